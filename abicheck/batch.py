@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Batch mode: check many binaries in one invocation.
+
+The packages of the union of the sonames all binaries need are resolved,
+downloaded, extracted and dumped once by a shared checker; then every
+binary gets its own dependency closure, symbol filtered comparison and
+report, in parallel, and the batch an index report linking them.
+With --quick, the binaries failing the symbol binding precheck are left
+out of the header based check and listed as incompatible in the index.
+"""
+import logging
+import os
+from concurrent import futures
+
+from abicheck import binhandler, crawler, pipeline, report, utils
+
+INDEX_HTML_FILE = "index.html"
+SHARED_DIR = "shared"
+
+
+def collect_binaries(path):
+    """Return the binaries and shared objects of a directory tree, a copy
+    of the same build-id once, or the files listed in a manifest file, one
+    path per line.
+    """
+    if os.path.isdir(path):
+        return [
+            obj.path
+            for obj in crawler.crawl(path)
+            if obj.type in crawler.CHECKED_TYPES
+        ]
+
+    binfiles = list()
+
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                binfiles.append(os.path.join(base, line))
+    return binfiles
+
+
+class SharedABI(binhandler.ABI):
+    """The checker doing the package and dump work of a whole batch.
+
+    Its required sonames are the union of those of the batch; closures are
+    resolved per binary, so the chains skip them here.
+    """
+
+    def gen_old_dep_closure(self):
+        pass
+
+    def gen_new_dep_closure(self):
+        pass
+
+
+class BatchChecker(object):
+    """The check of binfiles, configured by opts; all checkers share the
+    chroots of workspace.
+    """
+
+    def __init__(self, opts, workspace, binfiles, output_dir=None):
+        self.logger = logging.getLogger(__name__)
+        self.opts = opts
+        self.workspace = workspace
+        self.binfiles = list(dict.fromkeys(os.path.abspath(f) for f in binfiles))
+        self.output_dir = output_dir or opts.output_dir
+        self.checkers = list()
+        # checkers of the binaries failing the symbol binding precheck
+        self.quick_failed = list()
+        self.shared = None
+
+    def _report_dirs(self):
+        """Return a report directory name per binary, unique in the batch."""
+        names = list()
+        seen = dict()
+        for binfile in self.binfiles:
+            name = os.path.basename(binfile)
+            seen[name] = seen.get(name, 0) + 1
+            if seen[name] > 1:
+                name = f"{name}.{seen[name]}"
+            names.append(name)
+        return names
+
+    def prepare(self):
+        """Read the ELF information of every binary and return the shared
+        checker, whose chains then run once for the whole batch.
+        """
+        self.logger.info(f"Checking a batch of {len(self.binfiles)} binaries ...")
+        for binfile, name in zip(self.binfiles, self._report_dirs()):
+            output_dir = os.path.join(self.output_dir, name)
+            utils.mkdir_p(output_dir)
+            checker = binhandler.ABI(self.opts, self.workspace, binfile, output_dir)
+            checker.gen_elf_info()
+            checker.gen_ldd_info()
+            checker.gen_soname_file()
+            self.checkers.append(checker)
+
+        shared_dir = os.path.join(self.output_dir, SHARED_DIR)
+        utils.mkdir_p(shared_dir)
+        self.shared = SharedABI(
+            self.opts, self.workspace, self.binfiles[0], shared_dir
+        )
+        self._require_union()
+        return self.shared
+
+    def _require_union(self):
+        self.shared.required_sonames = list(
+            dict.fromkeys(
+                soname
+                for checker in self.checkers
+                for soname in checker.required_sonames
+            )
+        )
+        self.logger.info(
+            f"The batch requires {len(self.shared.required_sonames)} libraries."
+        )
+
+    def quick_check(self):
+        """Run the symbol binding precheck of every binary in a chroot of
+        the libraries of the whole batch, and leave only the binaries
+        passing it to the full check. Return True if any is left.
+        """
+        self.shared.gen_new_quick_chroot()
+        passed = list()
+        for checker in self.checkers:
+            if checker.quick_check():
+                passed.append(checker)
+            else:
+                self.quick_failed.append(checker)
+        self.logger.info(
+            f"{len(passed)} of {len(self.checkers)} binaries passed the"
+            " symbol binding check."
+        )
+        self.checkers = passed
+        if passed:
+            self._require_union()
+        return bool(passed)
+
+    def _check_binary(self, checker):
+        checker.adopt(self.shared)
+        pipeline.run_stage(checker, "gen_old_dep_closure")
+        pipeline.run_stage(checker, "gen_new_dep_closure")
+        pipeline.run_stage(checker, "report")
+        return checker.library_results
+
+    def finish(self, jobs=None):
+        """Compare and report every binary in parallel, then write the
+        index report of the batch. Return its path.
+        """
+        entries = list()
+        with futures.ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+            jobs = [
+                executor.submit(self._check_binary, checker)
+                for checker in self.checkers
+            ]
+            for checker, job in zip(self.checkers, jobs):
+                name = os.path.basename(checker.output_dir)
+                try:
+                    results = job.result()
+                except Exception as e:  # pylint: disable=W0703
+                    self.logger.warning(f"Failed to check {checker.binfile}: {e}")
+                    entries.append((checker.binfile, None, []))
+                    continue
+                entries.append(
+                    (
+                        checker.binfile,
+                        f"{name}/{checker.EXPORT_HTML_FILE}",
+                        results,
+                    )
+                )
+
+        quick_failed = [
+            (
+                checker.binfile,
+                f"{os.path.basename(checker.output_dir)}/{checker.QUICK_FILE}",
+                checker.quick_result.summary(),
+            )
+            for checker in self.quick_failed
+        ]
+        html_file = os.path.join(self.output_dir, INDEX_HTML_FILE)
+        report.write_batch_index(
+            html_file,
+            f"{self.shared.old_os_full_name} to {self.shared.new_os_full_name}"
+            f" compatibility of {len(self.binfiles)} binaries",
+            entries,
+            quick_failed,
+        )
+        self.logger.info(f"The check result is {os.path.abspath(html_file)}")
+        return html_file
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Symbol binding simulation.
+
+Checks the way ld.so does at load time that the version requirements of a
+binary are met by its dependency closure inside a chroot and that every
+undefined function finds a matching definition, from the exported .dynsym
+and version definitions alone. This takes seconds where the header based
+abi-compliance-checker analysis takes minutes.
+"""
+import logging
+
+from abicheck import elf
+
+FUNC_TYPES = (elf.STT_FUNC, elf.STT_GNU_IFUNC)
+
+
+class Exports(object):
+    """The version definitions and defined dynamic symbols of an object."""
+
+    def __init__(self, path):
+        self.versions = set()
+        # {name: [(version or None, hidden)]}
+        self.symbols = dict()
+        with elf.ELFFile(path) as f:
+            for name, flags in f.version_defs().values():
+                if not flags & elf.VER_FLG_BASE:
+                    self.versions.add(name)
+            for sym in f.dynamic_symbols():
+                if sym.defined and sym.bind != elf.STB_LOCAL:
+                    self.symbols.setdefault(sym.name, []).append(
+                        (sym.version, sym.hidden)
+                    )
+
+    def defines(self, name, version=None):
+        """Return True if a reference to name@version binds here.
+
+        Like ld.so, an unversioned definition satisfies a versioned
+        reference, and hidden (non-default) versions only exact ones.
+        """
+        for defined_version, hidden in self.symbols.get(name, ()):
+            if version is not None and defined_version == version:
+                return True
+            if not hidden and (version is None or defined_version is None):
+                return True
+        return False
+
+
+class BindingResult(object):
+    """What would fail to bind when the binary is loaded."""
+
+    def __init__(self, binfile):
+        self.binfile = binfile
+        self.missing_sonames = list()
+        # [(file, version)] version requirements no loaded object defines
+        self.missing_versions = list()
+        # ["name@version"] undefined functions without a definition
+        self.missing_symbols = list()
+        self.bound = 0
+        self.weak_unbound = 0
+        # {"name@version": [(soname, package)]} of the missing symbols
+        self.providers = dict()
+
+    @property
+    def passed(self):
+        return not (self.missing_sonames or self.missing_versions or self.missing_symbols)
+
+    def summary(self):
+        return (
+            f"{self.bound} functions bound, {len(self.missing_symbols)} missing,"
+            f" {len(self.missing_versions)} missing versions,"
+            f" {len(self.missing_sonames)} unresolved libraries"
+        )
+
+    def lines(self):
+        """Return the result as the lines of the quick check report."""
+        lines = [f"Binary: {self.binfile}", f"Result: {'PASS' if self.passed else 'FAIL'}"]
+        lines.append(f"Summary: {self.summary()}")
+        lines += [f"Unresolved library: {soname}" for soname in self.missing_sonames]
+        lines += [
+            f"Missing version: {version} (required from {file})"
+            for file, version in self.missing_versions
+        ]
+        for symbol in self.missing_symbols:
+            providers = ", ".join(
+                f"{package} ({soname})" for soname, package in self.providers.get(symbol, ())
+            )
+            lines.append(
+                f"Missing symbol: {symbol}"
+                + (f" provided by {providers}" if providers else "")
+            )
+        return lines
+
+
+def simulate(binfile, graph, resolver):
+    """Simulate binding the undefined functions of binfile.
+
+    graph is the DependencyGraph of binfile resolved by resolver; its
+    objects are searched in load order, as the global scope of ld.so.
+    """
+    loggerinst = logging.getLogger(__name__)
+    result = BindingResult(binfile)
+    result.missing_sonames = graph.missing_sonames()
+
+    scope = list()
+    by_name = dict()
+    for path, info in graph.objects.items():
+        if info is graph.root:
+            continue
+        try:
+            exports = Exports(resolver.host_path(path))
+        except (OSError, elf.ELFError) as e:
+            loggerinst.debug(f"Can not read the symbols of {path}: {e}")
+            continue
+        scope.append(exports)
+        for name in (info.soname, graph.names.get(path)):
+            if name:
+                by_name.setdefault(name, exports)
+
+    with elf.ELFFile(binfile) as f:
+        references = [
+            sym for sym in f.dynamic_symbols() if not sym.defined and sym.name
+        ]
+
+    checked = set()
+    for sym in references:
+        if sym.version is not None and sym.file and (sym.file, sym.version) not in checked:
+            checked.add((sym.file, sym.version))
+            exports = by_name.get(sym.file)
+            if exports is not None and sym.version not in exports.versions:
+                result.missing_versions.append((sym.file, sym.version))
+
+        if sym.type not in FUNC_TYPES:
+            continue
+        if any(exports.defines(sym.name, sym.version) for exports in scope):
+            result.bound += 1
+        elif sym.bind == elf.STB_WEAK:
+            result.weak_unbound += 1
+        else:
+            name = sym.name + (f"@{sym.version}" if sym.version else "")
+            result.missing_symbols.append(name)
+    return result
@@ -1,40 +1,66 @@
+import collections
 import logging
 import os
 import platform
 import re
-import shutil
 
 import distro
 
-from abicheck import utils
-from abicheck.toolopts import tool_opts
+from abicheck import (
+    binding,
+    deltadb,
+    dumpcache,
+    elf,
+    ldso,
+    metacache,
+    planner,
+    repo,
+    report,
+    rpmfile,
+    store,
+    symindex,
+    toolopts,
+    utils,
+    workspace,
+)
 
 ABI_CC = "abi-compliance-checker"
 ABI_DUMPER = "abi-dumper"
-READELF = "eu-readelf"
-LDD = "ldd"
-RPM2CPIO = "rpm2cpio"
 DOT = "dot"
 CONVERT = "convert"
 
 
 class ABI:
-    def __init__(self):
+    """The check of one binary, configured by the ToolOpts opts, with its
+    rpm files and chroots in the Workspace workspace.
+    """
+
+    def __init__(self, opts, workspace, binfile=None, output_dir=None, release=None):
         self.logger = logging.getLogger(__name__)
-        self.output_dir = tool_opts.output_dir
+        self.opts = opts
+        self.workspace = workspace
+        self.output_dir = output_dir or opts.output_dir
 
-        self.binfile = os.path.abspath(tool_opts.binfile)
+        self.binfile = os.path.abspath(binfile or opts.binfile)
         self.basename = os.path.basename(self.binfile)
         self.arch = platform.machine()
 
         self.READELF_FILE = f"OLD_{self.basename}_readelf.info"
         self.LDD_FILE = f"OLD_{self.basename}_ldd.info"
         self.required_sonames = []
+        # list like  [ "EVP_DigestUpdate@OPENSSL_1_1_0" ]
+        self.func_dynsym_list = []
+        # elf.DynamicSymbols the binary imports
+        self.undefined_symbols = []
+        self.dep_graph = None
 
-        self.old_os_full_name = tool_opts.old_os_full_name
+        self.old_os_full_name = release or opts.old_os_full_name
         self.OLD_XML_FILE = f"OLD_{self.basename}.xml"
-        self.OLD_DUMP_FILE = f"OLD_{self.basename}.dump"
-        self.OLD_ABICC_LOG = f"{self.basename}_{self.old_os_full_name}.log"
+        self.OLD_DUMP_DIR = f"dumps/{self.old_os_full_name}"
+        # {soname: (NEVRA, dump path)} of the old OS libraries
+        self.old_library_dumps = dict()
+        self.OLD_LDD_FILE = f"{self.basename}_{self.old_os_full_name}_ldd.info"
+        self.old_dep_graph = None
 
         self.FUNC_DYNSYM_FILE = f"OLD_{self.basename}_func_dynsym.info"
         self.FUNC_DYNSYM_NAME_FILE = f"OLD_{self.basename}_func_dynsym_name.info"
@@ -42,33 +68,40 @@ class ABI:
         self.old_required_rpm_pkgs = []
         self.old_required_rpm_devel_pkgs = []
         self.old_required_rpm_libs_pkgs = []
-        self.old_dnf_conf = tool_opts.old_dnf_conf
-        self.old_all_pkgs_list = utils.dnf_list(self.old_dnf_conf, self.arch)
-        self.old_rpm_downloaddir = (
-            f"{utils.TMP_DIR}/{self.old_os_full_name}/{self.arch}/Packages"
+        self.old_dnf_conf = opts.old_dnf_conf
+        if release:
+            self.old_dnf_conf = toolopts.release_dnf_conf(release)
+        self.old_repo = repo.get_session(
+            self.old_dnf_conf, self.arch, refresh=opts.refresh
         )
-        self.old_rpm_cpiodir = (
-            f"{utils.TMP_DIR}/{self.old_os_full_name}/{self.arch}/chroot"
+        self.old_all_pkgs_list = set(self.old_repo.package_names())
+        self.old_rpm_downloaddir = workspace.downloaddir(
+            self.old_os_full_name, self.arch
         )
+        self.old_rpm_cpiodir = workspace.chroot(self.old_os_full_name, self.arch)
 
         self.new_os_full_name = f"{distro.id()}_{distro.major_version()}"
         self.NEW_XML_FILE = f"NEW_{self.basename}.xml"
-        self.NEW_DUMP_FILE = f"NEW_{self.basename}.dump"
-        self.NEW_ABICC_LOG = f"{self.basename}_{self.new_os_full_name}.log"
+        self.NEW_DUMP_DIR = f"dumps/{self.new_os_full_name}"
+        self.new_library_dumps = dict()
+        self.NEW_LDD_FILE = f"{self.basename}_{self.new_os_full_name}_ldd.info"
+        self.new_dep_graph = None
+        self.QUICK_FILE = f"{self.basename}_{self.new_os_full_name}_quick.info"
+        self.quick_result = None
         self.new_required_rpm_pkgs = []
         self.new_required_rpm_devel_pkgs = []
         self.new_required_rpm_libs_pkgs = []
-        self.new_dnf_conf = "/etc/dnf/dnf.conf"
-        self.new_all_pkgs_list = utils.dnf_list(self.new_dnf_conf, self.arch)
-        self.new_rpm_downloaddir = (
-            f"{utils.TMP_DIR}/{self.new_os_full_name}/{self.arch}/Packages"
+        self.new_dnf_conf = opts.new_dnf_conf
+        self.new_repo = repo.get_session(
+            self.new_dnf_conf, self.arch, refresh=opts.refresh
         )
-        self.new_rpm_cpiodir = (
-            f"{utils.TMP_DIR}/{self.new_os_full_name}/{self.arch}/chroot"
-        )
-        self.DIFF_ABICC_LOG = (
-            f"{self.basename}_{self.old_os_full_name}_{self.new_os_full_name}.log"
+        self.new_all_pkgs_list = set(self.new_repo.package_names())
+        self.new_rpm_downloaddir = workspace.downloaddir(
+            self.new_os_full_name, self.arch
         )
+        self.new_rpm_cpiodir = workspace.chroot(self.new_os_full_name, self.arch)
+        self.REPORT_DIR = "reports"
+        self.library_results = []
         self.EXPORT_HTML_FILE = "export.html"
 
         self.OLD_SO_DOT_FILE = f"{self.basename}_{self.old_os_full_name}_so.dot"
@@ -77,51 +110,63 @@ class ABI:
         self.OLD_RPM_PNG_FILE = f"{self.basename}_{self.old_os_full_name}_rpm.png"
         self.so_dep_rpm_dict = dict()
         self.NOTFOUND = "Not Found"
+        # {soname: [package]} suggested for the sonames not found
+        self.suggested_rpm_dict = dict()
+        self.symbol_index = symindex.get_index(self.new_os_full_name)
+
+        # {soname: (old NEVRA, new NEVRA, pair)} of the library pairs found
+        # in the delta database, which are neither dumped nor compared
+        self.delta_pairs = dict()
+        self.delta_db = None if opts.no_deltas else deltadb.get_db()
+
+        self.store = store.get_store(opts.store_quota)
+        self.dump_cache = dumpcache.get_cache()
+        # PackageFiles of the packages stored for each side
+        self.old_package_files = []
+        self.new_package_files = []
 
     def gen_elf_info(self):
         self.logger.info(f"Checking ELF information of file {self.binfile} ...")
-        output, _ = utils.run_subprocess(
-            f"{READELF} -s {self.binfile}", print_output=False
-        )
+        try:
+            with elf.ELFFile(self.binfile) as f:
+                self.func_dynsym_list = f.versioned_func_symbols()
+                self.undefined_symbols = [
+                    sym for sym in f.dynamic_symbols() if not sym.defined and sym.name
+                ]
+                info = [
+                    f"Type: {f.elf_type}",
+                    f"Class: ELF{32 if f.elfclass == elf.ELFCLASS32 else 64}",
+                    f"Machine: {f.machine_name}",
+                    f"Interpreter: {f.interpreter or ''}",
+                    f"Build ID: {f.build_id or ''}",
+                    f"SONAME: {f.soname or ''}",
+                    f"NEEDED: {' '.join(f.needed)}",
+                    f"RPATH: {':'.join(f.rpath)}",
+                    f"RUNPATH: {':'.join(f.runpath)}",
+                ]
+        except (OSError, elf.ELFError) as e:
+            self.logger.critical(f"Can not read ELF file {self.binfile}: {e}")
 
         output_file = os.path.join(self.output_dir, self.READELF_FILE)
-        utils.store_content_to_file(output_file, output)
+        utils.store_content_to_file(output_file, info + self.func_dynsym_list)
 
     def gen_ldd_info(self):
         self.logger.info(f"Checking ldd information of file {self.binfile} ...")
-        output, _ = utils.run_subprocess(f"{LDD} {self.binfile}", print_output=False)
+        # as ldd did, with the libraries the caller points LD_LIBRARY_PATH to
+        resolver = ldso.LibraryResolver(ld_library_path=ldso.env_library_path())
+        self.dep_graph = resolver.resolve(self.binfile)
 
         output_file = os.path.join(self.output_dir, self.LDD_FILE)
-        utils.store_content_to_file(output_file, output)
+        utils.store_content_to_file(output_file, self.dep_graph.ldd_lines())
 
     def gen_soname_file(self):
         self.logger.info("Checking package dependencies ...")
-        # list like  [ "EVP_DigestUpdate@OPENSSL_1_1_0" ]
-        func_dynsym_list = list()
+        func_dynsym_list = self.func_dynsym_list
+        symbols = [elf.split_symbol(symbol) for symbol in func_dynsym_list]
         # list like [ "EVP_DigestUpdate" ]
-        func_dynsym_name_list = list()
+        func_dynsym_name_list = list(dict.fromkeys(name for name, _ in symbols))
         # list lke [ "OPENSSL_1_1_0" ]
-        func_dynsym_ver_list = list()
-        elf_file = os.path.join(self.output_dir, self.READELF_FILE)
-        elf_text = utils.get_file_content(elf_file, as_list=True)
-        elf_symbol_fmt = (
-            " *(?P<num>[0-9]*): (?P<value>[0-9abcdef]*) (?P<size>[0-9]*).*(FUNC).*@.*"
-        )
-
-        for line in elf_text:
-            m = re.match(elf_symbol_fmt, line)
-            if not m:
-                continue
-            elf_line_list = re.split(r"\s+", line)
-            if elf_line_list[7] not in func_dynsym_list:
-                func_dynsym_list.append(elf_line_list[7])
-
-            sym = elf_line_list[7].split("@")
-            if sym[0] not in func_dynsym_name_list:
-                func_dynsym_name_list.append(sym[0])
-
-            if sym[1] not in func_dynsym_ver_list:
-                func_dynsym_ver_list.append(sym[1])
+        func_dynsym_ver_list = list(dict.fromkeys(ver for _, ver in symbols))
 
         output_file = os.path.join(self.output_dir, self.FUNC_DYNSYM_FILE)
         self.logger.info(f"Writing file {output_file} ...")
@@ -135,27 +180,51 @@ class ABI:
         self.logger.info(f"Writing file {output_file} ...")
         utils.store_content_to_file(output_file, func_dynsym_ver_list)
 
-        ldd_file = os.path.join(self.output_dir, self.LDD_FILE)
-        ldd_text = utils.get_file_content(ldd_file, as_list=True)
-
-        soname_file_list = list()
-        for line in ldd_text:
-            if not re.match(".*=>.*", line):
-                continue
-            soname = line.strip().split(" ")[0]
-            if soname not in soname_file_list:
-                soname_file_list.append(soname)
-        self.required_sonames = soname_file_list
+        soname_file_list = self.dep_graph.needed_sonames()
+        self.gen_runtime_sonames(soname_file_list)
+        self.required_sonames = soname_file_list + self.dep_graph.runtime_sonames()
         self.logger.debug(
             f"The list of dynamic libraries that the {self.binfile}"
             f" binary requires is {self.required_sonames}."
         )
 
+    def gen_runtime_sonames(self, needed):
+        """Add the libraries the binary names in its read-only data, and so
+        likely loads with dlopen(), as runtime edges of the dependency graph.
+
+        Only the sonames the new OS ships are kept, per the symbol index or
+        else the new OS repos, as the others are mostly text.
+        """
+        root = self.dep_graph.root
+        candidates = [
+            soname
+            for soname in ldso.dlopen_candidates(self.binfile)
+            if soname not in needed and root is not None and soname != root.soname
+        ]
+        if not candidates:
+            return
+        if self.symbol_index is not None:
+            sonames = [
+                soname
+                for soname in candidates
+                if self.symbol_index.soname_providers(soname)
+            ]
+        else:
+            so_pkgs = self.new_repo.resolve_sonames(candidates)
+            sonames = [soname for soname in candidates if so_pkgs[soname]]
+        resolver = ldso.LibraryResolver(ld_library_path=ldso.env_library_path())
+        for soname in sonames:
+            self.dep_graph.add_runtime_edge(soname, resolver.find(soname, root))
+        if sonames:
+            self.logger.info(
+                f"{self.binfile} names the libraries {sonames}, checked as"
+                " loaded at run time."
+            )
+
     def get_old_os_main_pkgs(self):
+        so_pkgs = self.old_repo.resolve_sonames(self.required_sonames)
         for soname in self.required_sonames:
-            pkgs = utils.dnf_provides(
-                self.old_dnf_conf, f"*{str(soname)}*", arch=self.arch
-            )
+            pkgs = so_pkgs[soname]
             if pkgs:
                 pkg = pkgs[0]
             else:
@@ -168,15 +237,14 @@ class ABI:
         )
 
     def get_new_os_main_pkgs(self):
+        so_pkgs = self.new_repo.resolve_sonames(self.required_sonames)
         for soname in self.required_sonames:
-
-            pkgs = utils.dnf_provides(
-                "/etc/dnf/dnf.conf", f"*{str(soname)}*", arch=self.arch
-            )
+            pkgs = so_pkgs[soname]
             if pkgs:
                 pkg = pkgs[0]
             else:
                 self.so_dep_rpm_dict[f"{str(soname)}"] = [f"{self.NOTFOUND}"]
+                self.suggest_new_pkgs(soname)
                 continue
             self.so_dep_rpm_dict[f"{str(soname)}"] = pkgs
             if pkg and pkg not in self.new_required_rpm_pkgs:
@@ -186,6 +254,86 @@ class ABI:
             f" binary requires is {self.new_required_rpm_pkgs}."
         )
 
+    def suggest_new_pkgs(self, soname):
+        """Look up the new OS packages shipping soname in the symbol index,
+        or else those defining the symbols the binary needs from it.
+        """
+        if self.symbol_index is None:
+            return []
+        pkgs = self.symbol_index.soname_providers(soname)
+        if not pkgs:
+            counts = collections.Counter()
+            for sym in self.undefined_symbols:
+                if sym.file == soname:
+                    counts.update(
+                        set(
+                            pkg
+                            for _, pkg in self.symbol_index.symbol_providers(
+                                sym.name, sym.version
+                            )
+                        )
+                    )
+            pkgs = [pkg for pkg, _ in counts.most_common()]
+        if pkgs:
+            self.suggested_rpm_dict[soname] = pkgs
+            self.logger.info(
+                f"{soname} is not found in {self.new_os_full_name},"
+                f" the symbol index suggests the packages {pkgs}."
+            )
+        return pkgs
+
+    def lookup_deltas(self):
+        """Find the library pairs of the required sonames in the delta
+        database. Return True if it has all pairs there are to compare.
+        """
+        self.delta_pairs = dict()
+        if self.delta_db is None:
+            return False
+        old_pkgs = dict(
+            (soname, pkgs[0])
+            for soname, pkgs in self.old_repo.resolve_sonames(
+                self.required_sonames
+            ).items()
+            if pkgs
+        )
+        new_pkgs = dict(
+            (soname, pkgs[0])
+            for soname, pkgs in self.so_dep_rpm_dict.items()
+            if pkgs != [self.NOTFOUND]
+        )
+        old_nevras = self.old_repo.latest_nevras(set(old_pkgs.values()))
+        new_nevras = self.new_repo.latest_nevras(set(new_pkgs.values()))
+        # verdicts of an older abi-compliance-checker are not trusted
+        version = dumpcache.tool_version()
+        missing = list()
+        for soname in self.required_sonames:
+            old = old_nevras.get(old_pkgs.get(soname))
+            new = new_nevras.get(new_pkgs.get(soname))
+            if not (old and new):
+                continue
+            pair = self.delta_db.pair(soname, old, new, version)
+            if pair is None:
+                missing.append(soname)
+            else:
+                self.delta_pairs[soname] = (old, new, pair)
+        self.logger.info(
+            f"The delta database has {len(self.delta_pairs)} of the library"
+            f" pairs of {self.binfile}, {len(missing)} are compared in full."
+        )
+        if missing:
+            self.logger.debug(f"The pairs of {missing} are not in the delta database.")
+        return not missing
+
+    def _imports(self, soname):
+        """Return the [(name, version)] symbols the binary may import from
+        soname: those of its versions and the unversioned ones.
+        """
+        return [
+            (sym.name, sym.version or "")
+            for sym in self.undefined_symbols
+            if sym.file in (soname, None)
+        ]
+
     @staticmethod
     def _get_rpmname_without_libs(x):
         x = re.sub("-libs$", "", x).strip()
@@ -196,7 +344,7 @@ class ABI:
         for line in self.old_required_rpm_pkgs:
             name = self._get_rpmname_without_libs(line)
             devel_name = f"{name}-devel"
-            if devel_name in list(self.old_all_pkgs_list):
+            if devel_name in self.old_all_pkgs_list:
                 self.old_required_rpm_devel_pkgs.append(devel_name)
             devel_name = f"{name}-headers"
             if devel_name in self.old_all_pkgs_list:
@@ -264,97 +412,160 @@ class ABI:
             f" binary requires is {self.new_required_rpm_libs_pkgs}."
         )
 
-    def download_old_packages(self):
-        """Download rpm packages with dnf download command"""
-        if not os.path.exists(self.old_dnf_conf):
-            self.logger.critical(f"No such file {self.old_dnf_conf}, please check.")
-        if not os.path.exists(self.old_rpm_downloaddir):
-            utils.mkdir_p(self.old_rpm_downloaddir)
-        cmd = f"dnf -c {self.old_dnf_conf} download"
-        cmd += " --resolve --alldeps"
-        cmd += f" --arch {self.arch}"
-        cmd += f" --downloaddir {self.old_rpm_downloaddir}"
-        all_pkgs = self.old_required_rpm_pkgs + self.old_required_rpm_devel_pkgs
+    def _download_packages(self, session, lib_pkgs, devel_pkgs, downloaddir):
+        """Download the packages needed by the xml descriptor into downloaddir"""
         pkgs = ""
-        for pkg in all_pkgs:
+        for pkg in lib_pkgs + devel_pkgs:
             pkgs += f" {pkg}"
-        cmd = cmd + pkgs
         self.logger.info(
             "The program will automatically download"
-            f" packages {pkgs} to directory {self.old_rpm_downloaddir}."
+            f" packages {pkgs} to directory {downloaddir}."
         )
+        if self.opts.alldeps:
+            packages = session.package_files(
+                session.resolve_closure(lib_pkgs + devel_pkgs)
+            )
+        else:
+            # the full closure is only compared with when debugging
+            plan = planner.plan_downloads(
+                session, lib_pkgs, devel_pkgs, full_closure=self.opts.debug
+            )
+            self.logger.info(f"Download plan for {downloaddir}: {plan.summary()}.")
+            packages = plan.packages
+        files = self.store.fetch(packages, self.opts.download_jobs)
+        self.store.link_packages(files, downloaddir)
+        return files
 
-        utils.run_subprocess(cmd, print_cmd=True, print_output=True)
+    def download_old_packages(self):
+        """Download rpm packages from the old OS repos"""
+        if not os.path.exists(self.old_dnf_conf):
+            self.logger.critical(f"No such file {self.old_dnf_conf}, please check.")
+        self.old_package_files = self._download_packages(
+            self.old_repo,
+            self.old_required_rpm_pkgs,
+            self.old_required_rpm_devel_pkgs,
+            self.old_rpm_downloaddir,
+        )
 
     def download_new_packages(self):
-        """Download rpm packages with dnf download command"""
+        """Download rpm packages from the new OS repos"""
         if not os.path.exists(self.new_dnf_conf):
             self.logger.critical(f"No such file {self.new_dnf_conf}, please check.")
-        if not os.path.exists(self.new_rpm_downloaddir):
-            utils.mkdir_p(self.new_rpm_downloaddir)
-        cmd = f"dnf -c {self.new_dnf_conf} download"
-        cmd += " --resolve --alldeps"
-        cmd += f" --arch {self.arch}"
-        cmd += f" --downloaddir {self.new_rpm_downloaddir}"
-        all_pkgs = self.new_required_rpm_pkgs + self.new_required_rpm_devel_pkgs
-        all_pkgs += self.new_required_rpm_libs_pkgs
-        pkgs = ""
-        for pkg in all_pkgs:
-            pkgs += f" {pkg}"
-        cmd = cmd + pkgs
-        self.logger.info(
-            "The program will automatically download"
-            f"packages {pkgs} to directory {self.new_rpm_downloaddir}"
+        self.new_package_files = self._download_packages(
+            self.new_repo,
+            self.new_required_rpm_pkgs + self.new_required_rpm_libs_pkgs,
+            self.new_required_rpm_devel_pkgs,
+            self.new_rpm_downloaddir,
         )
-        utils.run_subprocess(cmd, print_cmd=True, print_output=True)
-
-    def decompress_old_packages(self):
-        src = self.old_rpm_downloaddir
-        dst = self.old_rpm_cpiodir
-        if not os.listdir(src):
-            self.logger.critical(f"Can not find rpm packages in" f" {src}.")
-        if not os.path.exists(dst):
-            utils.mkdir_p(dst)
 
-        # pushd dest dir
-        cwd = os.getcwd()
-        os.chdir(dst)
-
-        for parent, _, filenames in os.walk(src):
-            filenames[:] = (f for f in filenames if f.endswith(".rpm"))
+    def _decompress_packages(self, files, dst):
+        """Assemble the chroot dst from the stored trees of the packages"""
+        if not files:
+            self.logger.critical(f"No rpm packages to decompress into {dst}.")
 
         self.logger.info(f"Decompressing packages to {dst} ...")
-        for filename in filenames:
-            filename = os.path.join(parent, filename)
-            cmd = f"rpm2cpio {filename} | cpio -dim"
-            utils.run_cmd(cmd, print_cmd=False)
-        self.logger.info(f"Decompression completed.")
-        # popd dest dir
-        os.chdir(cwd)
+        self.store.extract(files, rpmfile.ABIFilter())
+        count = self.store.assemble(files, dst)
+        self.store.evict(self.opts.store_quota, self.workspace.started)
+        self.logger.info(
+            f"Decompression completed, {count} files"
+            f" linked from {len(files)} packages."
+        )
+
+    def decompress_old_packages(self):
+        self._decompress_packages(self.old_package_files, self.old_rpm_cpiodir)
 
     def decompress_new_packages(self):
-        src = self.new_rpm_downloaddir
-        dst = self.new_rpm_cpiodir
-        if not os.listdir(src):
-            self.logger.critical(f"Can not find rpm packages in" f" {src}.")
-        if not os.path.exists(dst):
-            utils.mkdir_p(dst)
+        self._decompress_packages(self.new_package_files, self.new_rpm_cpiodir)
+
+    def _gen_dep_closure(self, sysroot, ldd_file):
+        graph = ldso.LibraryResolver(sysroot).resolve(self.binfile, host_root=True)
+        output_file = os.path.join(self.output_dir, ldd_file)
+        utils.store_content_to_file(output_file, graph.ldd_lines())
+        missing = graph.missing_sonames()
+        if missing:
+            self.logger.info(
+                f"The libraries {missing} required by {self.binfile}"
+                f" can not be resolved in {sysroot}."
+            )
+        return graph
 
-        # pushd dest dir
-        cwd = os.getcwd()
-        os.chdir(dst)
+    def gen_old_dep_closure(self):
+        """Resolve the binary's dependency closure inside the old OS chroot"""
+        self.old_dep_graph = self._gen_dep_closure(
+            self.old_rpm_cpiodir, self.OLD_LDD_FILE
+        )
 
-        for parent, _, filenames in os.walk(src):
-            filenames[:] = (f for f in filenames if f.endswith(".rpm"))
+    def gen_new_dep_closure(self):
+        """Resolve the binary's dependency closure inside the new OS chroot"""
+        self.new_dep_graph = self._gen_dep_closure(
+            self.new_rpm_cpiodir, self.NEW_LDD_FILE
+        )
 
-        self.logger.info(f"Decompressing packages to {dst} ...")
-        for filename in filenames:
-            filename = os.path.join(parent, filename)
-            cmd = f"rpm2cpio {filename} | cpio -dim"
-            utils.run_cmd(cmd, print_cmd=False)
-        self.logger.info(f"Decompression completed.")
-        # popd dest dir
-        os.chdir(cwd)
+    def gen_new_quick_chroot(self):
+        """Assemble a new OS chroot of only the library packages of the
+        binary's dependency closure, for the symbol binding precheck.
+
+        The sonames the packages of one round still miss are looked up in
+        the next one, until all are found or none can be.
+        """
+        sonames = list(self.required_sonames)
+        looked_up = set()
+        pkgs = []
+        while sonames:
+            looked_up.update(sonames)
+            so_pkgs = self.new_repo.resolve_sonames(sonames)
+            added = list(
+                dict.fromkeys(
+                    found[0]
+                    for found in so_pkgs.values()
+                    if found and found[0] not in pkgs
+                )
+            )
+            if not added:
+                break
+            pkgs += added
+            files = self._download_packages(
+                self.new_repo, pkgs, [], self.new_rpm_downloaddir
+            )
+            self._decompress_packages(files, self.new_rpm_cpiodir)
+            graph = ldso.LibraryResolver(self.new_rpm_cpiodir).resolve(
+                self.binfile, host_root=True
+            )
+            sonames = [s for s in graph.missing_sonames() if s not in looked_up]
+
+    def quick_check(self):
+        """Simulate the symbol binding of the binary inside the new OS
+        chroot, write the QUICK_FILE and return True if nothing is missing.
+        """
+        self.logger.info(f"Checking symbol binding of {self.binfile} ...")
+        resolver = ldso.LibraryResolver(self.new_rpm_cpiodir)
+        graph = resolver.resolve(self.binfile, host_root=True)
+        try:
+            result = binding.simulate(self.binfile, graph, resolver)
+        except (OSError, elf.ELFError) as e:
+            self.logger.critical(f"Can not read ELF file {self.binfile}: {e}")
+        self.quick_result = result
+        if self.symbol_index is not None:
+            for symbol in result.missing_symbols:
+                name, version = elf.split_symbol(symbol)
+                result.providers[symbol] = self.symbol_index.symbol_providers(
+                    name, version or None
+                )
+
+        output_file = os.path.join(self.output_dir, self.QUICK_FILE)
+        self.logger.info(f"Writing file {output_file} ...")
+        utils.store_content_to_file(output_file, result.lines())
+        if result.passed:
+            self.logger.info(
+                f"{self.binfile} binds in {self.new_os_full_name}: {result.summary()}."
+            )
+        else:
+            self.logger.warning(
+                f"{self.binfile} does not bind in {self.new_os_full_name}:"
+                f" {result.summary()}, see {os.path.abspath(output_file)}."
+            )
+        return result.passed
 
     @staticmethod
     def _gen_xml(
@@ -371,48 +582,48 @@ class ABI:
         loggerinst = logging.getLogger(__name__)
         loggerinst.info(f"Generating xml file {file}")
 
-        header_file_list = list()
-        libs_file_list = list()
-        for pkg in dev_pkgs:
-            cmd = f"rpm -ql"
-            if installed:
-                cmd += f" {pkg}"
-            else:
-                cmd += f" -p {rpm_dir}/{pkg}*"
-            cmd += " |grep .*include.*\.h$"
-            returncode, stdout, _ = utils.run_cmd(cmd, print_cmd=False)
-            if returncode == 0 and stdout:
-                for line in stdout.decode().strip("\n").split("\n"):
-                    header_file_list.append(sysroot + line + "\n")
-
-        for soname in required_soname:
-            for pkg in libs_pkgs:
-                cmd = f"rpm -ql"
-                if installed:
-                    cmd += f" {pkg}"
-                else:
-                    cmd += f" -p {rpm_dir}/{pkg}*"
-                cmd += f"| grep {soname}$"
-                returncode, stdout, _ = utils.run_cmd(cmd, print_cmd=False)
-
-                if returncode == 0 and stdout:
-                    for line in stdout.decode().rstrip("\n").split("\n"):
-                        libs_file_list.append(sysroot + line + "\n")
+        if installed:
+            index = rpmfile.FileListIndex.from_installed(dev_pkgs + libs_pkgs)
+        else:
+            index = rpmfile.FileListIndex.from_rpm_dir(rpm_dir)
+        header_file_list = [sysroot + path for path in index.headers(dev_pkgs)]
+        libs_file_list = [
+            sysroot + path for path in index.libraries(libs_pkgs, required_soname)
+        ]
 
         loggerinst.info(f"Finish generating the xml {file}")
 
-        with open(file, "w") as f:
-            f.write("<version>\n")
-            f.write(f"{os_version}\n")
-            f.write("</version>\n")
-
-            f.write("<headers>\n")
-            f.writelines(header_file_list)
-            f.write("</headers>\n")
-
-            f.write("<libs>\n")
-            f.writelines(libs_file_list)
-            f.write("</libs>\n")
+        _write_xml(file, os_version, header_file_list, libs_file_list)
+
+    def adopt(self, shared):
+        """Take over the library dumps and package lookups a batch made once
+        for the union of the sonames of all its binaries.
+        """
+        self.old_library_dumps = shared.old_library_dumps
+        self.new_library_dumps = shared.new_library_dumps
+        self.old_package_files = shared.old_package_files
+        self.new_package_files = shared.new_package_files
+        self.so_dep_rpm_dict = dict(
+            (soname, shared.so_dep_rpm_dict[soname])
+            for soname in self.required_sonames
+            if soname in shared.so_dep_rpm_dict
+        )
+        for soname, pkgs in self.so_dep_rpm_dict.items():
+            if pkgs == [self.NOTFOUND]:
+                self.suggest_new_pkgs(soname)
+
+    def adopt_new_side(self, other):
+        """Take over the new OS results of a checker of another release,
+        the new OS side being the same for every release.
+        """
+        self.new_required_rpm_pkgs = other.new_required_rpm_pkgs
+        self.new_required_rpm_devel_pkgs = other.new_required_rpm_devel_pkgs
+        self.new_required_rpm_libs_pkgs = other.new_required_rpm_libs_pkgs
+        self.new_package_files = other.new_package_files
+        self.new_dep_graph = other.new_dep_graph
+        self.new_library_dumps = other.new_library_dumps
+        self.so_dep_rpm_dict = other.so_dep_rpm_dict
+        self.suggested_rpm_dict = other.suggested_rpm_dict
 
     def gen_old_xml(self):
         file = os.path.join(self.output_dir, self.OLD_XML_FILE)
@@ -466,46 +677,154 @@ class ABI:
         utils.run_cmd(cmd, print_cmd=True)
         loggerinst.info(f"Finish generating dump file {dump}")
 
-    def gen_old_dump(self):
+    def _gen_library_dumps(
+        self, os_version, dev_pkgs, libs_pkgs, rpm_dir, sysroot, dump_dir
+    ):
+        """Dump every required library on its own, reusing the cached dumps.
+
+        Return {soname: (NEVRA, dump path)}.
+        """
+        index = rpmfile.FileListIndex.from_rpm_dir(rpm_dir)
+        version = dumpcache.tool_version()
+        workdir = os.path.join(self.output_dir, dump_dir)
+        utils.mkdir_p(workdir)
+        dumps = dict()
+        for soname, pkg, path in index.owners(libs_pkgs, self.required_sonames):
+            if soname in dumps or soname in self.delta_pairs:
+                continue
+            name = self._get_rpmname_without_libs(pkg)
+            devel_pkgs = [
+                p for p in (f"{name}-devel", f"{name}-headers") if p in dev_pkgs
+            ]
+            # libraries without their own headers get all of the side's
+            headers = index.headers(devel_pkgs or dev_pkgs)
+            if not headers:
+                self.logger.warning(f"No headers to dump {soname} of {pkg} with.")
+                continue
 
-        name = self.basename
-        num = self.old_os_full_name
-        xml_file = os.path.join(self.output_dir, self.OLD_XML_FILE)
-        dump_file = os.path.join(self.output_dir, self.OLD_DUMP_FILE)
-        log_file = os.path.join(self.output_dir, self.OLD_ABICC_LOG)
+            nevra = index.nevras[pkg]
+            key = dumpcache.dump_key(
+                soname, nevra, dumpcache.header_hash(headers, sysroot), version
+            )
+            dump = self.dump_cache.lookup(key)
+            if dump is not None:
+                self.logger.info(f"Reusing the cached dump of {soname} from {nevra}")
+            else:
+                xml_file = os.path.join(workdir, f"{soname}.xml")
+                dump_file = os.path.join(workdir, f"{soname}.dump")
+                log_file = os.path.join(workdir, f"{soname}.log")
+                _write_xml(
+                    xml_file,
+                    os_version,
+                    [sysroot + header for header in headers],
+                    [sysroot + path],
+                )
+                self._gen_dump(soname, os_version, xml_file, dump_file, log_file)
+                if not os.path.isfile(dump_file):
+                    self.logger.warning(f"Failed to dump {soname}, see {log_file}.")
+                    continue
+                dump = self.dump_cache.add(key, soname, nevra, dump_file)
+            dumps[soname] = (nevra, dump)
+        self.dump_cache.evict(since=self.workspace.started)
+        return dumps
 
-        self._gen_dump(name, num, xml_file, dump_file, log_file)
+    def gen_old_dump(self):
+        self.old_library_dumps = self._gen_library_dumps(
+            self.old_os_full_name,
+            self.old_required_rpm_devel_pkgs,
+            self.old_required_rpm_pkgs,
+            self.old_rpm_downloaddir,
+            self.old_rpm_cpiodir,
+            self.OLD_DUMP_DIR,
+        )
 
     def gen_new_dump(self):
-
-        name = self.basename
-        num = self.new_os_full_name
-        xml_file = os.path.join(self.output_dir, self.NEW_XML_FILE)
-        dump_file = os.path.join(self.output_dir, self.NEW_DUMP_FILE)
-        log_file = os.path.join(self.output_dir, self.NEW_ABICC_LOG)
-
-        self._gen_dump(name, num, xml_file, dump_file, log_file)
+        self.new_library_dumps = self._gen_library_dumps(
+            self.new_os_full_name,
+            self.new_required_rpm_devel_pkgs,
+            self.new_required_rpm_pkgs + self.new_required_rpm_libs_pkgs,
+            self.new_rpm_downloaddir,
+            self.new_rpm_cpiodir,
+            self.NEW_DUMP_DIR,
+        )
 
     def diff_dump(self):
-        name = self.basename
-        new_dump = os.path.join(self.output_dir, self.NEW_DUMP_FILE)
-
-        old_dump = os.path.join(self.output_dir, self.OLD_DUMP_FILE)
-        log_file = os.path.join(self.output_dir, self.DIFF_ABICC_LOG)
+        """Compare the dumps library by library and index the reports"""
         sym_list = os.path.join(self.output_dir, self.FUNC_DYNSYM_NAME_FILE)
-        html = os.path.join(self.output_dir, self.EXPORT_HTML_FILE)
+        report_dir = os.path.join(self.output_dir, self.REPORT_DIR)
+        utils.mkdir_p(report_dir)
 
-        self.logger.info(f"Comparing dump file {old_dump} and {new_dump} ...")
-        cmd = f"{ABI_CC} -l {name}"
-        cmd += f" -old {old_dump}"
-        cmd += f" -new {new_dump}"
-        cmd += f" --symbols-list {sym_list}"
-        cmd += f" --report-path {html}"
-        cmd += f" -log-path {log_file}"
+        results = list()
+        for soname in self.required_sonames:
+            old = self.old_library_dumps.get(soname)
+            new = self.new_library_dumps.get(soname)
+            report_file = None
+            meta = dict()
+            if soname in self.delta_pairs:
+                old_nevra, new_nevra, _ = self.delta_pairs[soname]
+                # like the dumps, without a dump
+                old, new = (old_nevra, None), (new_nevra, None)
+                report_file = f"{self.REPORT_DIR}/{soname}.html"
+                meta = self._delta_report(
+                    soname, os.path.join(self.output_dir, report_file)
+                )
+            elif old and new:
+                report_file = f"{self.REPORT_DIR}/{soname}.html"
+                html = os.path.join(self.output_dir, report_file)
+                log_file = os.path.join(report_dir, f"{soname}.log")
+
+                self.logger.info(f"Comparing dump file {old[1]} and {new[1]} ...")
+                cmd = f"{ABI_CC} -l {soname}"
+                cmd += f" -old {old[1]}"
+                cmd += f" -new {new[1]}"
+                cmd += f" -v1 {self.old_os_full_name}"
+                cmd += f" -v2 {self.new_os_full_name}"
+                cmd += f" --symbols-list {sym_list}"
+                cmd += f" --report-path {html}"
+                cmd += f" -log-path {log_file}"
+                utils.run_cmd(cmd)
+                meta = report.parse_meta(html)
+                if not meta:
+                    report_file = None
+            results.append(
+                report.LibraryResult(
+                    soname, old and old[0], new and new[0], report_file, meta
+                )
+            )
+        self.library_results = results
 
-        utils.run_cmd(cmd)
+        html = os.path.join(self.output_dir, self.EXPORT_HTML_FILE)
+        report.write_library_index(
+            html,
+            f"{self.basename}: {self.old_os_full_name} to {self.new_os_full_name}"
+            " compatibility report",
+            results,
+            [
+                ("LibGraph", "Library Dependency", self.OLD_SO_PNG_FILE),
+                ("PkgGraph", "Package Dependency", self.OLD_RPM_PNG_FILE),
+            ],
+        )
         self.logger.info(f"Finished Comparison.")
 
+    def _delta_report(self, soname, html):
+        """Write the report of soname from the delta database, return its
+        meta data.
+        """
+        old_nevra, new_nevra, pair = self.delta_pairs[soname]
+        used, verdicts = self.delta_db.lookup(pair, self._imports(soname))
+        self.logger.info(
+            f"{soname}: {len(verdicts)} of the {len(used)} symbols used changed"
+            " according to the delta database."
+        )
+        report.write_delta_report(
+            html,
+            f"{soname}: {old_nevra} to {new_nevra}",
+            used,
+            verdicts,
+            deltadb.BREAKING,
+        )
+        return report.parse_meta(html)
+
     def gen_soname_deppng(self):
 
         png_file = os.path.join(self.output_dir, self.OLD_SO_PNG_FILE)
@@ -540,7 +859,7 @@ class ABI:
 
             f.write(f"{node_attrs}\n")
 
-            _dep(f, file)
+            _dep(f, self.dep_graph)
             f.write("}\n")
 
         cmd = f"{DOT} -Tpng -o {png_file} {dot_file}"
@@ -588,13 +907,21 @@ class ABI:
                 )
                 f.write(f'i [shape=box, label="", width=0, height={ibox_h}];\n')
                 f.write(f'"{self.basename}":e -> i [arrowhead="none"];\n')
+            runtime = self.dep_graph.runtime_sonames() if self.dep_graph else []
             for so in self.required_sonames:
-                f.write(f'i -> "{so}":w;\n')
+                if so in runtime:
+                    f.write(f'i -> "{so}":w[style="dashed"];\n')
+                else:
+                    f.write(f'i -> "{so}":w;\n')
             for soname in self.so_dep_rpm_dict.keys():
                 for pkg in self.so_dep_rpm_dict[soname]:
                     if pkg == self.NOTFOUND:
                         f.write(f'"{self.NOTFOUND}"[fillcolor="red"];\n')
                         f.write(f'"{soname}" -> "{self.NOTFOUND}";\n')
+                        for suggested in self.suggested_rpm_dict.get(soname, []):
+                            f.write(
+                                f'"{soname}" -> "{suggested}.rpm"[style="dashed"];\n'
+                            )
                     else:
                         f.write(f'"{soname}" -> "{pkg}.rpm";\n')
             f.write("}\n")
@@ -605,61 +932,40 @@ class ABI:
         utils.run_subprocess(cmd, print_cmd=False, print_output=False)
         self.logger.info(f"The rpm run dependency graph {png_file} has been generated")
 
-    def add_deptab(self):
-
-        html_file = os.path.join(self.output_dir, self.EXPORT_HTML_FILE)
-        self.logger.info(f"Generating html file {html_file}")
-
-        substr = r"\n<a id='LibGraphID' href='#LibGraphTab' style='margin-left:3px' class='tab disabled'>"
-        substr += "Library<br/>Dependency</a>"
-        substr += r"\n<a id='PkgGraphID' href='#PkgGraphTab' style='margin-left:3px' class='tab disabled'>"
-        substr += "Package<br/>Dependency</a>"
-
-        str = "Source<br/>Compatibility</a>"
-        cmd = f"""sed -i "s@{str}@{str}{substr}@g" {html_file}"""
-        utils.run_subprocess(cmd, print_cmd=False, print_output=False)
-
-        substr = r"<div id='LibGraphTab' class='tab'>\n"
-        substr += f"<div style='text-align:center;vertical-align:middle;'>"
-        substr += f"<img style='margin: auto; max-width:90%; max-height: 90%; background-color: hsl(0, 0%, 100%)' src='{self.OLD_SO_PNG_FILE}'>"
-        substr += r"</div></div>\n"
-
-        substr += r"</div><div id='PkgGraphTab' class='tab'>\n"
-        substr += f"<div style='text-align:center;vertical-align:middle;'>"
-        substr += f"<img style='margin: auto; max-width:90%; max-height: 90%; background-color: hsl(0, 0%, 100%)' src='{self.OLD_RPM_PNG_FILE}'>"
-        substr += r"</div></div>\n"
-
-        str = "<div class='footer'"
-        cmd = f"""sed -i "s@{str}@{substr}{str}@g" {html_file}"""
-        utils.run_subprocess(cmd, print_cmd=False, print_output=False)
-
-        self.logger.info(f"Complete generation.")
-
     def show_html(self):
         html_file = os.path.join(self.output_dir, self.EXPORT_HTML_FILE)
         self.logger.info(f"The check result is {os.path.abspath(html_file)}")
 
     @staticmethod
-    def clean_cache():
-        cache_dir = '/tmp/abi-info-check-cache'
-        if os.path.exists(cache_dir):
-            shutil.rmtree(cache_dir)
-
-# get the libs prog depends on and write the results into opened file f
-analyzedlist = []
-
-
-def _dep(f, prog):
-    # one lib may be used by several users
-    if prog in analyzedlist:
-        return
-    else:
-        analyzedlist.append(prog)
-
-    pname = prog.split("/")[-1]
-    needed = os.popen("ldd " + prog)
-    neededso = re.findall(r"[>](.*?)[(]", needed.read())
-    for so in neededso:
-        if len(so.strip()) > 0:
-            f.write('"' + pname + '" -> "' + so.split("/")[-1] + '";\n')
-            _dep(f, so)
+    def clean_cache(quota=metacache.DEFAULT_QUOTA):
+        """Release the repo sessions, trim the metadata cache to quota and
+        remove the workspaces no check used for long.
+        """
+        repo.close_sessions()
+        metacache.get_cache().evict(quota)
+        workspace.evict()
+
+
+def _write_xml(file, os_version, headers, libs):
+    """Write an abi-compliance-checker xml descriptor"""
+    with open(file, "w") as f:
+        f.write("<version>\n")
+        f.write(f"{os_version}\n")
+        f.write("</version>\n")
+
+        f.write("<headers>\n")
+        f.writelines(header + "\n" for header in headers)
+        f.write("</headers>\n")
+
+        f.write("<libs>\n")
+        f.writelines(lib + "\n" for lib in libs)
+        f.write("</libs>\n")
+
+
+def _dep(f, graph):
+    """Write the library dependency edges of graph into the opened file f"""
+    for pname, so in graph.name_edges():
+        f.write('"' + pname + '" -> "' + so + '";\n')
+    # loaded with dlopen()
+    for pname, so in graph.runtime_name_edges():
+        f.write('"' + pname + '" -> "' + so + '"[style="dashed"];\n')
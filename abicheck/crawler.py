@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Inventory of the ELF files of an application tree.
+
+The tree is walked with os.scandir, whose directory entries already tell
+regular files and their inodes apart without a stat per file; hard links
+are read once. The headers of the candidates are read by a pool of
+threads, most of their time being spent waiting on the disk, and files
+sharing a GNU build-id are kept once as well, with the other copies
+recorded. The binaries and shared objects found are written to a manifest
+--batch reads, one path per line, their type, class, machine and
+DT_NEEDED sonames in a comment.
+"""
+import collections
+import logging
+import os
+from concurrent import futures
+
+from abicheck import elf
+
+MANIFEST_FILE = "manifest.txt"
+# object types the checker can check
+CHECKED_TYPES = ("EXEC", "DYN")
+# files read per thread at once
+CHUNK = 64
+
+# elfclass: 32 or 64, copies: the paths of the same build-id left out
+ElfObject = collections.namedtuple(
+    "ElfObject", "path type elfclass machine soname needed build_id copies"
+)
+
+
+def _candidates(root):
+    """Yield the regular files below root, each inode once, in a stable
+    order; symbolic links are not followed.
+    """
+    loggerinst = logging.getLogger(__name__)
+    seen = set()
+    dirs = [root]
+    while dirs:
+        parent = dirs.pop()
+        try:
+            device = os.stat(parent).st_dev
+            with os.scandir(parent) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            loggerinst.debug(f"Can not read the directory {parent}: {e}")
+            continue
+        subdirs = list()
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    inode = (device, entry.inode())
+                    if inode not in seen:
+                        seen.add(inode)
+                        yield entry.path
+            except OSError:
+                continue
+        dirs.extend(reversed(subdirs))
+
+
+def _read(path):
+    """Return the ElfObject of path, None if it is not an ELF file."""
+    try:
+        with open(path, "rb") as f:
+            if f.read(4) != b"\x7fELF":
+                return None
+        with elf.ELFFile(path) as f:
+            class_ = 64 if f.elfclass == elf.ELFCLASS64 else 32
+            if f.elf_type in CHECKED_TYPES:
+                soname, needed = f.soname, f.needed
+            else:
+                soname, needed = None, []
+            return ElfObject(
+                path, f.elf_type, class_, f.machine_name, soname, needed, f.build_id, []
+            )
+    except (OSError, elf.ELFError):
+        return None
+    except Exception as e:  # pylint: disable=W0703
+        # one malformed file must not end the inventory of the tree
+        logging.getLogger(__name__).debug(f"Can not read {path}: {e}")
+        return None
+
+
+def _read_chunk(paths):
+    return [_read(path) for path in paths]
+
+
+def _chunks(paths):
+    chunk = list()
+    for path in paths:
+        chunk.append(path)
+        if len(chunk) == CHUNK:
+            yield chunk
+            chunk = list()
+    if chunk:
+        yield chunk
+
+
+def crawl(root, jobs=None):
+    """Return the ElfObjects of the ELF files below root, in path order;
+    of the files sharing a build-id only the first is returned, the others
+    are its copies.
+    """
+    loggerinst = logging.getLogger(__name__)
+    if jobs is None:
+        jobs = min(32, (os.cpu_count() or 1) * 4)
+    objects = list()
+    by_build_id = dict()
+    with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for chunk in executor.map(_read_chunk, _chunks(_candidates(root))):
+            for obj in chunk:
+                if obj is None:
+                    continue
+                first = by_build_id.get(obj.build_id) if obj.build_id else None
+                if first is not None:
+                    first.copies.append(obj.path)
+                    continue
+                if obj.build_id:
+                    by_build_id[obj.build_id] = obj
+                objects.append(obj)
+    copies = sum(len(obj.copies) for obj in objects)
+    loggerinst.info(
+        f"Found {len(objects)} ELF files below {root}, and {copies} copies of them."
+    )
+    return objects
+
+
+def write_manifest(path, objects):
+    """Write the binaries and shared objects of objects as a manifest of
+    --batch, return the number of entries.
+    """
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("# path  # type class machine soname needed\n")
+        for obj in objects:
+            if obj.type not in CHECKED_TYPES:
+                continue
+            needed = ",".join(obj.needed) or "-"
+            f.write(
+                f"{os.path.abspath(obj.path)}  # {obj.type} {obj.elfclass}-bit"
+                f" {obj.machine} {obj.soname or '-'} {needed}\n"
+            )
+            count += 1
+    return count
+
+
+def inventory(root, output_dir, jobs=None):
+    """Write the manifest of the ELF files below root into output_dir,
+    return its path.
+    """
+    loggerinst = logging.getLogger(__name__)
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    count = write_manifest(path, crawl(root, jobs))
+    loggerinst.info(f"Wrote the {count} binaries and shared objects to {path}.")
+    return path
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Service mode.
+
+The daemon keeps a pool of worker processes whose repo sessions, indexes
+and caches stay loaded from one job to the next, and takes check jobs over
+the Unix socket SOCKET_PATH. A job is the command line of a check; it
+waits in a bounded queue for a free worker, its log messages are streamed
+back to the client while it runs, then its exit status and report paths.
+The CLI hands its checks over to a running daemon, so it neither imports
+dnf nor loads any repo metadata itself.
+
+Requests and replies are JSON objects, one per line:
+
+    {"op": "check", "argv": [...]}
+    {"event": "queued", "job": 1, "position": 0}
+    {"event": "started", "job": 1}
+    {"event": "log", "job": 1, "level": "INFO", "message": "..."}
+    {"event": "done", "job": 1, "status": 0, "reports": [...]}
+    {"event": "error", "message": "..."}
+"""
+import glob
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from concurrent import futures
+
+from abicheck import utils
+
+SOCKET_PATH = f"{utils.TMP_DIR}/abicheck.sock"
+# options whose value is a path, made absolute by the client as the
+# daemon runs the job from another directory
+PATH_OPTIONS = (
+    "-i",
+    "--input",
+    "-b",
+    "--batch",
+    "-o",
+    "--output-dir",
+    "--new-repo-conf",
+    "--index-mirror",
+    "--crawl",
+    "--build-deltas",
+)
+# values of PATH_OPTIONS that are not paths
+PATH_KEYWORDS = {"--build-deltas": ("all",)}
+DEFAULT_OUTPUT_DIR = "abi-info-export"
+
+# the event queue of a worker process, see _init_worker
+_events = None
+
+
+def _absolute(option, value, cwd):
+    if value in PATH_KEYWORDS.get(option, ()):
+        return value
+    return os.path.join(cwd, value)
+
+
+def absolute_args(argv, cwd):
+    """Return argv with the values of PATH_OPTIONS made absolute against
+    cwd, and the default output directory made explicit.
+
+    Values are taken in the forms "--opt value", "--opt=value",
+    "-o value", "-ovalue" and "-o=value".
+    """
+    result = list()
+    output_dir = False
+    args = iter(argv)
+    for arg in args:
+        if arg.startswith("--"):
+            option, sep, value = arg.partition("=")
+        else:
+            option, value = arg[:2], arg[2:]
+            sep = value[:1]
+            if value.startswith("="):
+                value = value[1:]
+        if option not in PATH_OPTIONS:
+            result.append(arg)
+            continue
+        if option in ("-o", "--output-dir"):
+            output_dir = True
+        if sep:
+            joiner = "=" if option.startswith("--") else ""
+            result.append(f"{option}{joiner}{_absolute(option, value, cwd)}")
+        else:
+            result.append(option)
+            value = next(args, None)
+            if value is not None:
+                result.append(_absolute(option, value, cwd))
+    if not output_dir:
+        result += ["--output-dir", os.path.join(cwd, DEFAULT_OUTPUT_DIR)]
+    return result
+
+
+def _send(conn, message):
+    conn.sendall(json.dumps(message).encode() + b"\n")
+
+
+def _messages(conn):
+    """Yield the JSON messages read from conn until it is closed."""
+    with conn.makefile("rb") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class _ProgressHandler(logging.Handler):
+    """Forward the log records of a job to the daemon."""
+
+    def __init__(self, job):
+        super().__init__(logging.INFO)
+        self.job = job
+        self.setFormatter(logging.Formatter("%(message)s"))
+
+    def emit(self, record):
+        try:
+            _events.put(
+                (
+                    self.job,
+                    {
+                        "event": "log",
+                        "level": record.levelname,
+                        "message": self.format(record),
+                    },
+                )
+            )
+        except Exception:  # pylint: disable=W0703
+            self.handleError(record)
+
+
+def _init_worker(events):
+    global _events  # pylint: disable=C0103
+    _events = events
+    # the daemon decides when its workers stop
+    import signal
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def run_job(job, argv):
+    """Run one check in a worker process and report its end to the daemon."""
+    from abicheck import metacache, profiler, repo, runner, toolopts, workspace
+
+    _events.put((job, {"event": "started"}))
+    # the worker outlives its jobs, so the caches keep what this one used
+    started = time.time()
+    opts = toolopts.ToolOpts()
+    profiler.reset()
+    logger = logging.getLogger("abicheck")
+    handler = _ProgressHandler(job)
+    logger.addHandler(handler)
+    status = 1
+    try:
+        toolopts.CLI().process_cli_options(argv, opts)
+        if opts.refresh:
+            repo.close_sessions()
+        status = runner.check(opts) or 0
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 1
+    except Exception as e:  # pylint: disable=W0703
+        # a failed job must not take the worker and its warm sessions down
+        logger.exception(f"The check failed: {e}")
+    finally:
+        logger.removeHandler(handler)
+    output_dir = os.path.abspath(opts.output_dir)
+    profiler.get_profiler().write(output_dir)
+    metacache.get_cache().evict(opts.metadata_quota, started)
+    workspace.evict()
+    reports = sorted(glob.glob(os.path.join(output_dir, "*.html")))
+    _events.put((job, {"event": "done", "status": status, "reports": reports}))
+
+
+class Daemon(object):
+    """Runs the jobs submitted on path with workers processes, keeping at
+    most queue_size more waiting.
+    """
+
+    def __init__(self, path=SOCKET_PATH, workers=1, queue_size=16):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.workers = workers
+        self.queue_size = queue_size
+        self._ids = itertools.count(1)
+        self._jobs = dict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._events = None
+        # workers are started from a fork server, not from this threaded
+        # process
+        self._context = multiprocessing.get_context("forkserver")
+
+    def _start_workers(self, broken=None):
+        """Start the worker pool, or a new one if broken is still the
+        current pool.
+        """
+        with self._lock:
+            if broken is not None and self._executor is not broken:
+                return
+            if broken is not None:
+                self.logger.warning("A worker died, starting new workers.")
+                broken.shutdown(wait=False, cancel_futures=True)
+            self._executor = futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=self._context,
+                initializer=_init_worker,
+                initargs=(self._events,),
+            )
+
+    def serve(self):
+        """Serve jobs until interrupted."""
+        if running(self.path):
+            self.logger.critical(f"A daemon is already listening on {self.path}.")
+        self._events = self._context.Queue()
+        self._start_workers()
+        threading.Thread(target=self._dispatch, daemon=True).start()
+
+        utils.mkdir_p(os.path.dirname(self.path))
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            # checks run as root, so only root may submit them; the socket
+            # is created without access for others
+            umask = os.umask(0o177)
+            try:
+                server.bind(self.path)
+            finally:
+                os.umask(umask)
+            server.listen()
+            self.logger.info(
+                f"Listening on {self.path} with {self.workers} workers"
+                f" and {self.queue_size} queued jobs at most."
+            )
+            while True:
+                conn, _ = server.accept()
+                threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+        finally:
+            server.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _serve(self, conn):
+        with conn:
+            try:
+                request = next(_messages(conn), None)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Bad request: {e}")
+                return
+            if request is None:
+                # a probe of running()
+                return
+            if request.get("op") != "check":
+                _send(conn, {"event": "error", "message": "unknown request"})
+                return
+            job = self._submit(conn, request.get("argv", []))
+            if job is not None:
+                job["finished"].wait()
+
+    def _submit(self, conn, argv):
+        """Queue a job replying on conn, return it or None if refused."""
+        with self._lock:
+            active = len(self._jobs)
+            if active >= self.workers + self.queue_size:
+                _send(conn, {"event": "error", "message": "the job queue is full"})
+                return None
+            number = next(self._ids)
+            job = {"conn": conn, "finished": threading.Event()}
+            self._jobs[number] = job
+            position = max(active - self.workers + 1, 0)
+        self.logger.info(f"Job {number}: {' '.join(argv)}")
+        self._reply(number, {"event": "queued", "position": position})
+        with self._lock:
+            executor = self._executor
+        try:
+            future = executor.submit(run_job, number, argv)
+        except futures.BrokenExecutor:
+            self._start_workers(executor)
+            with self._lock:
+                executor = self._executor
+            future = executor.submit(run_job, number, argv)
+        job["future"] = future
+        future.add_done_callback(
+            lambda future: self._crashed(number, future, executor)
+        )
+        return job
+
+    def _reply(self, number, message):
+        with self._lock:
+            job = self._jobs.get(number)
+        if job is None or job["conn"] is None:
+            return
+        message = dict(message, job=number)
+        try:
+            _send(job["conn"], message)
+        except OSError:
+            # the client went away, the job goes on unless still queued
+            job["conn"] = None
+            future = job.get("future")
+            if future is not None and future.cancel():
+                self._finish(number, 1)
+
+    def _finish(self, number, status):
+        with self._lock:
+            job = self._jobs.pop(number, None)
+        if job is not None:
+            self.logger.info(f"Job {number} finished with exit status {status}.")
+            job["finished"].set()
+
+    def _dispatch(self):
+        """Pass the events of the workers on to the clients of the jobs."""
+        while True:
+            number, message = self._events.get()
+            self._reply(number, message)
+            if message["event"] == "done":
+                self._finish(number, message["status"])
+
+    def _crashed(self, number, future, executor):
+        """Finish a job whose worker died before reporting its end, and
+        replace the pool it broke.
+        """
+        if future.cancelled() or future.exception() is None:
+            return
+        if isinstance(future.exception(), futures.BrokenExecutor):
+            self._start_workers(executor)
+        self._reply(
+            number,
+            {"event": "error", "message": f"the worker failed: {future.exception()}"},
+        )
+        self._finish(number, 1)
+
+
+def running(path=SOCKET_PATH):
+    """Return True if a daemon is listening on path."""
+    if not os.path.exists(path):
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        try:
+            conn.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def submit(argv, path=SOCKET_PATH):
+    """Run a check in the daemon, printing its progress, and return its
+    exit status.
+    """
+    loggerinst = logging.getLogger(__name__)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        try:
+            conn.connect(path)
+            _send(conn, {"op": "check", "argv": absolute_args(argv, os.getcwd())})
+            for message in _messages(conn):
+                event = message.get("event")
+                if event == "queued":
+                    loggerinst.info(
+                        f"Handed over to the daemon as job {message['job']},"
+                        f" {message['position']} jobs ahead."
+                    )
+                elif event == "log":
+                    print(message["message"], flush=True)
+                elif event == "error":
+                    loggerinst.error(f"The daemon failed the check: {message['message']}")
+                    return 1
+                elif event == "done":
+                    for report in message["reports"]:
+                        loggerinst.info(f"The check result is {report}")
+                    return message["status"]
+        except (OSError, ValueError) as e:
+            loggerinst.error(f"Lost the connection to the daemon: {e}")
+            return 1
+    loggerinst.error("The daemon closed the connection before the check finished.")
+    return 1
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Offline builder of the delta database.
+
+Per old release, a checker requiring the libraries to build the deltas of
+runs the chains like the shared checker of a batch: the packages of both
+sides are resolved, downloaded, extracted and dumped library by library,
+reusing the dump cache. Every library pair with a dump on both sides and
+not in the database yet is then compared once by abi-compliance-checker
+into an xml report, the symbols of both libraries are read from the
+chroots, and the verdicts of both go into the database.
+"""
+import logging
+import os
+
+from abicheck import (
+    binhandler,
+    deltadb,
+    dumpcache,
+    elf,
+    ldso,
+    rpmfile,
+    symindex,
+    utils,
+)
+
+DELTA_DIR = "deltas"
+
+
+def collect_sonames(spec, new_os_full_name):
+    """Return the sonames listed in the file spec, one per line, or with
+    spec "all" those of the symbol index of the new OS.
+    """
+    loggerinst = logging.getLogger(__name__)
+    if spec == "all":
+        sonames = symindex.indexed_sonames(new_os_full_name)
+        if not sonames:
+            loggerinst.critical(
+                f"No symbol index of {new_os_full_name} to take the sonames from,"
+                " build it with --index-mirror first."
+            )
+        return sonames
+    sonames = list()
+    with open(spec) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                sonames.append(line)
+    return list(dict.fromkeys(sonames))
+
+
+class DeltaABI(binhandler.ABI):
+    """The checker doing the package and dump work of the libraries of one
+    old release. There is no binary, so the chains skip the closures.
+    """
+
+    def __init__(self, opts, workspace, sonames, output_dir, release):
+        super().__init__(
+            opts, workspace, os.path.join(output_dir, DELTA_DIR), output_dir, release
+        )
+        self.required_sonames = list(sonames)
+
+    def gen_old_dep_closure(self):
+        pass
+
+    def gen_new_dep_closure(self):
+        pass
+
+
+def _library_paths(rpm_dir, sysroot, pkgs, sonames):
+    """Return {soname: host path} of the libraries of pkgs in sysroot."""
+    index = rpmfile.FileListIndex.from_rpm_dir(rpm_dir)
+    resolver = ldso.LibraryResolver(sysroot)
+    paths = dict()
+    for soname, _, path in index.owners(pkgs, sonames):
+        paths.setdefault(soname, resolver.host_path(resolver.realpath(path)))
+    return paths
+
+
+class DeltaBuilder(object):
+    """Adds the library pairs of DeltaABI checkers to the database db."""
+
+    def __init__(self, db):
+        self.logger = logging.getLogger(__name__)
+        self.db = db
+        self.added = 0
+
+    def _compare(self, checker, soname, old_dump, new_dump):
+        """Compare two dumps into an xml report, return its path."""
+        report_dir = os.path.join(checker.output_dir, checker.REPORT_DIR)
+        utils.mkdir_p(report_dir)
+        xml_file = os.path.join(report_dir, f"{soname}.xml")
+        log_file = os.path.join(report_dir, f"{soname}.log")
+        cmd = f"{binhandler.ABI_CC} -l {soname}"
+        cmd += f" -old {old_dump}"
+        cmd += f" -new {new_dump}"
+        cmd += " -binary -report-format xml"
+        cmd += f" --report-path {xml_file}"
+        cmd += f" -log-path {log_file}"
+        utils.run_cmd(cmd)
+        return xml_file
+
+    def add(self, checker):
+        """Compare and store the pairs of checker not in the database."""
+        version = dumpcache.tool_version()
+        old_paths = _library_paths(
+            checker.old_rpm_downloaddir,
+            checker.old_rpm_cpiodir,
+            checker.old_required_rpm_pkgs,
+            checker.required_sonames,
+        )
+        new_paths = _library_paths(
+            checker.new_rpm_downloaddir,
+            checker.new_rpm_cpiodir,
+            checker.new_required_rpm_pkgs + checker.new_required_rpm_libs_pkgs,
+            checker.required_sonames,
+        )
+        added = 0
+        for soname in checker.required_sonames:
+            if soname in checker.delta_pairs:
+                continue
+            old = checker.old_library_dumps.get(soname)
+            new = checker.new_library_dumps.get(soname)
+            if not (old and new and soname in old_paths and soname in new_paths):
+                continue
+            self.logger.info(f"Building the delta of {soname}: {old[0]} to {new[0]} ...")
+            xml_file = self._compare(checker, soname, old[1], new[1])
+            try:
+                old_exports = deltadb.exported_symbols(old_paths[soname])
+                new_exports = deltadb.exported_symbols(new_paths[soname])
+                nodes = deltadb.version_nodes(new_paths[soname])
+            except (OSError, elf.ELFError) as e:
+                self.logger.warning(f"Can not read the libraries of {soname}: {e}")
+                continue
+            verdicts = deltadb.elf_verdicts(old_exports, new_exports, nodes)
+            verdicts += deltadb.report_verdicts(xml_file)
+            self.db.add(soname, old[0], new[0], old_exports, verdicts, version)
+            added += 1
+        self.added += added
+        self.logger.info(
+            f"Added {added} library pairs of {checker.old_os_full_name}"
+            f" to the delta database, {len(checker.delta_pairs)} were there."
+        )
+        return added
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Database of the ABI differences between old and new OS libraries.
+
+Comparing the dumps of a library pair yields the same differences for
+every binary linking it, so an offline builder compares each (old library,
+new library) pair of the bundled releases once, and keeps the symbols the
+old library exports and the per-symbol verdicts in a sqlite database keyed
+by the soname and the NEVRAs of both packages. A check then looks up the
+pairs of the libraries its binary needs and joins their verdicts with the
+symbols the binary imports; abi-compliance-checker only runs for the pairs
+missing from the database.
+
+The verdicts are
+    removed              the new library does not define the symbol
+    version_dropped      the new library lacks the version node of the symbol
+    changed_signature    abi-compliance-checker reports a problem of the symbol
+    changed_type_layout  a type used by the symbol changed, per the checker
+"""
+import collections
+import logging
+import os
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+
+from abicheck import elf, symindex, utils
+
+DB_PATH = f"{utils.TMP_DIR}/deltas/deltas.sqlite"
+# severities abi-compliance-checker rates as breaking binary compatibility
+BREAKING = ("High", "Medium")
+# the symbol types the delta is computed for, those a binary can bind to
+EXPORTED_TYPES = symindex.INDEXED_TYPES
+# symbols looked up per query, below the SQLite host parameter limit
+CHUNK = 500
+
+_dbs = dict()
+_dbs_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pairs (
+    pair INTEGER PRIMARY KEY, soname TEXT, old_nevra TEXT, new_nevra TEXT,
+    tool_version TEXT, built REAL, UNIQUE (soname, old_nevra, new_nevra));
+CREATE TABLE IF NOT EXISTS exports (pair INTEGER, symbol TEXT, version TEXT);
+CREATE TABLE IF NOT EXISTS verdicts (
+    pair INTEGER, symbol TEXT, version TEXT, verdict TEXT, severity TEXT,
+    detail TEXT);
+CREATE INDEX IF NOT EXISTS exports_symbol ON exports (pair, symbol);
+CREATE INDEX IF NOT EXISTS verdicts_symbol ON verdicts (pair, symbol);
+"""
+
+# version: "" for an unversioned symbol or a verdict of every version,
+# severity: as abi-compliance-checker rates it, detail: free text
+Verdict = collections.namedtuple("Verdict", "symbol version verdict severity detail")
+
+
+def exported_symbols(path):
+    """Return {name: set of versions} of the symbols a library exports,
+    the version "" standing for an unversioned definition.
+    """
+    exports = dict()
+    with elf.ELFFile(path) as f:
+        for sym in f.dynamic_symbols():
+            if sym.defined and sym.bind != elf.STB_LOCAL and sym.type in EXPORTED_TYPES:
+                exports.setdefault(sym.name, set()).add(sym.version or "")
+    return exports
+
+
+def elf_verdicts(old_exports, new_exports, new_version_nodes):
+    """Return the removed and version_dropped Verdicts of the symbols of
+    old_exports missing from new_exports; new_version_nodes are the names
+    of the version definitions of the new library.
+    """
+    verdicts = list()
+    for name, versions in sorted(old_exports.items()):
+        new_versions = new_exports.get(name)
+        for version in sorted(versions):
+            if new_versions is None:
+                verdicts.append(Verdict(name, version, "removed", "High", ""))
+            elif version and version not in new_versions and "" not in new_versions:
+                if version not in new_version_nodes:
+                    verdicts.append(
+                        Verdict(
+                            name,
+                            version,
+                            "version_dropped",
+                            "High",
+                            f"no version node {version}",
+                        )
+                    )
+                else:
+                    verdicts.append(
+                        Verdict(
+                            name,
+                            version,
+                            "removed",
+                            "High",
+                            f"defined in {', '.join(sorted(new_versions))} only",
+                        )
+                    )
+    return verdicts
+
+
+def version_nodes(path):
+    """Return the names of the version definitions of a library."""
+    with elf.ELFFile(path) as f:
+        return set(name for name, _ in f.version_defs().values())
+
+
+def report_verdicts(path):
+    """Return the changed_signature and changed_type_layout Verdicts of an
+    xml report of abi-compliance-checker, [] if it can't be read.
+    """
+    loggerinst = logging.getLogger(__name__)
+    try:
+        root = ElementTree.parse(path).getroot()
+    except (OSError, ElementTree.ParseError) as e:
+        loggerinst.warning(f"Can not read the report {path}: {e}")
+        return []
+    verdicts = list()
+    for problems in root.iter("problems_with_symbols"):
+        severity = problems.get("severity", "")
+        for symbol in problems.iter("symbol"):
+            name, version = elf.split_symbol(symbol.get("name", ""))
+            ids = [problem.get("id", "") for problem in symbol.iter("problem")]
+            if name:
+                verdicts.append(
+                    Verdict(name, version, "changed_signature", severity, ", ".join(ids))
+                )
+    for problems in root.iter("problems_with_types"):
+        severity = problems.get("severity", "")
+        for type_ in problems.iter("type"):
+            ids = [problem.get("id", "") for problem in type_.iter("problem")]
+            detail = f"{type_.get('name', '')}: {', '.join(ids)}"
+            for affected in type_.iter("affected"):
+                for symbol in affected.iter("symbol"):
+                    name, version = elf.split_symbol(symbol.get("name", ""))
+                    if name:
+                        verdicts.append(
+                            Verdict(name, version, "changed_type_layout", severity, detail)
+                        )
+    return verdicts
+
+
+class DeltaDB(object):
+    """The delta database at path."""
+
+    def __init__(self, path=DB_PATH):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        utils.mkdir_p(os.path.dirname(path))
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        with self._lock, self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def pair(self, soname, old_nevra, new_nevra, tool_version=None):
+        """Return the id of a library pair, None if it is not known or,
+        with tool_version, was built with other tool versions.
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT pair, tool_version FROM pairs"
+                " WHERE soname = ? AND old_nevra = ? AND new_nevra = ?",
+                (soname, old_nevra, new_nevra),
+            ).fetchone()
+        if row is None or tool_version is not None and row[1] != tool_version:
+            return None
+        return row[0]
+
+    def add(self, soname, old_nevra, new_nevra, exports, verdicts, tool_version=""):
+        """Store a library pair, replacing an earlier build of it.
+
+        exports are the {name: set of versions} of the old library.
+        """
+        with self._lock, self.conn:
+            row = self.conn.execute(
+                "SELECT pair FROM pairs"
+                " WHERE soname = ? AND old_nevra = ? AND new_nevra = ?",
+                (soname, old_nevra, new_nevra),
+            ).fetchone()
+            if row:
+                for table in ("pairs", "exports", "verdicts"):
+                    self.conn.execute(f"DELETE FROM {table} WHERE pair = ?", row)
+            pair = self.conn.execute(
+                "INSERT INTO pairs (soname, old_nevra, new_nevra, tool_version, built)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (soname, old_nevra, new_nevra, tool_version, time.time()),
+            ).lastrowid
+            self.conn.executemany(
+                "INSERT INTO exports VALUES (?, ?, ?)",
+                (
+                    (pair, name, version)
+                    for name, versions in exports.items()
+                    for version in versions
+                ),
+            )
+            self.conn.executemany(
+                "INSERT INTO verdicts VALUES (?, ?, ?, ?, ?, ?)",
+                ((pair,) + tuple(verdict) for verdict in verdicts),
+            )
+        return pair
+
+    def _rows(self, sql, pair, names):
+        rows = list()
+        names = list(names)
+        with self._lock:
+            for i in range(0, len(names), CHUNK):
+                chunk = names[i : i + CHUNK]
+                rows += self.conn.execute(
+                    sql.format(", ".join("?" * len(chunk))), [pair] + chunk
+                ).fetchall()
+        return rows
+
+    def lookup(self, pair, imports):
+        """Join the verdicts of a pair with the [(name, version)] symbols a
+        binary imports, the version "" matching any.
+
+        Return the imports the old library exports, and the Verdicts
+        affecting them.
+        """
+        wanted = dict()
+        for name, version in imports:
+            wanted.setdefault(name, set()).add(version or "")
+
+        def matches(name, version):
+            versions = wanted[name]
+            return "" in versions or not version or version in versions
+
+        used = sorted(
+            (name, version)
+            for name, version in self._rows(
+                "SELECT symbol, version FROM exports"
+                " WHERE pair = ? AND symbol IN ({})",
+                pair,
+                wanted,
+            )
+            if matches(name, version)
+        )
+        verdicts = sorted(
+            Verdict(*row)
+            for row in self._rows(
+                "SELECT symbol, version, verdict, severity, detail FROM verdicts"
+                " WHERE pair = ? AND symbol IN ({})",
+                pair,
+                wanted,
+            )
+            if matches(row[0], row[1])
+        )
+        return used, verdicts
+
+
+def get_db(path=DB_PATH):
+    """Return the DeltaDB at path shared in this process, or None if no
+    database was built there.
+    """
+    with _dbs_lock:
+        if path not in _dbs:
+            _dbs[path] = DeltaDB(path) if os.path.exists(path) else None
+        return _dbs[path]
+
+
+def forget_db(path=DB_PATH):
+    """Drop the shared DeltaDB at path, e.g. after building it."""
+    with _dbs_lock:
+        db = _dbs.pop(path, None)
+    if db is not None:
+        db.close()
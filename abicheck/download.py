@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+In-process parallel package downloads.
+
+Packages are fetched over a pool of connections to the mirror, through
+the proxy and with the TLS settings of their repo, and verified against
+the checksum of the repo metadata. A verified copy already in the download
+directory is kept, and an interrupted download is resumed from its .part
+file when the server serves ranges; a lock file per package keeps
+processes sharing the directory from fetching it twice. Any url urllib can
+open works, so file:// and localhost repos are fine for testing.
+"""
+import collections
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+from concurrent import futures
+
+from abicheck import repoindex, utils
+
+DEFAULT_JOBS = 4
+RETRIES = 3
+CHUNK_SIZE = 1024 * 1024
+
+# url: where to fetch it, filename: the rpm file name in the download dir,
+# checksum_type: a hashlib name, checksum: the hex digest, transport: the
+# repoindex.Transport of its repo or None
+PackageFile = collections.namedtuple(
+    "PackageFile",
+    "name url filename checksum_type checksum size transport",
+    defaults=(None,),
+)
+
+
+class DownloadError(Exception):
+    """Raised when a package can not be fetched or fails verification."""
+
+
+def file_checksum(path, checksum_type):
+    """Return the hex digest of a file."""
+    digest = hashlib.new(checksum_type)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_verified(path, package):
+    """Return True if path holds the package with a matching checksum."""
+    if not os.path.isfile(path):
+        return False
+    if package.size and os.path.getsize(path) != package.size:
+        return False
+    return file_checksum(path, package.checksum_type) == package.checksum
+
+
+class PackageDownloader(object):
+    """Download packages into downloaddir with jobs parallel connections,
+    with by_checksum each into a directory named after its checksum.
+    """
+
+    def __init__(self, downloaddir, jobs=DEFAULT_JOBS, by_checksum=False):
+        self.logger = logging.getLogger(__name__)
+        self.downloaddir = downloaddir
+        self.jobs = max(1, jobs)
+        self.by_checksum = by_checksum
+
+    def path(self, package):
+        """Return where a package is downloaded to."""
+        if self.by_checksum:
+            return os.path.join(self.downloaddir, package.checksum, package.filename)
+        return os.path.join(self.downloaddir, package.filename)
+
+    def download(self, packages):
+        """Fetch packages, return the paths of the verified rpm files.
+
+        Packages that fail to download are logged and left out.
+        """
+        utils.mkdir_p(self.downloaddir)
+        paths = list()
+        todo = list()
+        for package in packages:
+            path = self.path(package)
+            utils.mkdir_p(os.path.dirname(path))
+            if is_verified(path, package):
+                self.logger.debug(f"{package.filename} already downloaded.")
+                paths.append(path)
+            else:
+                todo.append((package, path))
+
+        if todo:
+            self.logger.info(
+                f"Downloading {len(todo)} packages to {self.downloaddir}"
+                f" ({len(paths)} already present) ..."
+            )
+        with futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            jobs = dict(
+                (executor.submit(self._fetch, package, path), package)
+                for package, path in todo
+            )
+            for job in futures.as_completed(jobs):
+                package = jobs[job]
+                try:
+                    paths.append(job.result())
+                except DownloadError as e:
+                    self.logger.warning(str(e))
+                else:
+                    self.logger.info(f"Downloaded {package.filename}")
+        return paths
+
+    def _fetch(self, package, path):
+        utils.mkdir_p(os.path.dirname(path))
+        with utils.flock(f"{path}.lock", fcntl.LOCK_EX):
+            try:
+                # another process may have fetched it meanwhile
+                if is_verified(path, package):
+                    return path
+                return self._download(package, path)
+            finally:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(f"{path}.lock")
+
+    def _download(self, package, path):
+        part = path + ".part"
+        error = None
+        for _ in range(RETRIES):
+            digest = hashlib.new(package.checksum_type)
+            offset = os.path.getsize(part) if os.path.isfile(part) else 0
+            if package.size and offset >= package.size:
+                offset = 0
+            headers = {"Range": f"bytes={offset}-"} if offset else None
+            try:
+                with repoindex.open_url(package.url, headers, package.transport) as src:
+                    if offset and getattr(src, "status", None) == 206:
+                        with open(part, "rb") as f:
+                            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                                digest.update(chunk)
+                        mode = "ab"
+                    else:
+                        mode = "wb"
+                    with open(part, mode) as dst:
+                        for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                            digest.update(chunk)
+                            dst.write(chunk)
+            except OSError as e:
+                # the .part is kept to resume from
+                error = e
+                continue
+            if digest.hexdigest() != package.checksum:
+                error = "checksum mismatch"
+                os.remove(part)
+                continue
+            os.replace(part, path)
+            return path
+
+        raise DownloadError(f"Failed to download {package.url}: {error}")
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Persistent cache of per-library ABI dumps.
+
+The GCC based header analysis of abi-compliance-checker -dump is the most
+expensive stage, and most binaries link the same few libraries. Dumps are
+therefore made per library and kept under TMP_DIR/dumps, keyed by the
+soname, the NEVRA of the package shipping it, a hash of the header set and
+the versions of abi-compliance-checker and GCC. The least recently used
+dumps are evicted once the cache grows past its quota.
+"""
+import functools
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from abicheck import utils
+
+DUMP_DIR = f"{utils.TMP_DIR}/dumps"
+DEFAULT_QUOTA = 5 * 1024 * 1024 * 1024
+ABI_CC = "abi-compliance-checker"
+
+_cache = None
+_cache_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dumps (
+    key TEXT PRIMARY KEY, soname TEXT, nevra TEXT, size INTEGER,
+    last_used REAL);
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def tool_version():
+    """Return the abi-compliance-checker and GCC versions dumps depend on."""
+    versions = list()
+    for cmd in (f"{ABI_CC} -dumpversion", "gcc -dumpversion"):
+        _, stdout, _ = utils.run_cmd(cmd, print_cmd=False)
+        versions.append(stdout.decode().strip() if stdout else "")
+    return "/".join(versions)
+
+
+def header_hash(headers, sysroot=""):
+    """Return a hash of the paths and contents of the header files.
+
+    headers are paths inside sysroot, so that the same headers extracted
+    into different chroots hash alike.
+    """
+    digest = hashlib.sha256()
+    for header in sorted(headers):
+        digest.update(header.encode("utf-8", "surrogateescape") + b"\0")
+        try:
+            with open(sysroot + header, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        except OSError:
+            digest.update(b"missing")
+    return digest.hexdigest()
+
+
+def dump_key(soname, nevra, headers_hash, version):
+    """Return the cache key of the dump of a library."""
+    return hashlib.sha256(
+        "\0".join((soname, nevra, headers_hash, version)).encode()
+    ).hexdigest()
+
+
+class DumpCache(object):
+    """The dump cache at path, holding at most quota bytes (0 for no limit)
+    of dumps not used since the cache was opened.
+    """
+
+    def __init__(self, path=DUMP_DIR, quota=DEFAULT_QUOTA):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.quota = quota
+        self.opened = time.time()
+        utils.mkdir_p(path)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            os.path.join(path, "dumps.sqlite"), check_same_thread=False, timeout=60
+        )
+        with self._lock, self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def dump_path(self, key):
+        return os.path.join(self.path, key[:2], f"{key}.dump")
+
+    def lookup(self, key):
+        """Return the path of the cached dump of key, or None."""
+        path = self.dump_path(key)
+        with self._lock, self.conn:
+            row = self.conn.execute(
+                "SELECT key FROM dumps WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or not os.path.isfile(path):
+                return None
+            self.conn.execute(
+                "UPDATE dumps SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+        return path
+
+    def add(self, key, soname, nevra, dump):
+        """Move the freshly made dump file into the cache, return its path."""
+        path = self.dump_path(key)
+        utils.mkdir_p(os.path.dirname(path))
+        os.replace(dump, path)
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO dumps VALUES (?, ?, ?, ?, ?)",
+                (key, soname, nevra, os.path.getsize(path), time.time()),
+            )
+        return path
+
+    def evict(self, quota=None, since=None):
+        """Remove the least recently used dumps until the cache fits into
+        quota, its own by default. Dumps used since the time since, by
+        default since the cache was opened, are kept.
+        """
+        if quota is None:
+            quota = self.quota
+        if since is None:
+            since = self.opened
+        if not quota:
+            return
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT key, size, last_used FROM dumps ORDER BY last_used"
+            ).fetchall()
+        total = sum(size for _, size, _ in rows)
+        evicted = 0
+        for key, size, last_used in rows:
+            if total <= quota:
+                break
+            if last_used >= since:
+                continue
+            if os.path.exists(self.dump_path(key)):
+                os.remove(self.dump_path(key))
+            with self._lock, self.conn:
+                self.conn.execute("DELETE FROM dumps WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        if evicted:
+            self.logger.info(
+                f"Evicted {evicted} dumps from the dump cache,"
+                f" {utils.format_size(total)} left."
+            )
+
+
+def get_cache(quota=DEFAULT_QUOTA):
+    """Return the dump cache shared by the checkers of this process; its
+    quota is the one of the first call, evict() takes another.
+    """
+    global _cache  # pylint: disable=C0103
+    with _cache_lock:
+        if _cache is None:
+            _cache = DumpCache(quota=quota)
+    return _cache
@@ -0,0 +1,550 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+In-process ELF reader.
+
+The file is mmap'ed and only the structures the checker needs are decoded:
+the dynamic symbol table with its GNU symbol versioning, the dynamic section
+(DT_NEEDED, DT_SONAME, DT_RPATH, DT_RUNPATH), the program interpreter and the
+GNU build-id. Symbol tables are kept as compact arrays; names are decoded
+from the string table only when asked for.
+"""
+import array
+import collections
+import mmap
+import struct
+import sys
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+ET_REL = 1
+ET_EXEC = 2
+ET_DYN = 3
+ET_CORE = 4
+
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_DYNAMIC = 6
+SHT_NOTE = 7
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+SHT_GNU_VERDEF = 0x6FFFFFFD
+SHT_GNU_VERNEED = 0x6FFFFFFE
+SHT_GNU_VERSYM = 0x6FFFFFFF
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+PT_NOTE = 4
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_SONAME = 14
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+STB_LOCAL = 0
+STB_GLOBAL = 1
+STB_WEAK = 2
+STT_OBJECT = 1
+STT_FUNC = 2
+STT_GNU_IFUNC = 10
+
+SHN_UNDEF = 0
+NT_GNU_BUILD_ID = 3
+VERSYM_HIDDEN = 0x8000
+VERSYM_VERSION = 0x7FFF
+VER_FLG_BASE = 0x1
+
+ELF_TYPES = {ET_REL: "REL", ET_EXEC: "EXEC", ET_DYN: "DYN", ET_CORE: "CORE"}
+ELF_MACHINES = {
+    3: "i386",
+    8: "mips",
+    20: "ppc",
+    21: "ppc64",
+    22: "s390",
+    40: "arm",
+    62: "x86_64",
+    183: "aarch64",
+    243: "riscv",
+    258: "loongarch",
+}
+
+Section = collections.namedtuple(
+    "Section", "name type flags addr offset size link info addralign entsize"
+)
+Segment = collections.namedtuple("Segment", "type offset vaddr filesz")
+# version: the version name or None, hidden: a non-default version of a
+# definition, file: the object a reference expects the version from
+DynamicSymbol = collections.namedtuple(
+    "DynamicSymbol", "name type bind defined version hidden file"
+)
+
+
+class ELFError(Exception):
+    """Raised when a file is not a valid ELF object."""
+
+
+class SymbolTable(object):
+    """The entries of a symbol table, stored as parallel compact arrays."""
+
+    def __init__(self, elf, strtab_offset):
+        self._elf = elf
+        self._strtab = strtab_offset
+        self.name_offsets = array.array("I")
+        self.infos = array.array("B")
+        self.shndxs = array.array("H")
+        self.versyms = array.array("H")
+
+    def __len__(self):
+        return len(self.name_offsets)
+
+    def name(self, i):
+        return self._elf.cstring(self._strtab + self.name_offsets[i])
+
+    def type(self, i):
+        return self.infos[i] & 0xF
+
+    def bind(self, i):
+        return self.infos[i] >> 4
+
+    def is_defined(self, i):
+        return self.shndxs[i] != SHN_UNDEF
+
+    def versym(self, i):
+        if not self.versyms:
+            return 0
+        return self.versyms[i]
+
+
+class ELFFile(object):
+    """A mmap'ed ELF object; use it as a context manager or close() it."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # mmap refuses empty files
+            self._file.close()
+            raise ELFError(f"{path} is empty")
+        try:
+            self._parse_header()
+        except (struct.error, IndexError):
+            self.close()
+            raise ELFError(f"{path} is truncated")
+        except ELFError:
+            self.close()
+            raise
+        self._dynamic = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def _parse_header(self):
+        ident = self._map[:16]
+        if len(ident) < 16 or ident[:4] != b"\x7fELF":
+            raise ELFError(f"{self.path} is not an ELF file")
+        self.elfclass = ident[4]
+        self.data = ident[5]
+        if self.elfclass not in (ELFCLASS32, ELFCLASS64):
+            raise ELFError(f"{self.path} has an unknown ELF class")
+        if self.data not in (ELFDATA2LSB, ELFDATA2MSB):
+            raise ELFError(f"{self.path} has an unknown ELF data encoding")
+        self._endian = "<" if self.data == ELFDATA2LSB else ">"
+        self._swap = (self.data == ELFDATA2LSB) != (sys.byteorder == "little")
+
+        if self.elfclass == ELFCLASS64:
+            fmt = "HHIQQQIHHHHHH"
+        else:
+            fmt = "HHIIIIIHHHHHH"
+        (
+            self.type,
+            self.machine,
+            _,
+            self.entry,
+            phoff,
+            shoff,
+            _,
+            _,
+            phentsize,
+            phnum,
+            shentsize,
+            shnum,
+            shstrndx,
+        ) = self._unpack(fmt, 16)
+
+        self.segments = list()
+        phdr_fmt = "IIQQQQQQ" if self.elfclass == ELFCLASS64 else "IIIIIIII"
+        for i in range(phnum):
+            fields = self._unpack(phdr_fmt, phoff + i * phentsize)
+            if self.elfclass == ELFCLASS64:
+                p_type, _, p_offset, p_vaddr, _, p_filesz, _, _ = fields
+            else:
+                p_type, p_offset, p_vaddr, _, p_filesz, _, _, _ = fields
+            self.segments.append(Segment(p_type, p_offset, p_vaddr, p_filesz))
+
+        self.sections = list()
+        shdr_fmt = "IIQQQQIIQQ" if self.elfclass == ELFCLASS64 else "IIIIIIIIII"
+        raw = [self._unpack(shdr_fmt, shoff + i * shentsize) for i in range(shnum)]
+        if raw and shstrndx < len(raw):
+            names_offset = raw[shstrndx][4]
+        else:
+            names_offset = None
+        for fields in raw:
+            name = ""
+            if names_offset is not None:
+                name = self.cstring(names_offset + fields[0])
+            self.sections.append(Section(name, *fields[1:]))
+
+    def _unpack(self, fmt, offset):
+        try:
+            return struct.unpack_from(self._endian + fmt, self._map, offset)
+        except struct.error:
+            # a section or segment pointing past the end of the file
+            raise ELFError(f"{self.path} is truncated") from None
+
+    def _slice(self, offset, size):
+        """Return size bytes at file offset, which must be in the file."""
+        if offset + size > len(self._map):
+            raise ELFError(f"{self.path} is truncated")
+        return self._map[offset:offset + size]
+
+    def cstring(self, offset):
+        """Return the NUL terminated string at file offset."""
+        end = self._map.find(b"\0", offset)
+        if end < 0:
+            end = len(self._map)
+        return self._map[offset:end].decode("utf-8", "replace")
+
+    def section(self, name):
+        for section in self.sections:
+            if section.name == name:
+                return section
+        return None
+
+    def sections_of_type(self, sh_type):
+        return [s for s in self.sections if s.type == sh_type]
+
+    def vaddr_to_offset(self, vaddr):
+        """Map a virtual address to its file offset through the PT_LOADs."""
+        for segment in self.segments:
+            if segment.type == PT_LOAD and (
+                segment.vaddr <= vaddr < segment.vaddr + segment.filesz
+            ):
+                return vaddr - segment.vaddr + segment.offset
+        return None
+
+    @property
+    def elf_type(self):
+        """Return the object type as printed by readelf (EXEC, DYN, ...)."""
+        return ELF_TYPES.get(self.type, str(self.type))
+
+    @property
+    def machine_name(self):
+        """Return the architecture name of e_machine, or its number."""
+        return ELF_MACHINES.get(self.machine, str(self.machine))
+
+    @property
+    def interpreter(self):
+        for segment in self.segments:
+            if segment.type == PT_INTERP:
+                return self.cstring(segment.offset)
+        return None
+
+    def _read_dynamic(self):
+        entries = list()
+        dyn_sections = self.sections_of_type(SHT_DYNAMIC)
+        strtab = None
+        if dyn_sections:
+            offset, size = dyn_sections[0].offset, dyn_sections[0].size
+            link = dyn_sections[0].link
+            if link < len(self.sections):
+                strtab = self.sections[link].offset
+        else:
+            segments = [s for s in self.segments if s.type == PT_DYNAMIC]
+            if not segments:
+                return entries, None
+            offset, size = segments[0].offset, segments[0].filesz
+
+        fmt = "qQ" if self.elfclass == ELFCLASS64 else "iI"
+        entsize = struct.calcsize(fmt)
+        for pos in range(offset, offset + size - entsize + 1, entsize):
+            tag, val = self._unpack(fmt, pos)
+            if tag == DT_NULL:
+                break
+            entries.append((tag, val))
+        if strtab is None:
+            for tag, val in entries:
+                if tag == DT_STRTAB:
+                    strtab = self.vaddr_to_offset(val)
+        return entries, strtab
+
+    def _dynamic_strings(self, wanted_tag):
+        if self._dynamic is None:
+            self._dynamic = self._read_dynamic()
+        entries, strtab = self._dynamic
+        if strtab is None:
+            return []
+        return [self.cstring(strtab + val) for tag, val in entries if tag == wanted_tag]
+
+    @property
+    def needed(self):
+        """Return the DT_NEEDED sonames in link order."""
+        return self._dynamic_strings(DT_NEEDED)
+
+    @property
+    def soname(self):
+        sonames = self._dynamic_strings(DT_SONAME)
+        return sonames[0] if sonames else None
+
+    @property
+    def rpath(self):
+        """Return the DT_RPATH directories."""
+        return _split_path_list(self._dynamic_strings(DT_RPATH))
+
+    @property
+    def runpath(self):
+        """Return the DT_RUNPATH directories."""
+        return _split_path_list(self._dynamic_strings(DT_RUNPATH))
+
+    @property
+    def build_id(self):
+        """Return the GNU build-id as a hex string, or None."""
+        notes = [(s.offset, s.size) for s in self.sections_of_type(SHT_NOTE)]
+        if not notes:
+            notes = [(s.offset, s.filesz) for s in self.segments if s.type == PT_NOTE]
+        for offset, size in notes:
+            pos, end = offset, offset + size
+            while pos + 12 <= end:
+                namesz, descsz, note_type = self._unpack("III", pos)
+                name_pos = pos + 12
+                desc_pos = name_pos + _align4(namesz)
+                name = self._map[name_pos:name_pos + namesz]
+                if note_type == NT_GNU_BUILD_ID and name == b"GNU\0":
+                    return self._map[desc_pos:desc_pos + descsz].hex()
+                pos = desc_pos + _align4(descsz)
+        return None
+
+    def rodata_strings(self, needle, max_len=4096):
+        """Yield the NUL terminated strings of the read-only data sections
+        that contain needle and are at most max_len bytes long.
+
+        Every byte is looked at no more than twice, so the time is linear
+        in the size of the sections whatever their content.
+        """
+        for section in self.sections:
+            if section.type == SHT_NOBITS or not (
+                section.name == ".rodata" or section.name.startswith(".rodata.")
+            ):
+                continue
+            pos, end = section.offset, min(section.offset + section.size, len(self._map))
+            while pos < end:
+                hit = self._map.find(needle, pos, end)
+                if hit < 0:
+                    break
+                first = self._map.rfind(b"\0", pos, hit) + 1 or pos
+                last = self._map.find(b"\0", hit, end)
+                if last < 0:
+                    last = end
+                if last - first <= max_len:
+                    yield self._map[first:last]
+                pos = last + 1
+
+    def symbols(self, sh_type=SHT_DYNSYM):
+        """Return the SymbolTable of the first section of sh_type, or None."""
+        sections = self.sections_of_type(sh_type)
+        if not sections:
+            return None
+        section = sections[0]
+        if section.link >= len(self.sections):
+            return None
+        table = SymbolTable(self, self.sections[section.link].offset)
+
+        if self.elfclass == ELFCLASS64:
+            fmt, name_i, info_i, shndx_i = "IBBHQQ", 0, 1, 3
+        else:
+            fmt, name_i, info_i, shndx_i = "IIIBBH", 0, 3, 5
+        fmt = self._endian + fmt
+        entsize = struct.calcsize(fmt)
+        count = section.size // entsize
+        data = self._slice(section.offset, count * entsize)
+        for fields in struct.iter_unpack(fmt, data):
+            table.name_offsets.append(fields[name_i])
+            table.infos.append(fields[info_i])
+            table.shndxs.append(fields[shndx_i])
+
+        if sh_type == SHT_DYNSYM:
+            versym = self.sections_of_type(SHT_GNU_VERSYM)
+            if versym:
+                table.versyms.frombytes(self._slice(versym[0].offset, count * 2))
+                if self._swap:
+                    table.versyms.byteswap()
+        return table
+
+    def version_needs(self):
+        """Return {version index: (version name, needed file)}."""
+        result = dict()
+        for section in self.sections_of_type(SHT_GNU_VERNEED):
+            if section.link >= len(self.sections):
+                continue
+            strtab = self.sections[section.link].offset
+            pos = section.offset
+            for _ in range(section.info):
+                _, vn_cnt, vn_file, vn_aux, vn_next = self._unpack("HHIII", pos)
+                filename = self.cstring(strtab + vn_file)
+                aux = pos + vn_aux
+                for _ in range(vn_cnt):
+                    _, _, vna_other, vna_name, vna_next = self._unpack("IHHII", aux)
+                    result[vna_other] = (self.cstring(strtab + vna_name), filename)
+                    if not vna_next:
+                        break
+                    aux += vna_next
+                if not vn_next:
+                    break
+                pos += vn_next
+        return result
+
+    def version_defs(self):
+        """Return {version index: (version name, vd_flags)}."""
+        result = dict()
+        for section in self.sections_of_type(SHT_GNU_VERDEF):
+            if section.link >= len(self.sections):
+                continue
+            strtab = self.sections[section.link].offset
+            pos = section.offset
+            for _ in range(section.info):
+                _, vd_flags, vd_ndx, _, _, vd_aux, vd_next = self._unpack(
+                    "HHHHIII", pos
+                )
+                vda_name, _ = self._unpack("II", pos + vd_aux)
+                result[vd_ndx] = (self.cstring(strtab + vda_name), vd_flags)
+                if not vd_next:
+                    break
+                pos += vd_next
+        return result
+
+    def symbol_version(self, table, i, needs=None, defs=None):
+        """Return the "@VER"/"@@VER" suffix eu-readelf prints for a symbol."""
+        versym = table.versym(i)
+        index = versym & VERSYM_VERSION
+        if index <= 1:
+            return ""
+        needs = self.version_needs() if needs is None else needs
+        defs = self.version_defs() if defs is None else defs
+        if not table.is_defined(i) and index in needs:
+            return "@" + needs[index][0]
+        if index in defs:
+            return ("@" if versym & VERSYM_HIDDEN else "@@") + defs[index][0]
+        if index in needs:
+            return "@" + needs[index][0]
+        return ""
+
+    def dynamic_symbols(self):
+        """Return the DynamicSymbols of .dynsym, without the null symbol."""
+        table = self.symbols(SHT_DYNSYM)
+        if table is None:
+            return []
+        needs, defs = self.version_needs(), self.version_defs()
+        result = list()
+        for i in range(1, len(table)):
+            versym = table.versym(i)
+            index = versym & VERSYM_VERSION
+            defined = table.is_defined(i)
+            version = file = None
+            if index > 1:
+                if not defined and index in needs:
+                    version, file = needs[index]
+                elif index in defs:
+                    version = defs[index][0]
+                elif index in needs:
+                    version, file = needs[index]
+            result.append(
+                DynamicSymbol(
+                    table.name(i),
+                    table.type(i),
+                    table.bind(i),
+                    defined,
+                    version,
+                    bool(versym & VERSYM_HIDDEN),
+                    file,
+                )
+            )
+        return result
+
+    def versioned_func_symbols(self):
+        """Return the versioned FUNC symbols, e.g. "EVP_DigestUpdate@OPENSSL_1_1_0".
+
+        This is what the "FUNC ... name@version" lines of eu-readelf -s list:
+        versioned .dynsym functions, followed by the .symtab functions whose
+        names carry a version, without duplicates.
+        """
+        result = list()
+        seen = set()
+        table = self.symbols(SHT_DYNSYM)
+        if table is not None:
+            needs, defs = self.version_needs(), self.version_defs()
+            for i in range(len(table)):
+                if table.type(i) not in (STT_FUNC, STT_GNU_IFUNC):
+                    continue
+                version = self.symbol_version(table, i, needs, defs)
+                if not version:
+                    continue
+                name = table.name(i) + version
+                if name not in seen:
+                    seen.add(name)
+                    result.append(name)
+        table = self.symbols(SHT_SYMTAB)
+        if table is not None:
+            for i in range(len(table)):
+                if table.type(i) not in (STT_FUNC, STT_GNU_IFUNC):
+                    continue
+                name = table.name(i)
+                if "@" in name and name not in seen:
+                    seen.add(name)
+                    result.append(name)
+        return result
+
+
+def _align4(size):
+    return (size + 3) & ~3
+
+
+def _split_path_list(values):
+    dirs = list()
+    for value in values:
+        dirs.extend(d for d in value.split(":") if d)
+    return dirs
+
+
+def split_symbol(symbol):
+    """Split "name@VER" or "name@@VER" into (name, VER)."""
+    name, _, version = symbol.partition("@")
+    return name, version.lstrip("@")
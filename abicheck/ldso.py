@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+In-process dynamic linker dependency resolution.
+
+Follows the ld.so search rules (DT_RPATH of the loader chain, LD_LIBRARY_PATH,
+DT_RUNPATH, ld.so.cache, the default directories) to compute the transitive
+DT_NEEDED graph of an object without running a loader, optionally inside a
+sysroot such as an extracted package chroot. The libraries an object loads
+with dlopen() are not in DT_NEEDED; the sonames among its string literals
+are the candidates for them.
+"""
+import collections
+import glob
+import os
+import re
+import struct
+
+from abicheck import elf
+
+LD_SO_CACHE = "/etc/ld.so.cache"
+LD_SO_CONF = "/etc/ld.so.conf"
+DEFAULT_DIRS = {
+    elf.ELFCLASS64: ("/lib64", "/usr/lib64"),
+    elf.ELFCLASS32: ("/lib", "/usr/lib"),
+}
+
+CACHE_MAGIC_OLD = b"ld.so-1.7.0"
+CACHE_MAGIC_NEW = b"glibc-ld.so.cache1.1"
+MAX_SYMLINKS = 40
+INTERPRETER_PREFIXES = ("ld-linux", "ld64.so", "ld.so")
+# the longest file name, longer strings are no soname
+NAME_MAX = 255
+SONAME_RE = re.compile(r"lib[A-Za-z0-9_+.-]*\.so(\.[0-9]+)*")
+
+ObjectInfo = collections.namedtuple(
+    "ObjectInfo", "path elfclass machine soname needed rpath runpath interpreter"
+)
+
+
+def parse_ld_so_cache(data):
+    """Return [(soname, path)] of an ld.so.cache, in the cache's order."""
+    entries = list()
+    pos = data.find(CACHE_MAGIC_NEW)
+    if pos >= 0:
+        base = pos
+        nlibs, _ = struct.unpack_from("<II", data, pos + 20)
+        pos += 48
+        for _ in range(nlibs):
+            _, key, value, _, _ = struct.unpack_from("<iIIIQ", data, pos)
+            entries.append((_cstring(data, base + key), _cstring(data, base + value)))
+            pos += 24
+        return entries
+
+    if data.startswith(CACHE_MAGIC_OLD):
+        (nlibs,) = struct.unpack_from("<I", data, 12)
+        strings = 16 + nlibs * 12
+        pos = 16
+        for _ in range(nlibs):
+            _, key, value = struct.unpack_from("<iII", data, pos)
+            entries.append((_cstring(data, strings + key), _cstring(data, strings + value)))
+            pos += 12
+    return entries
+
+
+def _cstring(data, offset):
+    end = data.find(b"\0", offset)
+    return data[offset:end].decode("utf-8", "replace")
+
+
+def _read_object(host_path, path):
+    try:
+        with elf.ELFFile(host_path) as f:
+            return ObjectInfo(
+                path,
+                f.elfclass,
+                f.machine,
+                f.soname,
+                f.needed,
+                f.rpath,
+                f.runpath,
+                f.interpreter,
+            )
+    except (OSError, elf.ELFError):
+        return None
+
+
+def dlopen_candidates(path):
+    """Return the sonames, in order of appearance, of the string literals
+    of the object at path that name a library, like "libfoo.so.1" or
+    "/opt/app/plugins/libbar.so".
+    """
+    sonames = list()
+    try:
+        with elf.ELFFile(path) as f:
+            for string in f.rodata_strings(b".so", NAME_MAX):
+                name = string.rpartition(b"/")[2].decode("ascii", "replace")
+                if SONAME_RE.fullmatch(name):
+                    sonames.append(name)
+    except (OSError, elf.ELFError):
+        return []
+    return list(dict.fromkeys(sonames))
+
+
+def env_library_path():
+    """Return the directories of the LD_LIBRARY_PATH of this process."""
+    return [d for d in os.environ.get("LD_LIBRARY_PATH", "").split(":") if d]
+
+
+class LibraryResolver(object):
+    """Resolve sonames the way ld.so would, optionally inside a sysroot.
+
+    Parsed objects and soname lookups are memoized, so one resolver can
+    compute the closures of many objects cheaply.
+    """
+
+    def __init__(self, sysroot="", ld_library_path=None):
+        self.sysroot = os.path.abspath(sysroot) if sysroot else ""
+        self.ld_library_path = ld_library_path or []
+        self._objects = dict()
+        self._lookups = dict()
+        self._cache = None
+        self._conf_dirs = None
+
+    def host_path(self, path):
+        """Map a path inside the sysroot to the host filesystem."""
+        if not self.sysroot:
+            return path
+        return self.sysroot + "/" + path.lstrip("/")
+
+    def realpath(self, path):
+        """Resolve symlinks of a sysroot path without escaping the sysroot."""
+        if not self.sysroot:
+            return os.path.realpath(path)
+        parts = [p for p in path.split("/") if p]
+        resolved = list()
+        links = 0
+        while parts:
+            part = parts.pop(0)
+            if part == ".":
+                continue
+            if part == "..":
+                if resolved:
+                    resolved.pop()
+                continue
+            candidate = "/" + "/".join(resolved + [part])
+            host = self.host_path(candidate)
+            if os.path.islink(host):
+                links += 1
+                if links > MAX_SYMLINKS:
+                    return candidate
+                target = os.readlink(host)
+                if target.startswith("/"):
+                    resolved = list()
+                parts = [p for p in target.split("/") if p] + parts
+            else:
+                resolved.append(part)
+        return "/" + "/".join(resolved)
+
+    def object_info(self, path):
+        """Return the ObjectInfo of the object at a sysroot path, or None."""
+        real = self.realpath(path)
+        if real not in self._objects:
+            self._objects[real] = _read_object(self.host_path(real), real)
+        return self._objects[real]
+
+    def _ld_so_cache(self):
+        if self._cache is None:
+            self._cache = dict()
+            try:
+                with open(self.host_path(LD_SO_CACHE), "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = b""
+            for soname, path in parse_ld_so_cache(data):
+                self._cache.setdefault(soname, []).append(path)
+        return self._cache
+
+    def _ld_so_conf_dirs(self):
+        """Return the ldconfig directories, used when there is no cache."""
+        if self._conf_dirs is None:
+            self._conf_dirs = list()
+            self._read_ld_so_conf(LD_SO_CONF, set())
+        return self._conf_dirs
+
+    def _read_ld_so_conf(self, path, seen):
+        if path in seen:
+            return
+        seen.add(path)
+        try:
+            with open(self.host_path(path)) as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        for line in lines:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith("include "):
+                pattern = line.split(None, 1)[1]
+                if not pattern.startswith("/"):
+                    pattern = os.path.join(os.path.dirname(path), pattern)
+                for conf in sorted(glob.glob(self.host_path(pattern))):
+                    if self.sysroot:
+                        conf = "/" + os.path.relpath(conf, self.sysroot)
+                    self._read_ld_so_conf(conf, seen)
+            elif line.startswith("hwcap "):
+                continue
+            elif line not in self._conf_dirs:
+                self._conf_dirs.append(line)
+
+    @staticmethod
+    def _expand(dirs, origin, elfclass):
+        lib = "lib64" if elfclass == elf.ELFCLASS64 else "lib"
+        result = list()
+        for d in dirs:
+            d = d.replace("$ORIGIN", origin).replace("${ORIGIN}", origin)
+            d = d.replace("$LIB", lib).replace("${LIB}", lib)
+            if "$" not in d:
+                result.append(d)
+        return result
+
+    def _compatible(self, path, loader):
+        info = self.object_info(path)
+        return (
+            info is not None
+            and info.elfclass == loader.elfclass
+            and info.machine == loader.machine
+        )
+
+    def _search_dirs(self, loader, chain):
+        dirs = list()
+        if not loader.runpath:
+            # DT_RPATH of the loader, then of the objects that loaded it
+            for obj in [loader] + chain:
+                if not obj.runpath:
+                    dirs += self._expand(
+                        obj.rpath, os.path.dirname(obj.path), obj.elfclass
+                    )
+        dirs += self.ld_library_path
+        dirs += self._expand(
+            loader.runpath, os.path.dirname(loader.path), loader.elfclass
+        )
+        return dirs
+
+    def find(self, soname, loader, chain=()):
+        """Return the sysroot path soname resolves to for loader, or None.
+
+        chain lists the objects that (transitively) loaded loader, nearest
+        first; their DT_RPATH entries are searched as ld.so does.
+        """
+        if "/" in soname:
+            return soname if self._compatible(soname, loader) else None
+
+        search_dirs = tuple(self._search_dirs(loader, list(chain)))
+        key = (soname, search_dirs, loader.elfclass, loader.machine)
+        if key in self._lookups:
+            return self._lookups[key]
+
+        found = None
+        for d in search_dirs:
+            candidate = os.path.join(d, soname)
+            if self._compatible(candidate, loader):
+                found = candidate
+                break
+        if found is None:
+            cache = self._ld_so_cache()
+            candidates = cache.get(soname, [])
+            if not cache:
+                candidates = [os.path.join(d, soname) for d in self._ld_so_conf_dirs()]
+            candidates += [
+                os.path.join(d, soname) for d in DEFAULT_DIRS.get(loader.elfclass, ())
+            ]
+            for candidate in candidates:
+                if self._compatible(candidate, loader):
+                    found = candidate
+                    break
+
+        self._lookups[key] = found
+        return found
+
+    def resolve(self, path, host_root=False):
+        """Return the DependencyGraph of the object at a sysroot path.
+
+        With host_root the object itself is read from the host filesystem
+        and only its dependencies are looked up inside the sysroot.
+        """
+        if host_root:
+            root = _read_object(path, os.path.realpath(path))
+        else:
+            root = self.object_info(path)
+        graph = DependencyGraph(root, os.path.basename(path))
+        if root is None:
+            return graph
+
+        # ld.so loads breadth first, which is also the order ldd prints
+        queue = collections.deque([(root, [])])
+        visited = set([root.path])
+        while queue:
+            obj, chain = queue.popleft()
+            for soname in obj.needed:
+                found = self.find(soname, obj, chain)
+                child = self.object_info(found) if found else None
+                graph.add_edge(obj, soname, found, child)
+                if child is not None and child.path not in visited:
+                    visited.add(child.path)
+                    queue.append((child, [obj] + chain))
+        return graph
+
+
+class DependencyGraph(object):
+    """The transitive DT_NEEDED graph of an object.
+
+    Every edge is (loader ObjectInfo, soname, path found or None). The
+    runtime edges are the libraries the root likely loads with dlopen(),
+    which are not part of what ldd lists.
+    """
+
+    def __init__(self, root, name):
+        self.root = root
+        self.edges = list()
+        self.runtime_edges = list()
+        self.objects = dict()
+        # the name every object was first found as, e.g. libc.so.6
+        self.names = dict()
+        if root is not None:
+            self.objects[root.path] = root
+            self.names[root.path] = name
+
+    def add_edge(self, loader, soname, found, child):
+        self.edges.append((loader, soname, found))
+        if child is not None:
+            self.objects.setdefault(child.path, child)
+            self.names.setdefault(child.path, os.path.basename(found))
+
+    def add_runtime_edge(self, soname, found):
+        self.runtime_edges.append((self.root, soname, found))
+
+    def runtime_name_edges(self):
+        """Return the unique (root name, library name) runtime edges, the
+        soname standing for the libraries not found.
+        """
+        return list(
+            dict.fromkeys(
+                (self.names[loader.path], os.path.basename(found or soname))
+                for loader, soname, found in self.runtime_edges
+            )
+        )
+
+    def runtime_sonames(self):
+        """Return the sonames of the runtime edges."""
+        return list(dict.fromkeys(soname for _, soname, _ in self.runtime_edges))
+
+    def name_edges(self):
+        """Return the unique (loader name, dependency name) edges of the
+        resolved dependencies.
+        """
+        return list(
+            dict.fromkeys(
+                (self.names[loader.path], os.path.basename(found))
+                for loader, _, found in self.edges
+                if found is not None
+            )
+        )
+
+    def needed_sonames(self):
+        """Return every soname of the closure in load order, like ldd lists
+        them, leaving out the program interpreter.
+        """
+        return list(
+            dict.fromkeys(
+                soname for _, soname, _ in self.edges if not self.is_interpreter(soname)
+            )
+        )
+
+    def is_interpreter(self, soname):
+        """Return True if soname is the program interpreter of the closure."""
+        if self.root is not None and self.root.interpreter:
+            return soname == os.path.basename(self.root.interpreter)
+        # shared objects have no PT_INTERP, ldd then runs the default one
+        return soname.startswith(INTERPRETER_PREFIXES)
+
+    def missing_sonames(self):
+        """Return the sonames that could not be resolved."""
+        return list(
+            dict.fromkeys(soname for _, soname, found in self.edges if found is None)
+        )
+
+    def ldd_lines(self):
+        """Return the closure formatted as ldd prints it."""
+        lines = list()
+        seen = set()
+        for _, soname, found in self.edges:
+            if soname in seen:
+                continue
+            seen.add(soname)
+            if found is None:
+                lines.append(f"\t{soname} => not found")
+            elif self.is_interpreter(soname):
+                lines.append(f"\t{found}")
+            else:
+                lines.append(f"\t{soname} => {found}")
+        return lines
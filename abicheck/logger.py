@@ -12,9 +12,11 @@ import logging
 import os
 import sys
 
-from abicheck.toolopts import tool_opts
 from abicheck.utils import format_msg_with_datetime
 
+# print debug messages, set by initialize_logger
+_debug_output = False
+
 
 class LogLevelTask(object):
     level = 15
@@ -26,12 +28,17 @@ class LogLevelFile(object):
     label = "FILE"
 
 
-def initialize_logger(log_name, log_dir="/tmp"):
+def initialize_logger(log_name, log_dir="/tmp", disable_colors=False, debug=False):
     """Initialize custom logging levels, handlers, and so on. Call this method
     from your application's main start point.
         log_name = the name for the log file
         log_dir = path to the dir where log file will be presented
+        disable_colors = print the messages without colors
+        debug = print the debug messages instead of only logging them
     """
+    global _debug_output  # pylint: disable=C0103
+    _debug_output = debug
+
     # set custom labels
     logging.addLevelName(LogLevelTask.level, LogLevelTask.label)
     logging.addLevelName(LogLevelFile.level, LogLevelFile.label)
@@ -48,13 +55,19 @@ def initialize_logger(log_name, log_dir="/tmp"):
     logger.propagate = True
     # set default logging level
     logger.setLevel(LogLevelFile.level)
+    # replace the handlers of an earlier initialization, e.g. by the
+    # previous job of a daemon worker
+    for handler in [h for h in logger.handlers if getattr(h, "initialized", False)]:
+        logger.removeHandler(handler)
+        handler.close()
 
     # create sys.stdout handler for info/debug
     stdout_handler = logging.StreamHandler(sys.stdout)
     formatter = CustomFormatter("%(message)s")
-    formatter.disable_colors(tool_opts.disable_colors)
+    formatter.disable_colors(disable_colors)
     stdout_handler.setFormatter(formatter)
     stdout_handler.setLevel(logging.DEBUG)
+    stdout_handler.initialized = True
     logger.addHandler(stdout_handler)
 
     # create file handler
@@ -65,6 +78,7 @@ def initialize_logger(log_name, log_dir="/tmp"):
     formatter.disable_colors(True)
     handler.setFormatter(formatter)
     handler.setLevel(LogLevelFile.level)
+    handler.initialized = True
     logger.addHandler(handler)
 
 
@@ -87,9 +101,7 @@ def _critical(self, msg, *args, **kwargs):
 
 def _debug(self, msg, *args, **kwargs):
     if self.isEnabledFor(logging.DEBUG):
-        from abicheck.toolopts import tool_opts
-
-        if tool_opts.debug:
+        if _debug_output:
             self._log(logging.DEBUG, msg, args, **kwargs)
         else:
             self._log(LogLevelFile.level,
@@ -13,80 +13,64 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import logging
-import signal
-import sys
+"""
+The abi-info-check command.
+
+A check is handed over to a running daemon before anything else is
+loaded, with only its options looked at; the daemon worker validates them.
+Everything else is run by abicheck.runner.
+"""
+import multiprocessing
 import os
+import sys
 
 sys.path.append(os.path.dirname(os.getcwd()))
-from abicheck import binhandler, toolopts, utils
-
-loggerinst = logging.getLogger("abicheck")
+from abicheck import daemon
+
+# options that keep a command line in this process
+LOCAL_OPTIONS = (
+    "-h",
+    "--help",
+    "-v",
+    "--version",
+    "--daemon",
+    "--no-daemon",
+    "--clean-cache",
+)
+CHECK_OPTIONS = ("-i", "--input", "-b", "--batch")
+
+
+def _options(argv):
+    options = set()
+    for arg in argv:
+        if arg == "--":
+            break
+        if arg.startswith("--"):
+            options.add(arg.partition("=")[0])
+        elif arg.startswith("-"):
+            options.add(arg[:2])
+    return options
+
+
+def for_daemon(argv):
+    """Return True if argv is a check a daemon can run."""
+    options = _options(argv)
+    return bool(options & set(CHECK_OPTIONS)) and not options & set(LOCAL_OPTIONS)
 
 
 def main():
     """Perform all steps for the entire conversion process."""
+    argv = sys.argv[1:]
+    # hand the check over to a running daemon, whose repos are loaded
+    if for_daemon(argv) and daemon.running():
+        return daemon.submit(argv)
 
-    utils.require_root()
-
-    # handle command line arguments
-    cli = toolopts.CLI()
-    cli.process_cli_options()
-
-    # check cmd
-    utils.check_cmd(binhandler.ABI_CC)
-    utils.check_cmd(binhandler.ABI_DUMPER)
-    utils.check_cmd(binhandler.READELF)
-    utils.check_cmd(binhandler.RPM2CPIO)
-    utils.check_cmd(binhandler.DOT)
-    utils.check_cmd(binhandler.CONVERT)
-
-    checker = binhandler.ABI()
-
-    checker.gen_elf_info()
-    checker.gen_ldd_info()
-    checker.gen_soname_file()
-
-    # old
-    checker.get_old_os_main_pkgs()
-    checker.get_old_devel_pkgs()
-    checker.get_old_libs_pkgs()
-    checker.download_old_packages()
-    checker.decompress_old_packages()
-    checker.gen_old_xml()
-    checker.gen_old_dump()
+    from abicheck import runner
 
-    # new
-    checker.get_new_os_main_pkgs()
-    checker.get_new_devel_pkgs()
-    checker.get_new_libs_pkgs()
-    checker.download_new_packages()
-    checker.decompress_new_packages()
-    checker.gen_new_xml()
-    checker.gen_new_dump()
-
-    # diff
-    checker.diff_dump()
-
-    # library depdency
-    checker.gen_soname_deppng()
-    checker.gen_rpm_deppng()
-
-    checker.add_deptab()
-
-    # show result
-    checker.show_html()
-
-    binhandler.ABI.clean_cache()
-
-def sigint_handler(sig, frame):
-    print('You pressed Ctrl+C!')
-    binhandler.ABI.clean_cache()
-    sys.exit(0)
+    return runner.main()
 
 
 if __name__ == "__main__":
-
-    binhandler.ABI.clean_cache()
-    signal.signal(signal.SIGINT, sigint_handler)
+    # the forkserver children of the frozen build run this executable
+    multiprocessing.freeze_support()
     sys.exit(main())
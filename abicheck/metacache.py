@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Repository metadata cache shared by all runs.
+
+dnf keeps the metadata downloaded for a repo config in a directory of the
+config's own below METADATA_DIR, whatever cachedir the config sets, so it
+survives between runs and reboots. When the metadata is checked again is
+up to the metadata_expire of every repo, the same policy the repo index
+follows; the bundled configs of the frozen vault releases never expire.
+The least recently used configs, with their repo indexes, are evicted once
+the cache grows past its quota. Open sessions hold a shared lock on the
+metadata of their config, which is never removed while locked, so a run
+evicting or cleaning the cache leaves alone what others are using.
+"""
+import fcntl
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from abicheck import repoindex, store, utils
+
+METADATA_DIR = f"{utils.TMP_DIR}/metadata"
+DEFAULT_QUOTA = 2 * 1024 * 1024 * 1024
+
+_cache = None
+_cache_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS configs (
+    config TEXT PRIMARY KEY, dirname TEXT, last_used REAL);
+"""
+
+
+def config_dirname(config):
+    """Return the name of the cache directory of a repo config."""
+    name = os.path.splitext(os.path.basename(config))[0]
+    digest = hashlib.sha1(os.path.abspath(config).encode()).hexdigest()[:8]
+    return f"{name}-{digest}"
+
+
+class MetadataCache(object):
+    """The metadata cache at path, holding at most quota bytes (0 for no
+    limit) of metadata of configs not used since the cache was opened.
+    """
+
+    def __init__(self, path=METADATA_DIR, quota=DEFAULT_QUOTA):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.quota = quota
+        self.opened = time.time()
+        utils.mkdir_p(path)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            os.path.join(path, "metadata.sqlite"), check_same_thread=False, timeout=60
+        )
+        with self._lock, self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def cachedir(self, config):
+        """Return the dnf cachedir of a repo config and mark it used."""
+        dirname = config_dirname(config)
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO configs VALUES (?, ?, ?)",
+                (os.path.abspath(config), dirname, time.time()),
+            )
+        path = os.path.join(self.path, dirname)
+        utils.mkdir_p(path)
+        return path
+
+    def _lock_path(self, dirname):
+        return os.path.join(self.path, f"{dirname}.lock")
+
+    def lock(self, config):
+        """Return an open file holding a shared lock on the metadata of a
+        repo config, kept from eviction until the file is closed.
+        """
+        f = open(self._lock_path(config_dirname(config)), "a")
+        fcntl.flock(f, fcntl.LOCK_SH)
+        return f
+
+    @staticmethod
+    def _index_paths(config):
+        return glob.glob(repoindex.index_path(config, "*"))
+
+    def _size(self, config, dirname):
+        size = store.tree_size(os.path.join(self.path, dirname))
+        for path in self._index_paths(config):
+            size += os.path.getsize(path)
+        return size
+
+    def _remove(self, config, dirname):
+        """Remove the metadata of a config unless a session has it locked,
+        return True if removed.
+        """
+        with open(self._lock_path(dirname), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            shutil.rmtree(os.path.join(self.path, dirname), ignore_errors=True)
+            for path in self._index_paths(config):
+                os.remove(path)
+            with self._lock, self.conn:
+                self.conn.execute("DELETE FROM configs WHERE config = ?", (config,))
+        return True
+
+    def evict(self, quota=None, since=None):
+        """Remove the metadata of the least recently used configs until
+        the cache fits into quota, its own by default. Configs used since
+        the time since, by default since the cache was opened, or locked by
+        a session are kept.
+        """
+        if quota is None:
+            quota = self.quota
+        if since is None:
+            since = self.opened
+        if not quota:
+            return
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT config, dirname, last_used FROM configs ORDER BY last_used"
+            ).fetchall()
+        sizes = [self._size(config, dirname) for config, dirname, _ in rows]
+        total = sum(sizes)
+        evicted = 0
+        for (config, dirname, last_used), size in zip(rows, sizes):
+            if total <= quota:
+                break
+            if last_used >= since or not self._remove(config, dirname):
+                continue
+            total -= size
+            evicted += 1
+        if evicted:
+            self.logger.info(
+                f"Evicted the metadata of {evicted} repo configs,"
+                f" {utils.format_size(total)} left."
+            )
+
+    def clean(self):
+        """Remove the metadata and repo indexes of every config no session
+        has locked.
+        """
+        with self._lock:
+            rows = self.conn.execute("SELECT config, dirname FROM configs").fetchall()
+        removed = sum(self._remove(config, dirname) for config, dirname in rows)
+        # the indexes of configs that were never cached here
+        with self._lock:
+            configs = [row[0] for row in self.conn.execute("SELECT config FROM configs")]
+        kept = set(path for config in configs for path in self._index_paths(config))
+        for path in glob.glob(os.path.join(repoindex.INDEX_DIR, "*.sqlite")):
+            if path not in kept:
+                os.remove(path)
+        self.logger.info(
+            f"Removed the cached metadata of {removed} repo configs,"
+            f" {len(rows) - removed} are in use."
+        )
+
+
+def get_cache(quota=DEFAULT_QUOTA):
+    """Return the metadata cache shared by the sessions of this process;
+    its quota is the one of the first call, evict() takes another.
+    """
+    global _cache  # pylint: disable=C0103
+    with _cache_lock:
+        if _cache is None:
+            _cache = MetadataCache(quota=quota)
+    return _cache
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Multi-release mode: compare one binary against several old OS releases.
+
+The new OS side does not depend on the old release, except for the devel
+and libs packages it looks up by the old names, so it runs once for the
+union of those of every release. The old OS side runs per release, sharing
+the package store, and the results end up in a release x library matrix.
+"""
+import logging
+import os
+from concurrent import futures
+
+from abicheck import binhandler, pipeline, report, utils
+
+MATRIX_HTML_FILE = "matrix.html"
+
+
+class MultiReleaseChecker(object):
+    """The check of binfile against releases, configured by opts; the
+    checkers of the releases share the chroots of workspace.
+    """
+
+    def __init__(self, opts, workspace, releases, binfile=None, output_dir=None):
+        self.logger = logging.getLogger(__name__)
+        self.opts = opts
+        self.workspace = workspace
+        self.releases = list(releases)
+        self.binfile = binfile
+        self.output_dir = output_dir or opts.output_dir
+        self.new_checker = None
+        self.old_checkers = list()
+
+    def _checker(self, release, output_dir):
+        utils.mkdir_p(output_dir)
+        checker = binhandler.ABI(
+            self.opts, self.workspace, self.binfile, output_dir, release
+        )
+        if not os.path.exists(checker.old_dnf_conf):
+            self.logger.critical(f"No such file {checker.old_dnf_conf}, please check.")
+        checker.gen_elf_info()
+        checker.gen_ldd_info()
+        checker.gen_soname_file()
+        return checker
+
+    def prepare(self):
+        """Create the new OS checker and a checker per old OS release."""
+        new_os_full_name = f"{self.opts.new_os_id}_{self.opts.new_os_version}"
+        self.new_checker = self._checker(
+            self.releases[0], os.path.join(self.output_dir, new_os_full_name)
+        )
+        for release in self.releases:
+            self.old_checkers.append(
+                self._checker(release, os.path.join(self.output_dir, release))
+            )
+
+    def merge_old_packages(self):
+        """Give the new OS checker the old devel and libs packages of every
+        release, once their package lookups are done.
+        """
+        devel_pkgs = list()
+        libs_pkgs = list()
+        for checker in self.old_checkers:
+            devel_pkgs += checker.old_required_rpm_devel_pkgs
+            libs_pkgs += checker.old_required_rpm_libs_pkgs
+        self.new_checker.old_required_rpm_devel_pkgs = list(dict.fromkeys(devel_pkgs))
+        self.new_checker.old_required_rpm_libs_pkgs = list(dict.fromkeys(libs_pkgs))
+
+    def _compare(self, checker):
+        checker.adopt_new_side(self.new_checker)
+        pipeline.run_stage(checker, "report")
+        return checker.library_results
+
+    def finish(self, jobs=None):
+        """Compare every release with the new OS side, then write the
+        release x library matrix. Return its path.
+        """
+        columns = list()
+        with futures.ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+            jobs = [
+                executor.submit(self._compare, checker) for checker in self.old_checkers
+            ]
+            for checker, job in zip(self.old_checkers, jobs):
+                release = checker.old_os_full_name
+                try:
+                    results = job.result()
+                except Exception as e:  # pylint: disable=W0703
+                    self.logger.warning(f"Failed to compare {release}: {e}")
+                    columns.append((release, None, []))
+                    continue
+                columns.append(
+                    (release, f"{release}/{checker.EXPORT_HTML_FILE}", results)
+                )
+
+        html_file = os.path.join(self.output_dir, MATRIX_HTML_FILE)
+        report.write_release_matrix(
+            html_file,
+            f"{self.new_checker.basename}: compatibility of"
+            f" {self.new_checker.new_os_full_name} with {len(self.releases)} releases",
+            self.new_checker.required_sonames,
+            columns,
+        )
+        self.logger.info(f"The check result is {os.path.abspath(html_file)}")
+        return html_file
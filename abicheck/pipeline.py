@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+The stage graph of a check, with checkpoints.
+
+Every stage declares the stages it runs after, its inputs (checker state,
+file contents, repo metadata revisions), the checker attributes it sets and
+the files it writes. After a stage ran, a checkpoint with a hash of its
+inputs, its state and the content hashes of its outputs is kept in the
+output directory. A stage whose inputs hash the same as in its checkpoint,
+and whose outputs are unchanged, is skipped and its state restored, so a
+run after a crash or after a change of only the new OS repos redoes only
+the stages affected.
+"""
+import collections
+import hashlib
+import logging
+import os
+import pickle
+
+from abicheck import dumpcache, profiler, store, utils
+
+CHECKPOINT_DIR = "checkpoints"
+# bumped whenever the stages change what they compute
+CHECKPOINT_VERSION = 1
+
+# side: "old", "new" or None for the report; after: names of the stages it
+# runs after; inputs: function of the checker returning what the stage
+# reads; state: names of the checker attributes it sets; outputs: function
+# of the checker returning the files it writes; methods: checker methods
+# run, in order
+Stage = collections.namedtuple(
+    "Stage", "name side after inputs state outputs methods"
+)
+
+
+def file_hash(path):
+    """Return the sha256 of the content of a file, None if it is missing."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def fingerprint(value):
+    """Return a text form of value that is stable across runs, for hashing.
+
+    Sets and dicts are sorted, objects are described by their attributes.
+    """
+    if isinstance(value, (str, bytes, int, float, bool, type(None))):
+        return repr(value)
+    if isinstance(value, dict):
+        items = sorted(f"{fingerprint(k)}:{fingerprint(v)}" for k, v in value.items())
+        return "{" + ",".join(items) + "}"
+    if isinstance(value, (set, frozenset)):
+        return "{" + ",".join(sorted(fingerprint(v) for v in value)) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(fingerprint(v) for v in value) + "]"
+    if hasattr(value, "__dict__"):
+        return type(value).__name__ + fingerprint(vars(value))
+    return repr(value)
+
+
+def _old_pkgs(abi):
+    return [abi.old_required_rpm_pkgs, abi.old_required_rpm_devel_pkgs]
+
+
+def _new_pkgs(abi):
+    return [
+        abi.new_required_rpm_pkgs,
+        abi.new_required_rpm_libs_pkgs,
+        abi.new_required_rpm_devel_pkgs,
+    ]
+
+
+def _rpm_files(files, downloaddir):
+    return [os.path.join(downloaddir, f.filename) for f in files]
+
+
+def _chroot(sysroot):
+    return [os.path.join(sysroot, store.ASSEMBLED_FILE)]
+
+
+def _dumps(dumps):
+    return [path for _, path in dumps.values()]
+
+
+def _report_outputs(abi):
+    return [
+        os.path.join(abi.output_dir, name)
+        for name in (abi.EXPORT_HTML_FILE, abi.OLD_SO_PNG_FILE, abi.OLD_RPM_PNG_FILE)
+    ] + [os.path.join(abi.output_dir, r.report) for r in abi.library_results if r.report]
+
+
+def _no_outputs(abi):
+    return []
+
+
+STAGES = collections.OrderedDict(
+    (stage.name, stage)
+    for stage in (
+        Stage(
+            "get_old_os_main_pkgs",
+            "old",
+            (),
+            lambda abi: [abi.required_sonames, abi.old_repo.revision()],
+            ("old_required_rpm_pkgs",),
+            _no_outputs,
+            ("get_old_os_main_pkgs",),
+        ),
+        Stage(
+            "get_old_devel_pkgs",
+            "old",
+            ("get_old_os_main_pkgs",),
+            lambda abi: [abi.old_required_rpm_pkgs, abi.old_repo.revision()],
+            ("old_required_rpm_devel_pkgs",),
+            _no_outputs,
+            ("get_old_devel_pkgs",),
+        ),
+        Stage(
+            "get_old_libs_pkgs",
+            "old",
+            ("get_old_os_main_pkgs",),
+            lambda abi: [abi.old_required_rpm_pkgs, abi.old_repo.revision()],
+            ("old_required_rpm_libs_pkgs",),
+            _no_outputs,
+            ("get_old_libs_pkgs",),
+        ),
+        Stage(
+            "download_old_packages",
+            "old",
+            ("get_old_devel_pkgs",),
+            lambda abi: _old_pkgs(abi) + [abi.old_repo.revision(), abi.opts.alldeps],
+            ("old_package_files",),
+            lambda abi: _rpm_files(abi.old_package_files, abi.old_rpm_downloaddir),
+            ("download_old_packages",),
+        ),
+        Stage(
+            "decompress_old_packages",
+            "old",
+            ("download_old_packages",),
+            lambda abi: [abi.old_package_files],
+            (),
+            lambda abi: _chroot(abi.old_rpm_cpiodir),
+            ("decompress_old_packages",),
+        ),
+        Stage(
+            "gen_old_dep_closure",
+            "old",
+            ("decompress_old_packages",),
+            lambda abi: [file_hash(abi.binfile), abi.old_package_files],
+            ("old_dep_graph",),
+            lambda abi: [os.path.join(abi.output_dir, abi.OLD_LDD_FILE)],
+            ("gen_old_dep_closure",),
+        ),
+        Stage(
+            "gen_old_xml",
+            "old",
+            ("decompress_old_packages",),
+            lambda abi: _old_pkgs(abi) + [abi.required_sonames, abi.old_package_files],
+            (),
+            lambda abi: [os.path.join(abi.output_dir, abi.OLD_XML_FILE)],
+            ("gen_old_xml",),
+        ),
+        Stage(
+            "gen_old_dump",
+            "old",
+            ("decompress_old_packages",),
+            lambda abi: _old_pkgs(abi)
+            + [
+                abi.required_sonames,
+                abi.old_package_files,
+                dumpcache.tool_version(),
+                abi.delta_pairs,
+            ],
+            ("old_library_dumps",),
+            lambda abi: _dumps(abi.old_library_dumps),
+            ("gen_old_dump",),
+        ),
+        Stage(
+            "get_new_os_main_pkgs",
+            "new",
+            (),
+            lambda abi: [
+                abi.required_sonames,
+                abi.new_repo.revision(),
+                abi.symbol_index and abi.symbol_index.revision,
+                abi.undefined_symbols,
+            ],
+            ("new_required_rpm_pkgs", "so_dep_rpm_dict", "suggested_rpm_dict"),
+            _no_outputs,
+            ("get_new_os_main_pkgs",),
+        ),
+        Stage(
+            "get_new_devel_pkgs",
+            "new",
+            ("get_new_os_main_pkgs", "get_old_devel_pkgs"),
+            lambda abi: [
+                abi.new_required_rpm_pkgs,
+                abi.old_required_rpm_devel_pkgs,
+                abi.new_repo.revision(),
+            ],
+            ("new_required_rpm_devel_pkgs",),
+            _no_outputs,
+            ("get_new_devel_pkgs",),
+        ),
+        Stage(
+            "get_new_libs_pkgs",
+            "new",
+            ("get_new_os_main_pkgs", "get_old_libs_pkgs"),
+            lambda abi: [
+                abi.new_required_rpm_pkgs,
+                abi.old_required_rpm_libs_pkgs,
+                abi.new_repo.revision(),
+            ],
+            ("new_required_rpm_libs_pkgs",),
+            _no_outputs,
+            ("get_new_libs_pkgs",),
+        ),
+        Stage(
+            "download_new_packages",
+            "new",
+            ("get_new_devel_pkgs", "get_new_libs_pkgs"),
+            lambda abi: _new_pkgs(abi) + [abi.new_repo.revision(), abi.opts.alldeps],
+            ("new_package_files",),
+            lambda abi: _rpm_files(abi.new_package_files, abi.new_rpm_downloaddir),
+            ("download_new_packages",),
+        ),
+        Stage(
+            "decompress_new_packages",
+            "new",
+            ("download_new_packages",),
+            lambda abi: [abi.new_package_files],
+            (),
+            lambda abi: _chroot(abi.new_rpm_cpiodir),
+            ("decompress_new_packages",),
+        ),
+        Stage(
+            "gen_new_dep_closure",
+            "new",
+            ("decompress_new_packages",),
+            lambda abi: [file_hash(abi.binfile), abi.new_package_files],
+            ("new_dep_graph",),
+            lambda abi: [os.path.join(abi.output_dir, abi.NEW_LDD_FILE)],
+            ("gen_new_dep_closure",),
+        ),
+        Stage(
+            "gen_new_xml",
+            "new",
+            ("decompress_new_packages",),
+            lambda abi: _new_pkgs(abi) + [abi.required_sonames, abi.new_package_files],
+            (),
+            lambda abi: [os.path.join(abi.output_dir, abi.NEW_XML_FILE)],
+            ("gen_new_xml",),
+        ),
+        Stage(
+            "gen_new_dump",
+            "new",
+            ("decompress_new_packages",),
+            lambda abi: _new_pkgs(abi)
+            + [
+                abi.required_sonames,
+                abi.new_package_files,
+                dumpcache.tool_version(),
+                abi.delta_pairs,
+            ],
+            ("new_library_dumps",),
+            lambda abi: _dumps(abi.new_library_dumps),
+            ("gen_new_dump",),
+        ),
+        Stage(
+            "report",
+            None,
+            ("gen_old_dump", "gen_new_dump", "gen_old_dep_closure", "gen_new_dep_closure"),
+            lambda abi: [
+                file_hash(os.path.join(abi.output_dir, abi.FUNC_DYNSYM_NAME_FILE)),
+                abi.required_sonames,
+                abi.old_os_full_name,
+                abi.new_os_full_name,
+                abi.old_library_dumps,
+                abi.new_library_dumps,
+                abi.dep_graph,
+                abi.so_dep_rpm_dict,
+                abi.suggested_rpm_dict,
+                abi.delta_pairs,
+            ],
+            ("library_results",),
+            _report_outputs,
+            ("diff_dump", "gen_soname_deppng", "gen_rpm_deppng"),
+        ),
+    )
+)
+
+
+def chain(side):
+    """Return the names of the stages of a side, each after the stages of
+    the side it runs after.
+    """
+    names = list()
+
+    def visit(name):
+        stage = STAGES[name]
+        if name in names or stage.side != side:
+            return
+        for after in stage.after:
+            visit(after)
+        names.append(name)
+
+    for name in STAGES:
+        visit(name)
+    return tuple(names)
+
+
+class Checkpoints(object):
+    """The checkpoints of the stages run for the checker writing into
+    output_dir.
+    """
+
+    def __init__(self, output_dir):
+        self.logger = logging.getLogger(__name__)
+        self.path = os.path.join(output_dir, CHECKPOINT_DIR)
+
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.pickle")
+
+    def load(self, name):
+        try:
+            with open(self._file(name), "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                self.logger.debug(f"Ignoring the checkpoint of {name}: {e}")
+            return None
+
+    def save(self, name, record):
+        utils.mkdir_p(self.path)
+        tmp = f"{self._file(name)}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(record, f)
+        os.replace(tmp, self._file(name))
+
+    @staticmethod
+    def outputs(paths, known=None):
+        """Return {path: (size, mtime_ns, inode, sha256)} of the files,
+        rehashing only those whose stat differs from the known ones.
+        """
+        known = known or dict()
+        result = dict()
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                result[path] = None
+                continue
+            stat = (st.st_size, st.st_mtime_ns, st.st_ino)
+            old = known.get(path)
+            if old is not None and old[:3] == stat:
+                result[path] = old
+            else:
+                result[path] = stat + (file_hash(path),)
+        return result
+
+
+def stage_key(checker, stage):
+    digest = hashlib.sha256(f"{CHECKPOINT_VERSION}:{stage.name}:".encode())
+    digest.update(fingerprint(stage.inputs(checker)).encode())
+    return digest.hexdigest()
+
+
+def run_stage(checker, name):
+    """Run a stage of checker unless its checkpoint is up to date, in which
+    case its state is restored instead. Return True if the stage ran.
+    """
+    loggerinst = logging.getLogger(__name__)
+    stage = STAGES[name]
+    checkpoints = Checkpoints(checker.output_dir)
+    key = stage_key(checker, stage)
+
+    record = None if checker.opts.rerun else checkpoints.load(name)
+    if record is not None and record["key"] == key:
+        known = record["outputs"]
+        outputs = Checkpoints.outputs(known, known)
+        if all(
+            outputs[path] and known[path] and outputs[path][3] == known[path][3]
+            for path in known
+        ):
+            for attr, value in record["state"].items():
+                setattr(checker, attr, value)
+            if outputs != known:
+                record["outputs"] = outputs
+                checkpoints.save(name, record)
+            loggerinst.info(f"Stage {name} is up to date, skipping it.")
+            with profiler.span(name, binary=checker.basename, skipped=True):
+                pass
+            return False
+
+    with profiler.span(name, binary=checker.basename):
+        for method in stage.methods:
+            getattr(checker, method)()
+    state = dict((attr, getattr(checker, attr)) for attr in stage.state)
+    checkpoints.save(
+        name,
+        {
+            "key": key,
+            "state": state,
+            "outputs": Checkpoints.outputs(stage.outputs(checker)),
+        },
+    )
+    return True
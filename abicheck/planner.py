@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Download planning.
+
+The xml descriptors only need the headers of the devel packages and the
+shared objects of the library packages, so instead of the full runtime
+closure of every devel package only these are fetched: the library
+packages, the devel/headers packages, and the devel/headers packages
+those require in turn, since their headers #include each other.
+"""
+import logging
+
+from abicheck import utils
+
+HEADER_PACKAGE_SUFFIXES = ("-devel", "-headers")
+
+
+def is_header_package(name):
+    """Return True if the package name looks like it ships headers."""
+    return name.endswith(HEADER_PACKAGE_SUFFIXES)
+
+
+class DownloadPlan(object):
+    """The download.PackageFiles to download, and those of the full
+    closure when it was computed for comparison.
+    """
+
+    def __init__(self, packages, full_closure=None):
+        self.packages = packages
+        self.full_closure = full_closure
+
+    @property
+    def size(self):
+        return sum(pkg.size for pkg in self.packages)
+
+    @property
+    def full_size(self):
+        return sum(pkg.size for pkg in self.full_closure or [])
+
+    @property
+    def saved_bytes(self):
+        return max(0, self.full_size - self.size)
+
+    @property
+    def saved_count(self):
+        return max(0, len(self.full_closure or []) - len(self.packages))
+
+    def summary(self):
+        summary = f"{len(self.packages)} packages ({utils.format_size(self.size)})"
+        if self.full_closure is None:
+            return summary
+        return (
+            f"{summary} instead of"
+            f" {len(self.full_closure)} ({utils.format_size(self.full_size)}),"
+            f" saving {self.saved_count} packages"
+            f" and {utils.format_size(self.saved_bytes)}"
+        )
+
+
+def _plan_from_index(session, lib_names, devel_names):
+    """Return the rows of the planned packages, from the repo index."""
+    loggerinst = logging.getLogger(__name__)
+    index = session.index
+    arches = [session.arch, "noarch"]
+
+    selected = session.latest_rows(lib_names, [session.arch])
+    queue = list()
+    for name, row in session.latest_rows(devel_names, arches).items():
+        if name not in selected:
+            selected[name] = row
+            queue.append(row)
+
+    # follow the requires between header packages
+    while queue:
+        row = queue.pop(0)
+        for require, providers in index.providers(index.requires(row), arches).items():
+            if not providers or any(name in selected for name in providers):
+                continue
+            for name in providers:
+                if not is_header_package(name):
+                    continue
+                provider = session.latest_rows([name], arches).get(name)
+                if provider is not None:
+                    loggerinst.debug(f"{row[3]} requires {require}, adding {name}.")
+                    selected[name] = provider
+                    queue.append(provider)
+                    break
+
+    return [selected[name] for name in sorted(selected)]
+
+
+def _plan_from_sack(session, lib_names, devel_names):
+    """Return the planned packages, from the dnf sack."""
+    loggerinst = logging.getLogger(__name__)
+    query = session.base.sack.query().available()
+    query = query.filter(arch=[session.arch, "noarch"]).latest()
+
+    selected = dict()
+    for name in lib_names:
+        for pkg in query.filter(name=name, arch=session.arch):
+            selected.setdefault(pkg.name, pkg)
+
+    queue = list()
+    for name in devel_names:
+        for pkg in query.filter(name=name):
+            if pkg.name not in selected:
+                selected[pkg.name] = pkg
+                queue.append(pkg)
+
+    # follow the requires between header packages
+    while queue:
+        pkg = queue.pop(0)
+        for reldep in pkg.requires:
+            providers = query.filter(provides=reldep)
+            if not providers:
+                continue
+            if any(p.name in selected for p in providers):
+                continue
+            for provider in providers:
+                if is_header_package(provider.name):
+                    loggerinst.debug(
+                        f"{pkg.name} requires {reldep}, adding {provider.name}."
+                    )
+                    selected[provider.name] = provider
+                    queue.append(provider)
+                    break
+
+    return sorted(selected.values(), key=lambda pkg: pkg.name)
+
+
+def plan_downloads(session, lib_names, devel_names, full_closure=False):
+    """Plan the minimal downloads for the xml descriptor of one side.
+
+    lib_names are the packages whose shared objects are described,
+    devel_names the devel/headers packages whose headers are described.
+    The plan comes from the repo index when the session has one, so no
+    dnf sack is loaded. The full closure, which needs a depsolve, is only
+    computed with full_closure, to compare the plan with it.
+    """
+    if session.index:
+        packages = session.index_package_files(
+            _plan_from_index(session, lib_names, devel_names)
+        )
+    else:
+        packages = session.package_files(
+            _plan_from_sack(session, lib_names, devel_names)
+        )
+    closure = None
+    if full_closure:
+        closure = session.package_files(
+            session.resolve_closure(list(lib_names) + list(devel_names))
+        )
+    return DownloadPlan(packages, closure)
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Run time instrumentation.
+
+Every stage, every in-process phase worth knowing about and every external
+command is recorded with its wall time, child CPU time, peak RSS and bytes
+read and written. External commands are accounted exactly from the rusage
+of the reaped child; for spans run in this process the figures are deltas
+of the whole process, so concurrent spans share theirs. At the end of a
+run the profile is written to the output directory as PROFILE_FILE, with
+the events and totals per name, and TRACE_FILE in the Chrome trace event
+format (chrome://tracing, Perfetto), and a summary table is logged.
+"""
+import contextlib
+import json
+import logging
+import os
+import resource
+import shlex
+import subprocess
+import threading
+import time
+
+PROFILE_FILE = "profile.json"
+TRACE_FILE = "trace.json"
+# ru_inblock and ru_oublock count 512 byte blocks
+BLOCK_SIZE = 512
+
+
+def _proc_io():
+    """Return (read_bytes, write_bytes) of this process so far."""
+    counters = dict()
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters.get("read_bytes", 0), counters.get("write_bytes", 0)
+
+
+def _child_cpu(usage):
+    return usage.ru_utime + usage.ru_stime
+
+
+class AccountedPopen(subprocess.Popen):
+    """A Popen keeping the rusage of the child once Profiler.communicate()
+    reaped it.
+    """
+
+    rusage = None
+
+
+def _read(pipe, result):
+    result.append(pipe.read())
+    pipe.close()
+
+
+class Profiler(object):
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.started = time.monotonic()
+        self.events = list()
+        self._threads = dict()
+        self._lock = threading.Lock()
+
+    def _tid(self):
+        ident = threading.get_ident()
+        with self._lock:
+            return self._threads.setdefault(ident, len(self._threads) + 1)
+
+    def _add(self, name, category, start, end, cpu, rss, read, written, args):
+        event = {
+            "name": name,
+            "cat": category,
+            "start": start - self.started,
+            "wall": end - start,
+            "cpu": cpu,
+            "rss": rss,
+            "read": read,
+            "written": written,
+            "tid": self._tid(),
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, category="stage", **args):
+        """Record the block as an event of the process."""
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        read, written = _proc_io()
+        start = time.monotonic()
+        try:
+            yield args
+        finally:
+            end = time.monotonic()
+            children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+            read_end, written_end = _proc_io()
+            self._add(
+                name,
+                category,
+                start,
+                end,
+                _child_cpu(children_end) - _child_cpu(children),
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                read_end - read,
+                written_end - written,
+                args,
+            )
+
+    def popen(self, cmd, **kwargs):
+        """Start cmd as an AccountedPopen; reap it with communicate(), then
+        pass it to command().
+        """
+        proc = AccountedPopen(cmd, **kwargs)
+        proc.profile_start = time.monotonic()
+        return proc
+
+    def communicate(self, proc):
+        """Read the pipes of an AccountedPopen to their end, then reap it
+        with os.wait4, keeping its rusage; return (stdout, stderr) as
+        Popen.communicate() does.
+        """
+        outputs = list()
+        readers = list()
+        for pipe in (proc.stdout, proc.stderr):
+            result = list()
+            outputs.append(result)
+            if pipe is not None:
+                readers.append(threading.Thread(target=_read, args=(pipe, result)))
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        if proc.returncode is None:
+            _, status, proc.rusage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+        return tuple(result[0] if result else None for result in outputs)
+
+    def command(self, proc, cmd):
+        """Record a finished AccountedPopen of cmd, named by its program."""
+        end = time.monotonic()
+        if isinstance(cmd, bytes):
+            cmd = cmd.decode("utf-8", "replace")
+        if isinstance(cmd, str):
+            try:
+                cmd = shlex.split(cmd)
+            except ValueError:
+                cmd = cmd.split()
+        name = os.path.basename(cmd[0]) if cmd else "?"
+        usage = proc.rusage
+        self._add(
+            name,
+            "command",
+            proc.profile_start,
+            end,
+            _child_cpu(usage) if usage else 0.0,
+            usage.ru_maxrss * 1024 if usage else 0,
+            usage.ru_inblock * BLOCK_SIZE if usage else 0,
+            usage.ru_oublock * BLOCK_SIZE if usage else 0,
+            {"cmd": " ".join(cmd), "returncode": proc.returncode},
+        )
+
+    def totals(self):
+        """Return the per (category, name) totals, slowest first."""
+        totals = dict()
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            total = totals.setdefault(
+                (event["cat"], event["name"]),
+                {
+                    "cat": event["cat"],
+                    "name": event["name"],
+                    "calls": 0,
+                    "wall": 0.0,
+                    "cpu": 0.0,
+                    "rss": 0,
+                    "read": 0,
+                    "written": 0,
+                },
+            )
+            total["calls"] += 1
+            total["wall"] += event["wall"]
+            total["cpu"] += event["cpu"]
+            total["rss"] = max(total["rss"], event["rss"])
+            total["read"] += event["read"]
+            total["written"] += event["written"]
+        return sorted(totals.values(), key=lambda total: -total["wall"])
+
+    def trace_events(self):
+        """Return the events in the Chrome trace event format."""
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+        trace = list()
+        for event in events:
+            args = dict(event.get("args", {}))
+            args.update(
+                cpu_s=round(event["cpu"], 3),
+                rss=event["rss"],
+                read=event["read"],
+                written=event["written"],
+            )
+            trace.append(
+                {
+                    "name": event["name"],
+                    "cat": event["cat"],
+                    "ph": "X",
+                    "ts": int(event["start"] * 1e6),
+                    "dur": int(event["wall"] * 1e6),
+                    "pid": pid,
+                    "tid": event["tid"],
+                    "args": args,
+                }
+            )
+        return trace
+
+    def summary_lines(self):
+        from abicheck import utils
+
+        lines = [
+            f"{'category':<9} {'name':<28} {'calls':>5} {'wall s':>9}"
+            f" {'cpu s':>9} {'peak rss':>10} {'read':>10} {'written':>10}"
+        ]
+        for total in self.totals():
+            lines.append(
+                f"{total['cat']:<9} {total['name'][:28]:<28} {total['calls']:>5}"
+                f" {total['wall']:>9.2f} {total['cpu']:>9.2f}"
+                f" {utils.format_size(total['rss']):>10}"
+                f" {utils.format_size(total['read']):>10}"
+                f" {utils.format_size(total['written']):>10}"
+            )
+        return lines
+
+    def write(self, output_dir):
+        """Write the profile and trace files into output_dir and log the
+        summary table.
+        """
+        total = time.monotonic() - self.started
+        with self._lock:
+            events = list(self.events)
+        try:
+            with open(os.path.join(output_dir, PROFILE_FILE), "w") as f:
+                json.dump(
+                    {"wall": total, "totals": self.totals(), "events": events},
+                    f,
+                    indent=1,
+                )
+            with open(os.path.join(output_dir, TRACE_FILE), "w") as f:
+                json.dump(
+                    {"traceEvents": self.trace_events(), "displayTimeUnit": "ms"}, f
+                )
+        except OSError as e:
+            self.logger.warning(f"Can not write the profile into {output_dir}: {e}")
+            return
+        self.logger.info(f"Run time profile ({total:.1f} s in total):")
+        for line in self.summary_lines():
+            self.logger.info(line)
+
+
+_profiler = Profiler()
+
+
+def get_profiler():
+    """Return the profiler of this process."""
+    return _profiler
+
+
+def reset():
+    """Start a new profile, e.g. for the next job of a daemon worker."""
+    global _profiler  # pylint: disable=C0103
+    _profiler = Profiler()
+
+
+def span(name, category="stage", **args):
+    return _profiler.span(name, category, **args)
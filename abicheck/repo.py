@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Repository sessions.
+
+Loading the repo metadata of a dnf config is by far the most expensive part
+of a package query, so every config is loaded once per process and the warm
+sack is shared by all callers asking for the same (config, arch) pair.
+dnf itself is imported on first use, so that processes never querying a
+repo, like the client of a daemon, start without it.
+"""
+import functools
+import hashlib
+import logging
+import os
+import threading
+
+from abicheck import download, metacache, profiler
+
+_sessions = dict()
+_sessions_lock = threading.Lock()
+
+# Architectures whose shared objects carry the "(64bit)" provides suffix
+ARCH_64BIT = ("x86_64", "aarch64", "ppc64le", "ppc64", "s390x", "riscv64")
+
+
+def repo_transport(repo):
+    """Return the repoindex.Transport of a dnf repo, or None if it is
+    reached directly with the default TLS settings.
+    """
+    from abicheck import repoindex
+
+    proxy = getattr(repo, "proxy", "") or ""
+    transport = repoindex.Transport(
+        "" if proxy == "_none_" else proxy,
+        getattr(repo, "proxy_username", "") or "",
+        getattr(repo, "proxy_password", "") or "",
+        bool(getattr(repo, "sslverify", True)),
+        getattr(repo, "sslcacert", "") or "",
+        getattr(repo, "sslclientcert", "") or "",
+        getattr(repo, "sslclientkey", "") or "",
+    )
+    if transport == repoindex.Transport("", "", "", True, "", "", ""):
+        return None
+    return transport
+
+
+class RepoSession(object):
+    """A dnf sack loaded from one repo config and filtered for one arch.
+
+    Queries are answered from the persistent repo index when every repo of
+    the config could be indexed, and from the dnf sack otherwise; the sack
+    is only filled when a query actually needs it. The metadata is kept in
+    the metadata cache and checked again once the metadata_expire of its
+    repo passed, or right away with refresh.
+    """
+
+    def __init__(self, config, arch, use_index=True, refresh=False):
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.arch = arch
+        self.use_index = use_index
+        self.refresh = refresh
+        self._base = None
+        self._filled = False
+        self._index = None
+        self._names = None
+        self._revision = None
+        # keeps the metadata of the config from being evicted while open
+        self._cache_lock = None
+        self._lock = threading.Lock()
+
+    def _configure(self):
+        if self._base is None:
+            import dnf
+
+            base = dnf.Base()
+
+            if os.path.exists(self.config):
+                conf = base.conf
+                conf.read(self.config)
+                cache = metacache.get_cache()
+                self._cache_lock = cache.lock(self.config)
+                conf.cachedir = cache.cachedir(self.config)
+            else:
+                self.logger.critical(f"No such file {self.config}, please check.")
+
+            base.read_all_repos()
+            if self.refresh:
+                for repo in base.repos.iter_enabled():
+                    repo.metadata_expire = 0
+            self._base = base
+        return self._base
+
+    @property
+    def base(self):
+        """Return the dnf base, loading the sack on first use."""
+        import dnf
+
+        with self._lock:
+            base = self._configure()
+            if not self._filled:
+                self.logger.info(f"Loading repository metadata of {self.config} ...")
+                try:
+                    with profiler.span("dnf fill_sack", "repo", config=self.config):
+                        base.fill_sack(load_system_repo=False)
+                except (dnf.exceptions.RepoError, dnf.exceptions.ConfigError) as e:
+                    self.logger.critical(e)
+                self._filled = True
+        return base
+
+    @property
+    def index(self):
+        """Return the up to date repo index, or None if it can't be used."""
+        with self._lock:
+            if self._index is None:
+                self._index = self._open_index()
+        return self._index or None
+
+    def _open_index(self):
+        if not self.use_index:
+            return False
+        repos = list()
+        expire = dict()
+        transports = dict()
+        for repo in self._configure().repos.iter_enabled():
+            # the mirrors of a mirrorlist or metalink are for dnf to pick
+            if not repo.baseurl:
+                self.logger.debug(f"Repo {repo.id} has no baseurl, not indexing it.")
+                return False
+            repos.append((repo.id, repo.baseurl[0]))
+            expire[repo.id] = repo.metadata_expire
+            transports[repo.id] = repo_transport(repo)
+
+        from abicheck import repoindex
+
+        index = repoindex.RepoIndex(
+            repoindex.index_path(self.config, self.arch), repos, expire, transports
+        )
+        with profiler.span("repo index refresh", "repo", config=self.config):
+            ok = index.refresh(force=self.refresh)
+        if not ok:
+            index.close()
+            return False
+        return index
+
+    def query(self):
+        """Return a query of the available packages of the session arch."""
+        return self.base.sack.query().available().filter(arch=self.arch)
+
+    def package_names(self):
+        """Return the names of all available packages."""
+        if self._names is None:
+            if self.index:
+                self._names = self.index.package_names(self.arch)
+            else:
+                self._names = [pkg.name for pkg in self.query()]
+        return self._names
+
+    def latest_rows(self, names, arches):
+        """Return {name: row} of the latest indexed package of arches of
+        every name, leaving out the names not available; see
+        RepoIndex.packages() for the rows.
+        """
+        import rpm
+
+        def evr(row):
+            return (row[4] or "0", row[5], row[6])
+
+        key = functools.cmp_to_key(lambda a, b: rpm.labelCompare(evr(a), evr(b)))
+        return dict(
+            (name, max(rows, key=key))
+            for name, rows in self.index.packages(names, arches).items()
+            if rows
+        )
+
+    def latest_nevras(self, names):
+        """Return {name: NEVRA} of the latest available package of every
+        name, leaving out the names not available.
+        """
+        result = dict()
+        if self.index:
+            from abicheck import repoindex
+
+            for name, row in self.latest_rows(names, [self.arch]).items():
+                result[name] = repoindex.nevra(*row[3:8])
+        else:
+            for pkg in self.query().filter(name=list(names)).latest():
+                result[pkg.name] = str(pkg)
+        return result
+
+    def revision(self):
+        """Return a fingerprint of the repo metadata the session answers
+        queries from, which changes whenever any of its repos does.
+        """
+        if self._revision is None:
+            digest = hashlib.sha256(self.config.encode())
+            if self.index:
+                for repo_id, checksum in self.index.revisions():
+                    digest.update(f"{repo_id}:{checksum}\n".encode())
+            else:
+                nevras = sorted(str(pkg) for pkg in self.query())
+                digest.update("\n".join(nevras).encode())
+            self._revision = digest.hexdigest()
+        return self._revision
+
+    def provides(self, substr):
+        """Return the names of the packages owning a file matching substr."""
+        self.logger.debug(f"Querying which package provides {substr}.")
+        if self.index:
+            pkgs_list = self.index.provides(substr, self.arch)
+        else:
+            pkgs_list = [pkg.name for pkg in self.query().filter(file__glob=substr)]
+        if pkgs_list:
+            self.logger.debug(f"{substr} is provides by {pkgs_list}")
+        else:
+            self.logger.debug(f"Not found package provide {substr}")
+        return pkgs_list
+
+    def resolve_sonames(self, sonames):
+        """Map every soname to the names of the packages providing it.
+
+        Exact "soname()(64bit)" provides, or the plain soname on 32-bit
+        arches, are looked up first in a single query; only the sonames
+        left unresolved fall back to one query for the files named the
+        soname, or the soname and a dot. The repo index answers instead of
+        the sack when it is available. Sonames nobody provides map to [].
+        """
+        # 32-bit packages provide the plain soname
+        suffix = "()(64bit)" if self.arch in ARCH_64BIT else ""
+        if self.index:
+            result = self.index.resolve_sonames(sonames, self.arch, suffix)
+        else:
+            result = self._sack_resolve_sonames(sonames, suffix)
+
+        for soname, pkgs in result.items():
+            if pkgs:
+                self.logger.debug(f"{soname} is provides by {pkgs}")
+            else:
+                self.logger.debug(f"Not found package provide {soname}")
+        return result
+
+    def _sack_resolve_sonames(self, sonames, suffix):
+        result = dict((soname, []) for soname in sonames)
+        wanted = dict((f"{soname}{suffix}", soname) for soname in result)
+        if wanted:
+            for pkg in self.query().filter(provides=list(wanted)):
+                for reldep in pkg.provides:
+                    soname = wanted.get(str(reldep))
+                    if soname and pkg.name not in result[soname]:
+                        result[soname].append(pkg.name)
+
+        # files named the soname or the soname and a dot, like the index
+        unresolved = [soname for soname, pkgs in result.items() if not pkgs]
+        if unresolved:
+            globs = [f"*/{soname}" for soname in unresolved]
+            globs += [f"*/{soname}.*" for soname in unresolved]
+            for pkg in self.query().filter(file__glob=globs):
+                for path in pkg.files:
+                    basename = os.path.basename(path)
+                    for soname in unresolved:
+                        if (
+                            basename == soname or basename.startswith(f"{soname}.")
+                        ) and pkg.name not in result[soname]:
+                            result[soname].append(pkg.name)
+        return result
+
+    def resolve_closure(self, names):
+        """Return the named packages plus their whole runtime dependency
+        closure, like "dnf download --resolve --alldeps" picks them.
+        """
+        query = self.query().latest()
+        pkgs = list()
+        for name in names:
+            found = query.filter(name=name)
+            if found:
+                pkgs.extend(found)
+            else:
+                self.logger.warning(f"No package {name} available for {self.arch}.")
+        if not pkgs:
+            return []
+
+        import hawkey
+
+        goal = hawkey.Goal(self.base.sack)
+        for pkg in pkgs:
+            goal.install(pkg)
+        if not goal.run():
+            self.logger.warning(
+                f"Can not resolve the dependencies of {names}: {goal.problems}"
+            )
+            return pkgs
+        return sorted(goal.list_installs(), key=lambda pkg: pkg.name)
+
+    def package_files(self, pkgs):
+        """Return the download.PackageFile of every package."""
+        import hawkey
+
+        files = list()
+        transports = dict()
+        for pkg in pkgs:
+            if pkg.reponame not in transports:
+                transports[pkg.reponame] = repo_transport(
+                    self.base.repos[pkg.reponame]
+                )
+            checksum_type, checksum = pkg.chksum
+            files.append(
+                download.PackageFile(
+                    pkg.name,
+                    pkg.remote_location(),
+                    os.path.basename(pkg.location),
+                    hawkey.chksum_name(checksum_type),
+                    checksum.hex(),
+                    pkg.downloadsize,
+                    transports[pkg.reponame],
+                )
+            )
+        return files
+
+    def index_package_files(self, rows):
+        """Return the download.PackageFile of every indexed package row."""
+        from abicheck import repoindex
+
+        files = list()
+        for repo_id, pkgid, checksum_type, name, *_, location, size in rows:
+            files.append(
+                download.PackageFile(
+                    name,
+                    repoindex.repo_file_url(self.index.baseurl(repo_id), location),
+                    os.path.basename(location),
+                    repoindex.hash_name(checksum_type),
+                    pkgid,
+                    size,
+                    self.index.transports.get(repo_id),
+                )
+            )
+        return files
+
+    def close(self):
+        with self._lock:
+            if self._index:
+                self._index.close()
+            self._index = None
+            if self._base is not None:
+                self._base.close()
+                self._base = None
+                self._filled = False
+            self._names = None
+            self._revision = None
+            if self._cache_lock is not None:
+                self._cache_lock.close()
+                self._cache_lock = None
+
+
+def get_session(config, arch, refresh=False):
+    """Return the shared session of config for arch, creating it if needed."""
+    key = (os.path.abspath(config), arch)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = RepoSession(config, arch, refresh=refresh)
+            _sessions[key] = session
+    return session
+
+
+def close_sessions():
+    """Release the sacks of every session opened by this process."""
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
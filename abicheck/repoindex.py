@@ -0,0 +1,581 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Persistent package index of a repo config.
+
+The primary and filelists metadata of every repo is parsed once into a SQLite
+database under TMP_DIR/index, mapping soname provides and file basenames to
+package NEVRAs. Only repomd.xml is fetched on later runs, and only once the
+metadata_expire of the repo passed since it was last checked; a repo is
+re-indexed only when its repomd revision or checksum changed.
+"""
+import bz2
+import collections
+import gzip
+import hashlib
+import logging
+import lzma
+import os
+import sqlite3
+import ssl
+import threading
+import time
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+import zlib
+
+from abicheck import utils
+
+INDEX_DIR = f"{utils.TMP_DIR}/index"
+
+NS_REPO = "{http://linux.duke.edu/metadata/repo}"
+NS_COMMON = "{http://linux.duke.edu/metadata/common}"
+NS_RPM = "{http://linux.duke.edu/metadata/rpm}"
+NS_FILELISTS = "{http://linux.duke.edu/metadata/filelists}"
+
+URL_TIMEOUT = 60
+BATCH_SIZE = 10000
+# sonames looked up per query, their parameters below the SQLite limit
+SONAME_CHUNK = 300
+# dnf's default metadata_expire in seconds, a negative one never expires
+DEFAULT_EXPIRE = 48 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS repos (
+    repo TEXT PRIMARY KEY, baseurl TEXT, revision TEXT, checksum TEXT,
+    checked REAL);
+CREATE TABLE IF NOT EXISTS packages (
+    pkgkey INTEGER PRIMARY KEY, repo TEXT, pkgid TEXT, checksum_type TEXT,
+    name TEXT, epoch TEXT, version TEXT, release TEXT, arch TEXT,
+    location TEXT, size INTEGER);
+CREATE TABLE IF NOT EXISTS provides (name TEXT, pkgkey INTEGER);
+CREATE TABLE IF NOT EXISTS requires (name TEXT, pkgkey INTEGER);
+CREATE TABLE IF NOT EXISTS dirs (dirkey INTEGER PRIMARY KEY, path TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS files (basename TEXT, dirkey INTEGER, pkgkey INTEGER);
+CREATE INDEX IF NOT EXISTS packages_repo ON packages (repo);
+CREATE INDEX IF NOT EXISTS packages_name ON packages (name);
+CREATE INDEX IF NOT EXISTS provides_name ON provides (name);
+CREATE INDEX IF NOT EXISTS provides_pkgkey ON provides (pkgkey);
+CREATE INDEX IF NOT EXISTS requires_pkgkey ON requires (pkgkey);
+CREATE INDEX IF NOT EXISTS files_basename ON files (basename);
+CREATE INDEX IF NOT EXISTS files_pkgkey ON files (pkgkey);
+"""
+
+
+# the network settings of a repo config: proxy url with its credentials,
+# whether to verify the server, CA file and client certificate and key
+Transport = collections.namedtuple(
+    "Transport",
+    "proxy proxy_username proxy_password sslverify sslcacert sslclientcert"
+    " sslclientkey",
+)
+
+
+class RepoIndexError(Exception):
+    """Raised when a repo can not be indexed from its metadata."""
+
+
+def nevra(name, epoch, version, release, arch):
+    """Format a package NEVRA the way dnf prints it."""
+    if epoch and epoch != "0":
+        return f"{name}-{epoch}:{version}-{release}.{arch}"
+    return f"{name}-{version}-{release}.{arch}"
+
+
+def hash_name(checksum_type):
+    """Return the hashlib name of a repo metadata checksum type."""
+    if checksum_type == "sha":
+        return "sha1"
+    return checksum_type
+
+
+def repo_file_url(baseurl, href):
+    """Join a repo baseurl and a metadata or package location href."""
+    if not baseurl.endswith("/"):
+        baseurl += "/"
+    return urllib.parse.urljoin(baseurl, href)
+
+
+def _opener(transport):
+    handlers = list()
+    if transport.proxy:
+        proxy = transport.proxy
+        if transport.proxy_username:
+            scheme, sep, rest = proxy.rpartition("://")
+            credentials = urllib.parse.quote(transport.proxy_username, safe="")
+            if transport.proxy_password:
+                password = urllib.parse.quote(transport.proxy_password, safe="")
+                credentials += f":{password}"
+            proxy = f"{scheme}{sep}{credentials}@{rest}"
+        handlers.append(urllib.request.ProxyHandler({"http": proxy, "https": proxy}))
+    context = ssl.create_default_context(cafile=transport.sslcacert or None)
+    if not transport.sslverify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if transport.sslclientcert:
+        context.load_cert_chain(transport.sslclientcert, transport.sslclientkey or None)
+    handlers.append(urllib.request.HTTPSHandler(context=context))
+    return urllib.request.build_opener(*handlers)
+
+
+def open_url(url, headers=None, transport=None):
+    """Open a http(s):// or file:// url, or a local path, for reading,
+    through the proxy and with the TLS settings of the Transport.
+    """
+    if "://" not in url:
+        return open(url, "rb")
+    request = urllib.request.Request(url, headers=headers or dict())
+    if transport is None:
+        return urllib.request.urlopen(request, timeout=URL_TIMEOUT)
+    return _opener(transport).open(request, timeout=URL_TIMEOUT)
+
+
+class _HashingReader(object):
+    """File-like wrapper hashing every byte read through it."""
+
+    def __init__(self, fileobj, checksum_type):
+        self.fileobj = fileobj
+        self.hash = hashlib.new(checksum_type)
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hash.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+def _decompressed(fileobj, href):
+    """Return a stream decompressing fileobj according to its extension."""
+    if href.endswith(".gz"):
+        return gzip.GzipFile(fileobj=fileobj)
+    if href.endswith(".xz"):
+        return lzma.LZMAFile(fileobj)
+    if href.endswith(".bz2"):
+        return bz2.BZ2File(fileobj)
+    if href.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise RepoIndexError(f"python3-zstandard is required to read {href}")
+        return zstandard.ZstdDecompressor().stream_reader(fileobj)
+    return fileobj
+
+
+def _iter_elements(stream, tag):
+    """Yield every complete tag element of an xml stream, then drop it."""
+    context = ET.iterparse(stream, events=("start", "end"))
+    _, root = next(context)
+    for event, elem in context:
+        if event == "end" and elem.tag == tag:
+            yield elem
+            root.clear()
+
+
+def parse_repomd(content):
+    """Return the revision and the {type: (href, checksum_type, checksum)}
+    metadata locations listed in repomd.xml content.
+    """
+    root = ET.fromstring(content)
+    revision = root.findtext(f"{NS_REPO}revision", default="")
+    data = dict()
+    for elem in root.findall(f"{NS_REPO}data"):
+        location = elem.find(f"{NS_REPO}location")
+        checksum = elem.find(f"{NS_REPO}checksum")
+        if location is None or checksum is None:
+            continue
+        data[elem.get("type")] = (
+            location.get("href"),
+            hash_name(checksum.get("type")),
+            checksum.text.strip(),
+        )
+    return revision, data
+
+
+class RepoIndex(object):
+    """SQLite index of the packages, provides and files of a set of repos.
+
+    repos is a list of (repo_id, baseurl) pairs, usually taken from the
+    configured dnf base of a repo session, and expire the {repo_id:
+    metadata_expire} in seconds of the repos not expiring by DEFAULT_EXPIRE.
+    """
+
+    def __init__(self, path, repos, expire=None, transports=None):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.repos = repos
+        self.expire = expire or dict()
+        # {repo: Transport} of the repos not reached directly
+        self.transports = transports or dict()
+        self._lock = threading.Lock()
+        utils.mkdir_p(os.path.dirname(path))
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        tables = [
+            name
+            for name, in self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        ]
+        self.conn.executescript(SCHEMA)
+        if "repos" in tables and "requires" not in tables:
+            # indexes written before the requires were kept, index again
+            with self.conn:
+                self.conn.execute("DELETE FROM repos")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(repos)")]
+        if "checked" not in columns:
+            # indexes written before the expiry was kept
+            with self.conn:
+                self.conn.execute("ALTER TABLE repos ADD COLUMN checked REAL")
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def _is_fresh(self, repo_id, baseurl):
+        row = self.conn.execute(
+            "SELECT checked FROM repos WHERE repo = ? AND baseurl = ?",
+            (repo_id, baseurl),
+        ).fetchone()
+        if row is None or row[0] is None:
+            return False
+        expire = self.expire.get(repo_id, DEFAULT_EXPIRE)
+        return expire < 0 or time.time() - row[0] < expire
+
+    def refresh(self, force=False):
+        """Re-index every repo whose repomd changed, checking only the
+        repos whose metadata expired unless force is given.
+
+        Return False if any repo could not be indexed, in which case the
+        index must not be used to answer queries.
+        """
+        ok = True
+        # the rows of repos dropped from the config must not answer queries
+        configured = set(repo_id for repo_id, _ in self.repos)
+        with self._lock:
+            indexed = self.conn.execute(
+                "SELECT repo FROM repos UNION SELECT repo FROM packages"
+            ).fetchall()
+        for repo_id, in indexed:
+            if repo_id not in configured:
+                self.logger.info(
+                    f"Dropping the index of repo {repo_id}, no longer configured."
+                )
+                with self._lock, self.conn:
+                    self._drop_repo(repo_id)
+        for repo_id, baseurl in self.repos:
+            if not force and self._is_fresh(repo_id, baseurl):
+                self.logger.debug(f"Metadata of repo {repo_id} has not expired.")
+                continue
+            try:
+                self._refresh_repo(repo_id, baseurl)
+            except (OSError, EOFError, lzma.LZMAError, zlib.error, ET.ParseError,
+                    RepoIndexError, sqlite3.Error) as e:
+                row = self.conn.execute(
+                    "SELECT revision FROM repos WHERE repo = ? AND baseurl = ?",
+                    (repo_id, baseurl),
+                ).fetchone()
+                if row is None:
+                    self.logger.warning(f"Can not index repo {repo_id}: {e}")
+                    ok = False
+                else:
+                    self.logger.warning(
+                        f"Can not check repo {repo_id} for updates ({e}),"
+                        f" using its index of revision {row[0]}."
+                    )
+        return ok
+
+    def _refresh_repo(self, repo_id, baseurl):
+        with open_url(
+            repo_file_url(baseurl, "repodata/repomd.xml"),
+            transport=self.transports.get(repo_id),
+        ) as f:
+            content = f.read()
+        checksum = hashlib.sha256(content).hexdigest()
+        revision, data = parse_repomd(content)
+
+        row = self.conn.execute(
+            "SELECT baseurl, revision, checksum FROM repos WHERE repo = ?",
+            (repo_id,),
+        ).fetchone()
+        if row == (baseurl, revision, checksum):
+            self.logger.debug(f"Index of repo {repo_id} is up to date.")
+            with self._lock, self.conn:
+                self.conn.execute(
+                    "UPDATE repos SET checked = ? WHERE repo = ?", (time.time(), repo_id)
+                )
+            return
+        for mdtype in ("primary", "filelists"):
+            if mdtype not in data:
+                raise RepoIndexError(f"repo {repo_id} has no {mdtype} metadata")
+
+        self.logger.info(f"Indexing metadata of repo {repo_id} ...")
+        with self._lock, self.conn:
+            self._drop_repo(repo_id)
+            pkgkeys = self._load_primary(repo_id, baseurl, data["primary"])
+            self._load_filelists(repo_id, baseurl, data["filelists"], pkgkeys)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO repos VALUES (?, ?, ?, ?, ?)",
+                (repo_id, baseurl, revision, checksum, time.time()),
+            )
+        self.logger.info(f"Repo {repo_id} indexed, {len(pkgkeys)} packages.")
+
+    def _drop_repo(self, repo_id):
+        subquery = "SELECT pkgkey FROM packages WHERE repo = ?"
+        self.conn.execute(f"DELETE FROM files WHERE pkgkey IN ({subquery})", (repo_id,))
+        self.conn.execute(f"DELETE FROM provides WHERE pkgkey IN ({subquery})", (repo_id,))
+        self.conn.execute(f"DELETE FROM requires WHERE pkgkey IN ({subquery})", (repo_id,))
+        self.conn.execute("DELETE FROM packages WHERE repo = ?", (repo_id,))
+        self.conn.execute("DELETE FROM repos WHERE repo = ?", (repo_id,))
+
+    def _open_metadata(self, repo_id, baseurl, location):
+        href, checksum_type, checksum = location
+        url = repo_file_url(baseurl, href)
+        reader = _HashingReader(
+            open_url(url, transport=self.transports.get(repo_id)), checksum_type
+        )
+        return reader, _decompressed(reader, href), checksum
+
+    @staticmethod
+    def _verify(reader, checksum, href):
+        # drain what the parser left unread so the whole file gets hashed
+        while reader.read(1024 * 1024):
+            pass
+        if reader.hexdigest() != checksum:
+            raise RepoIndexError(f"checksum mismatch of {href}")
+
+    def _load_primary(self, repo_id, baseurl, location):
+        pkgkeys = dict()
+        provides = list()
+        requires = list()
+        reader, stream, checksum = self._open_metadata(repo_id, baseurl, location)
+        with reader.fileobj:
+            for elem in _iter_elements(stream, f"{NS_COMMON}package"):
+                if elem.get("type") != "rpm":
+                    continue
+                version = elem.find(f"{NS_COMMON}version")
+                pkg_checksum = elem.find(f"{NS_COMMON}checksum")
+                size = elem.find(f"{NS_COMMON}size")
+                cursor = self.conn.execute(
+                    "INSERT INTO packages (repo, pkgid, checksum_type, name, epoch,"
+                    " version, release, arch, location, size)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        repo_id,
+                        pkg_checksum.text.strip(),
+                        pkg_checksum.get("type"),
+                        elem.findtext(f"{NS_COMMON}name"),
+                        version.get("epoch", "0"),
+                        version.get("ver"),
+                        version.get("rel"),
+                        elem.findtext(f"{NS_COMMON}arch"),
+                        elem.find(f"{NS_COMMON}location").get("href"),
+                        int(size.get("package", 0)) if size is not None else 0,
+                    ),
+                )
+                pkgkey = cursor.lastrowid
+                pkgkeys[pkg_checksum.text.strip()] = pkgkey
+                for entry in elem.iterfind(
+                    f"{NS_COMMON}format/{NS_RPM}provides/{NS_RPM}entry"
+                ):
+                    provides.append((entry.get("name"), pkgkey))
+                for entry in elem.iterfind(
+                    f"{NS_COMMON}format/{NS_RPM}requires/{NS_RPM}entry"
+                ):
+                    if not entry.get("name", "").startswith("rpmlib("):
+                        requires.append((entry.get("name"), pkgkey))
+                if len(provides) >= BATCH_SIZE:
+                    self.conn.executemany("INSERT INTO provides VALUES (?, ?)", provides)
+                    provides = list()
+                if len(requires) >= BATCH_SIZE:
+                    self.conn.executemany("INSERT INTO requires VALUES (?, ?)", requires)
+                    requires = list()
+            self.conn.executemany("INSERT INTO provides VALUES (?, ?)", provides)
+            self.conn.executemany("INSERT INTO requires VALUES (?, ?)", requires)
+            self._verify(reader, checksum, location[0])
+        return pkgkeys
+
+    def _load_filelists(self, repo_id, baseurl, location, pkgkeys):
+        dirkeys = dict(self.conn.execute("SELECT path, dirkey FROM dirs"))
+        files = list()
+        reader, stream, checksum = self._open_metadata(repo_id, baseurl, location)
+        with reader.fileobj:
+            for elem in _iter_elements(stream, f"{NS_FILELISTS}package"):
+                pkgkey = pkgkeys.get(elem.get("pkgid"))
+                if pkgkey is None:
+                    continue
+                for file_elem in elem.iterfind(f"{NS_FILELISTS}file"):
+                    if file_elem.get("type") == "dir" or not file_elem.text:
+                        continue
+                    dirname, basename = os.path.split(file_elem.text)
+                    dirkey = dirkeys.get(dirname)
+                    if dirkey is None:
+                        cursor = self.conn.execute(
+                            "INSERT INTO dirs (path) VALUES (?)", (dirname,)
+                        )
+                        dirkey = dirkeys[dirname] = cursor.lastrowid
+                    files.append((basename, dirkey, pkgkey))
+                if len(files) >= BATCH_SIZE:
+                    self.conn.executemany("INSERT INTO files VALUES (?, ?, ?)", files)
+                    files = list()
+            self.conn.executemany("INSERT INTO files VALUES (?, ?, ?)", files)
+            self._verify(reader, checksum, location[0])
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def revisions(self):
+        """Return the (repo, repomd checksum) of every indexed repo."""
+        return self._query("SELECT repo, checksum FROM repos ORDER BY repo")
+
+    def package_names(self, arch):
+        """Return the names of all indexed packages of arch."""
+        rows = self._query(
+            "SELECT DISTINCT name FROM packages WHERE arch = ? ORDER BY pkgkey",
+            (arch,),
+        )
+        return [name for name, in rows]
+
+    def packages(self, names, arches):
+        """Return {name: [row, ...]} of the package rows of arches named
+        names.
+
+        Every row is a (repo, pkgid, checksum_type, name, epoch, version,
+        release, arch, location, size) tuple.
+        """
+        result = dict()
+        marks = ", ".join("?" * len(arches))
+        for name in names:
+            result[name] = self._query(
+                "SELECT repo, pkgid, checksum_type, name, epoch, version,"
+                " release, arch, location, size FROM packages"
+                f" WHERE name = ? AND arch IN ({marks}) ORDER BY pkgkey",
+                [name] + list(arches),
+            )
+        return result
+
+    def baseurl(self, repo_id):
+        """Return the baseurl the repo is indexed from."""
+        return dict(self.repos).get(repo_id)
+
+    def requires(self, row):
+        """Return the names of the requires of a package row."""
+        rows = self._query(
+            "SELECT DISTINCT r.name FROM requires r"
+            " JOIN packages p ON p.pkgkey = r.pkgkey"
+            " WHERE p.repo = ? AND p.pkgid = ?",
+            (row[0], row[1]),
+        )
+        return [name for name, in rows]
+
+    def providers(self, requires, arches):
+        """Map every require name to the names of the packages of arches
+        providing it, a file require to those owning the file.
+        """
+        result = dict((name, []) for name in requires)
+        marks = ", ".join("?" * len(arches))
+        for name in result:
+            if name.startswith("/"):
+                dirname, basename = os.path.split(name)
+                rows = self._query(
+                    "SELECT DISTINCT p.name FROM files f"
+                    " JOIN dirs d ON d.dirkey = f.dirkey"
+                    " JOIN packages p ON p.pkgkey = f.pkgkey"
+                    f" WHERE f.basename = ? AND d.path = ? AND p.arch IN ({marks})"
+                    " ORDER BY p.pkgkey",
+                    [basename, dirname] + list(arches),
+                )
+            else:
+                rows = self._query(
+                    "SELECT DISTINCT p.name FROM provides v"
+                    " JOIN packages p ON p.pkgkey = v.pkgkey"
+                    f" WHERE v.name = ? AND p.arch IN ({marks})"
+                    " ORDER BY p.pkgkey",
+                    [name] + list(arches),
+                )
+            result[name] = [pkg for pkg, in rows]
+        return result
+
+    def resolve_sonames(self, sonames, arch, suffix):
+        """Map every soname to the names of the packages providing it.
+
+        The exact "soname" + suffix provides are looked up first, then the
+        packages shipping a file whose name is the soname or starts with
+        the soname and a dot, like RepoSession.resolve_sonames() does on
+        the sack. All sonames are looked up at once, per chunk.
+        """
+        result = dict((soname, []) for soname in sonames)
+        self._join_sonames(
+            result,
+            "SELECT w.soname, p.name FROM wanted w"
+            " JOIN provides v ON v.name = w.soname || ?"
+            " JOIN packages p ON p.pkgkey = v.pkgkey"
+            " WHERE p.arch = ? ORDER BY p.pkgkey",
+            (suffix, arch),
+        )
+        # "soname.*" are the names from "soname." up to "soname/"
+        self._join_sonames(
+            result,
+            "SELECT w.soname, p.name, p.pkgkey FROM wanted w"
+            " JOIN files f ON f.basename = w.soname"
+            " JOIN packages p ON p.pkgkey = f.pkgkey WHERE p.arch = ?"
+            " UNION ALL"
+            " SELECT w.soname, p.name, p.pkgkey FROM wanted w"
+            " JOIN files f ON f.basename >= w.soname || '.'"
+            " AND f.basename < w.soname || '/'"
+            " JOIN packages p ON p.pkgkey = f.pkgkey WHERE p.arch = ?"
+            " ORDER BY 3",
+            (arch, arch),
+        )
+        return result
+
+    def _join_sonames(self, result, sql, params):
+        """Run sql joining the sonames of result without packages yet as
+        the wanted table, and add the (soname, package name) rows it
+        returns to result.
+        """
+        sonames = [soname for soname, pkgs in result.items() if not pkgs]
+        for i in range(0, len(sonames), SONAME_CHUNK):
+            chunk = sonames[i : i + SONAME_CHUNK]
+            values = ", ".join(["(?)"] * len(chunk))
+            rows = self._query(
+                f"WITH wanted (soname) AS (VALUES {values}) {sql}",
+                chunk + list(params),
+            )
+            for soname, name, *_ in rows:
+                if name not in result[soname]:
+                    result[soname].append(name)
+
+    def provides(self, pattern, arch):
+        """Return the names of the packages owning a file matching the glob."""
+        rows = self._query(
+            "SELECT DISTINCT p.name FROM files f"
+            " JOIN dirs d ON d.dirkey = f.dirkey"
+            " JOIN packages p ON p.pkgkey = f.pkgkey"
+            " WHERE d.path || '/' || f.basename GLOB ? AND p.arch = ?"
+            " ORDER BY p.pkgkey",
+            (pattern, arch),
+        )
+        return [name for name, in rows]
+
+
+def index_path(config, arch):
+    """Return where the index of a repo config for arch is stored."""
+    name = os.path.splitext(os.path.basename(config))[0]
+    digest = hashlib.sha1(os.path.abspath(config).encode()).hexdigest()[:8]
+    return os.path.join(INDEX_DIR, f"{name}-{arch}-{digest}.sqlite")
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Summary reports over the per-library abi-compliance-checker reports.
+
+abi-compliance-checker leads every html report with meta data comments like
+<!-- kind:binary;verdict:compatible;affected:0;added:0;removed:0;... -->,
+which are parsed here and composed into index pages linking the reports.
+"""
+import collections
+import html
+import posixpath
+import re
+
+META_RE = re.compile(r"<!--\s*((?:\w+:[^;]*;)+)\s*-->")
+KINDS = ("binary", "source")
+
+# soname: the library, old/new: the NEVRAs compared, report: path of the
+# per-library report relative to the index, meta: {kind: {key: value}}
+LibraryResult = collections.namedtuple(
+    "LibraryResult", "soname old new report meta"
+)
+
+STYLE = """
+body { font-family: Arial, sans-serif; font-size: 0.875em; }
+h1 { font-size: 1.5em; }
+table.summary { border-collapse: collapse; }
+table.summary th, table.summary td {
+    border: 1px solid #b3b3b3; padding: 3px 8px; text-align: left; }
+table.summary th { background-color: #eeeeee; }
+td.compatible { background-color: #ccffcc; }
+td.incompatible { background-color: #ffcccc; }
+td.missing { background-color: #eeeeee; }
+div.tabset { float: left; }
+a.tab { border: 1px solid #aaaaaa; float: left; margin: 0 0 -1px 0;
+    padding: 4px 5px; text-align: center; text-decoration: none;
+    color: #333333; background-color: #eeeeee; }
+a.active { background-color: white; border-bottom-color: white; }
+div.tab { border-top: 1px solid #aaaaaa; clear: left; padding: 1em 0; }
+div.footer { font-size: 0.75em; }
+"""
+
+SCRIPT = """
+function showTab(active) {
+    var tabs = document.querySelectorAll("div.tabset a.tab");
+    for (var i = 0; i < tabs.length; i++) {
+        var on = tabs[i] == active;
+        tabs[i].className = on ? "tab active" : "tab disabled";
+        var div = document.getElementById(tabs[i].getAttribute("href").substring(1));
+        if (div) {
+            div.style.display = on ? "block" : "none";
+        }
+    }
+}
+window.onload = function() {
+    var tabs = document.querySelectorAll("div.tabset a.tab");
+    for (var i = 0; i < tabs.length; i++) {
+        tabs[i].onclick = function() { showTab(this); return false; };
+    }
+    showTab(tabs[0]);
+};
+"""
+
+
+def parse_meta(path):
+    """Return {kind: {key: value}} of the meta data of a report.
+
+    A report of a single kind without a kind: field counts as binary.
+    """
+    meta = dict()
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            head = f.read(4096)
+    except OSError:
+        return meta
+    for match in META_RE.finditer(head):
+        fields = dict(
+            item.split(":", 1) for item in match.group(1).split(";") if ":" in item
+        )
+        meta[fields.pop("kind", "binary")] = fields
+    return meta
+
+
+def verdict(result, kind="binary"):
+    """Return the verdict of a LibraryResult, "missing" without a report."""
+    return result.meta.get(kind, {}).get("verdict", "missing")
+
+
+def _result_rows(results, kind):
+    rows = list()
+    for result in results:
+        fields = result.meta.get(kind, {})
+        status = verdict(result, kind)
+        rate = "-"
+        if "affected" in fields:
+            rate = f"{100 - float(fields['affected']):g}%"
+        link = "-"
+        if result.report:
+            link = f"<a href='{html.escape(result.report)}'>report</a>"
+        rows.append(
+            "<tr>"
+            f"<td>{html.escape(result.soname)}</td>"
+            f"<td>{html.escape(result.old or '-')}</td>"
+            f"<td>{html.escape(result.new or '-')}</td>"
+            f"<td class='{status}'>{status}</td>"
+            f"<td>{rate}</td>"
+            f"<td>{fields.get('added', '-')}</td>"
+            f"<td>{fields.get('removed', '-')}</td>"
+            f"<td>{link}</td>"
+            "</tr>\n"
+        )
+    return "".join(rows)
+
+
+def _write_head(f, title):
+    f.write("<!DOCTYPE html>\n<html>\n<head>\n")
+    f.write("<meta http-equiv='Content-Type' content='text/html; charset=utf-8'/>\n")
+    f.write(f"<title>{html.escape(title)}</title>\n")
+    f.write(f"<style type='text/css'>{STYLE}</style>\n")
+    f.write(f"<script type='text/javascript'>{SCRIPT}</script>\n")
+    f.write("</head>\n<body>\n")
+    f.write(f"<h1>{html.escape(title)}</h1>\n")
+
+
+def _write_footer(f):
+    f.write("<hr/>\n<div class='footer' align='right'>")
+    f.write("<i>Generated by abi-info-check</i>\n</div>\n")
+    f.write("</body></html>\n")
+
+
+def overall_verdict(results, kind="binary"):
+    """Return the worst verdict of a list of LibraryResults."""
+    verdicts = set(verdict(result, kind) for result in results)
+    for worst in ("incompatible", "missing"):
+        if worst in verdicts:
+            return worst
+    return "compatible"
+
+
+def write_library_index(path, title, results, graphs=()):
+    """Write the index page of the per-library reports of one comparison.
+
+    The page has one tab per report kind, then one per graph of graphs,
+    (name, label, image) tuples with the path of the image relative to the
+    index.
+    """
+    header = (
+        "<tr><th>Library</th><th>Old package</th><th>New package</th>"
+        "<th>Verdict</th><th>Compatibility</th><th>Added</th>"
+        "<th>Removed</th><th>Report</th></tr>\n"
+    )
+    with open(path, "w", encoding="utf-8") as f:
+        _write_head(f, title)
+        f.write("<div class='tabset'>\n")
+        f.write(
+            "<a id='BinaryID' href='#BinaryTab' class='tab active'>"
+            "Binary<br/>Compatibility</a>\n"
+        )
+        f.write(
+            "<a id='SourceID' href='#SourceTab' style='margin-left:3px'"
+            " class='tab disabled'>Source<br/>Compatibility</a>\n"
+        )
+        for name, label, _ in graphs:
+            label = html.escape(label).replace(" ", "<br/>")
+            f.write(
+                f"<a id='{name}ID' href='#{name}Tab' style='margin-left:3px'"
+                f" class='tab disabled'>{label}</a>\n"
+            )
+        f.write("</div>\n")
+        for kind in KINDS:
+            f.write(f"<div id='{kind.capitalize()}Tab' class='tab'>\n")
+            f.write("<table class='summary'>\n")
+            f.write(header)
+            f.write(_result_rows(results, kind))
+            f.write("</table>\n</div>\n")
+        for name, _, image in graphs:
+            f.write(f"<div id='{name}Tab' class='tab'>\n")
+            f.write("<div style='text-align:center;vertical-align:middle;'>")
+            f.write(
+                "<img style='margin: auto; max-width:90%; max-height: 90%;"
+                " background-color: hsl(0, 0%, 100%)'"
+                f" src='{html.escape(image)}'>"
+            )
+            f.write("</div>\n</div>\n")
+        _write_footer(f)
+
+
+def write_batch_index(path, title, entries, quick_failed=()):
+    """Write the index page of a batch of binaries.
+
+    entries are (binary, path of its report relative to the index,
+    [LibraryResult]) tuples, quick_failed (binary, path of its symbol
+    binding report, summary) tuples of the binaries failing the precheck.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        _write_head(f, title)
+        f.write("<table class='summary'>\n")
+        f.write(
+            "<tr><th>Binary</th><th>Libraries</th><th>Incompatible</th>"
+            "<th>Missing</th><th>Verdict</th><th>Report</th></tr>\n"
+        )
+        for binary, report, results in entries:
+            verdicts = [verdict(result) for result in results]
+            status = overall_verdict(results) if report else "missing"
+            link = "-"
+            if report:
+                link = f"<a href='{html.escape(report)}'>report</a>"
+            f.write(
+                "<tr>"
+                f"<td>{html.escape(binary)}</td>"
+                f"<td>{len(results)}</td>"
+                f"<td>{verdicts.count('incompatible')}</td>"
+                f"<td>{verdicts.count('missing')}</td>"
+                f"<td class='{status}'>{status}</td>"
+                f"<td>{link}</td>"
+                "</tr>\n"
+            )
+        for binary, report, summary in quick_failed:
+            f.write(
+                "<tr>"
+                f"<td>{html.escape(binary)}</td>"
+                f"<td colspan='3'>{html.escape(summary)}</td>"
+                "<td class='incompatible'>incompatible</td>"
+                f"<td><a href='{html.escape(report)}'>symbols</a></td>"
+                "</tr>\n"
+            )
+        f.write("</table>\n")
+        _write_footer(f)
+
+
+def write_release_matrix(path, title, sonames, columns):
+    """Write a release x library verdict matrix.
+
+    columns are (release, path of its report relative to the matrix,
+    [LibraryResult]) tuples; the per-library reports are linked relative
+    to the directory of the release report.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        _write_head(f, title)
+        f.write("<table class='summary'>\n<tr><th>Library</th>")
+        for release, report, _ in columns:
+            if report:
+                link = f"<a href='{html.escape(report)}'>{html.escape(release)}</a>"
+                f.write(f"<th>{link}</th>")
+            else:
+                f.write(f"<th>{html.escape(release)}</th>")
+        f.write("</tr>\n")
+
+        by_release = [
+            (report, dict((result.soname, result) for result in results))
+            for _, report, results in columns
+        ]
+        for soname in sonames:
+            f.write(f"<tr><td>{html.escape(soname)}</td>")
+            for report, results in by_release:
+                result = results.get(soname)
+                if result is None or not report:
+                    f.write("<td class='missing'>missing</td>")
+                    continue
+                status = verdict(result)
+                text = status
+                if result.report:
+                    base = posixpath.dirname(report)
+                    link = posixpath.join(base, result.report)
+                    text = f"<a href='{html.escape(link)}'>{status}</a>"
+                f.write(f"<td class='{status}'>{text}</td>")
+            f.write("</tr>\n")
+
+        f.write("<tr><th>Overall</th>")
+        for _, report, results in columns:
+            status = overall_verdict(results) if report else "missing"
+            f.write(f"<td class='{status}'>{status}</td>")
+        f.write("</tr>\n</table>\n")
+        _write_footer(f)
+
+
+def write_delta_report(path, title, used, verdicts, breaking):
+    """Write the report of one library from the delta database.
+
+    used are the (symbol, version) imports of the binary the old library
+    exports, verdicts the deltadb.Verdicts affecting them and breaking the
+    severities counted as incompatible. The report leads with the same meta
+    data comment as those of abi-compliance-checker, so that parse_meta()
+    reads both alike.
+    """
+    affected = set(
+        (v.symbol, v.version) for v in verdicts if v.severity in breaking
+    )
+    removed = set(
+        v.symbol for v in verdicts if v.verdict in ("removed", "version_dropped")
+    )
+    status = "incompatible" if affected else "compatible"
+    rate = 100.0 * len(affected) / len(used) if used else 0.0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(
+            f"<!-- kind:binary;verdict:{status};affected:{rate:.2f};"
+            f"added:0;removed:{len(removed)};-->\n"
+        )
+        _write_head(f, title)
+        f.write(
+            f"<p>{len(used)} symbols used, {len(affected)} affected,"
+            " from the delta database.</p>\n"
+        )
+        f.write("<table class='summary'>\n")
+        f.write(
+            "<tr><th>Symbol</th><th>Version</th><th>Verdict</th>"
+            "<th>Severity</th><th>Detail</th></tr>\n"
+        )
+        for v in verdicts:
+            css = "incompatible" if v.severity in breaking else "compatible"
+            f.write(
+                "<tr>"
+                f"<td>{html.escape(v.symbol)}</td>"
+                f"<td>{html.escape(v.version or '-')}</td>"
+                f"<td class='{css}'>{html.escape(v.verdict)}</td>"
+                f"<td>{html.escape(v.severity or '-')}</td>"
+                f"<td>{html.escape(v.detail or '')}</td>"
+                "</tr>\n"
+            )
+        f.write("</table>\n")
+        _write_footer(f)
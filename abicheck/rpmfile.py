@@ -0,0 +1,556 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+In-process RPM reading and payload extraction.
+
+Reads the lead, signature and header of an RPM, then streams the payload
+through its decompressor and the cpio newc parser, writing only the paths a
+filter selects. This replaces the rpm2cpio | cpio -dim pipeline: nothing is
+spawned, the process-wide cwd is left alone and the packages of a chroot
+are extracted in a process pool.
+"""
+import bz2
+import gzip
+import logging
+import lzma
+import multiprocessing
+import os
+import posixpath
+import re
+import stat
+import struct
+import zlib
+from concurrent import futures
+
+from abicheck import utils
+
+LEAD_MAGIC = b"\xed\xab\xee\xdb"
+LEAD_SIZE = 96
+HEADER_MAGIC = b"\x8e\xad\xe8\x01"
+CPIO_NEWC_MAGIC = b"070701"
+CPIO_CRC_MAGIC = b"070702"
+CPIO_TRAILER = "TRAILER!!!"
+CHUNK_SIZE = 1024 * 1024
+
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_EPOCH = 1003
+RPMTAG_ARCH = 1022
+RPMTAG_FILEMODES = 1030
+RPMTAG_FILELINKTOS = 1036
+RPMTAG_DIRINDEXES = 1116
+RPMTAG_BASENAMES = 1117
+RPMTAG_DIRNAMES = 1118
+RPMTAG_PAYLOADFORMAT = 1124
+RPMTAG_PAYLOADCOMPRESSOR = 1125
+
+RPM_CHAR_TYPE = 1
+RPM_INT8_TYPE = 2
+RPM_INT16_TYPE = 3
+RPM_INT32_TYPE = 4
+RPM_INT64_TYPE = 5
+RPM_STRING_TYPE = 6
+RPM_BIN_TYPE = 7
+RPM_STRING_ARRAY_TYPE = 8
+RPM_I18NSTRING_TYPE = 9
+
+_INT_FORMATS = {
+    RPM_CHAR_TYPE: "B",
+    RPM_INT8_TYPE: "B",
+    RPM_INT16_TYPE: "H",
+    RPM_INT32_TYPE: "I",
+    RPM_INT64_TYPE: "Q",
+}
+
+
+class RPMError(Exception):
+    """Raised when an RPM can not be read or extracted."""
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise RPMError("unexpected end of file")
+    return data
+
+
+def read_header(f):
+    """Read a header structure at the current position of f.
+
+    Return {tag: value}; strings are decoded, arrays returned as lists.
+    """
+    intro = _read_exact(f, 16)
+    if intro[:4] != HEADER_MAGIC:
+        raise RPMError("bad header magic")
+    nindex, hsize = struct.unpack(">II", intro[8:16])
+    index = _read_exact(f, nindex * 16)
+    store = _read_exact(f, hsize)
+
+    tags = dict()
+    for i in range(nindex):
+        tag, typ, offset, count = struct.unpack_from(">IIiI", index, i * 16)
+        if typ in _INT_FORMATS:
+            fmt = _INT_FORMATS[typ]
+            tags[tag] = list(struct.unpack_from(f">{count}{fmt}", store, offset))
+        elif typ in (RPM_STRING_TYPE, RPM_STRING_ARRAY_TYPE, RPM_I18NSTRING_TYPE):
+            values = list()
+            pos = offset
+            for _ in range(count):
+                end = store.index(b"\0", pos)
+                values.append(store[pos:end].decode("utf-8", "surrogateescape"))
+                pos = end + 1
+            tags[tag] = values[0] if typ == RPM_STRING_TYPE else values
+        elif typ == RPM_BIN_TYPE:
+            tags[tag] = store[offset : offset + count]
+    return tags
+
+
+def _payload_stream(fileobj, compressor):
+    if compressor == "gzip":
+        return gzip.GzipFile(fileobj=fileobj)
+    if compressor in ("xz", "lzma"):
+        return lzma.LZMAFile(fileobj)
+    if compressor == "bzip2":
+        return bz2.BZ2File(fileobj)
+    if compressor == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RPMError("python3-zstandard is required for zstd payloads")
+        return zstandard.ZstdDecompressor().stream_reader(fileobj)
+    if compressor in ("", "identity"):
+        return fileobj
+    raise RPMError(f"unsupported payload compressor {compressor}")
+
+
+class RPMFile(object):
+    """An RPM package file, used as a context manager.
+
+    The header is read on open; the payload is only read by payload() and
+    extract().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            lead = _read_exact(self._file, LEAD_SIZE)
+            if lead[:4] != LEAD_MAGIC:
+                raise RPMError(f"{path} is not an rpm file")
+            start = self._file.tell()
+            read_header(self._file)
+            # the signature header is padded to 8 bytes
+            self._file.seek((self._file.tell() - start + 7) // 8 * 8 + start)
+            self.header = read_header(self._file)
+            self.payload_offset = self._file.tell()
+        except RPMError as e:
+            self._file.close()
+            raise RPMError(f"{path}: {e}")
+        except Exception:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def name(self):
+        return self.header.get(RPMTAG_NAME, "")
+
+    @property
+    def version(self):
+        return self.header.get(RPMTAG_VERSION, "")
+
+    @property
+    def release(self):
+        return self.header.get(RPMTAG_RELEASE, "")
+
+    @property
+    def epoch(self):
+        epoch = self.header.get(RPMTAG_EPOCH)
+        return epoch[0] if epoch else 0
+
+    @property
+    def arch(self):
+        return self.header.get(RPMTAG_ARCH, "")
+
+    @property
+    def nevra(self):
+        epoch = f"{self.epoch}:" if self.epoch else ""
+        return f"{self.name}-{epoch}{self.version}-{self.release}.{self.arch}"
+
+    @property
+    def payload_compressor(self):
+        return self.header.get(RPMTAG_PAYLOADCOMPRESSOR, "gzip")
+
+    def files(self):
+        """Return [(path, mode, linkto)] of the files listed in the header."""
+        basenames = self.header.get(RPMTAG_BASENAMES, [])
+        dirnames = self.header.get(RPMTAG_DIRNAMES, [])
+        dirindexes = self.header.get(RPMTAG_DIRINDEXES, [])
+        modes = self.header.get(RPMTAG_FILEMODES, [0] * len(basenames))
+        linktos = self.header.get(RPMTAG_FILELINKTOS, [""] * len(basenames))
+        return [
+            (dirnames[index] + basename, mode, linkto)
+            for basename, index, mode, linkto in zip(
+                basenames, dirindexes, modes, linktos
+            )
+        ]
+
+    def filenames(self):
+        """Return the paths of the files listed in the header."""
+        return [path for path, _, _ in self.files()]
+
+    def payload(self):
+        """Return a stream of the decompressed cpio payload."""
+        format = self.header.get(RPMTAG_PAYLOADFORMAT, "cpio")
+        if format != "cpio":
+            raise RPMError(f"{self.path}: unsupported payload format {format}")
+        self._file.seek(self.payload_offset)
+        return _payload_stream(self._file, self.payload_compressor)
+
+    def selected_paths(self, path_filter):
+        """Return the header paths path_filter selects, plus the targets of
+        the selected symlinks so that no selected link dangles.
+        """
+        files = dict((path, (mode, linkto)) for path, mode, linkto in self.files())
+        selected = set()
+        todo = [path for path in files if path_filter(path)]
+        while todo:
+            path = todo.pop()
+            if path in selected:
+                continue
+            selected.add(path)
+            mode, linkto = files[path]
+            if stat.S_ISLNK(mode) and linkto:
+                target = posixpath.normpath(
+                    posixpath.join(posixpath.dirname(path), linkto)
+                )
+                if target in files:
+                    todo.append(target)
+        return selected
+
+    def extract(self, dst, path_filter=None):
+        """Extract the selected files of the payload below dst.
+
+        Return the number of entries written.
+        """
+        wanted = None
+        if path_filter is not None:
+            wanted = self.selected_paths(path_filter)
+            if not wanted:
+                return 0
+        writer = _TreeWriter(dst)
+        with self.payload() as stream:
+            for entry in iter_cpio(stream):
+                path = "/" + re.sub(r"^\.?/+", "", entry.name)
+                if wanted is not None and path not in wanted:
+                    writer.skip(entry)
+                    continue
+                writer.write(path, entry)
+        writer.finish()
+        return writer.count
+
+
+class CpioEntry(object):
+    """A member of a cpio newc archive; its data must be read or skipped
+    before the next member is read.
+    """
+
+    def __init__(self, stream, fields, name):
+        (
+            self.ino,
+            self.mode,
+            _,
+            _,
+            self.nlink,
+            self.mtime,
+            self.size,
+            self.devmajor,
+            self.devminor,
+        ) = fields[:9]
+        self.name = name
+        self._stream = stream
+        self._left = self.size
+        self._pad = (4 - self.size % 4) % 4
+
+    def read_chunks(self):
+        while self._left:
+            chunk = self._stream.read(min(CHUNK_SIZE, self._left))
+            if not chunk:
+                raise RPMError("truncated cpio payload")
+            self._left -= len(chunk)
+            yield chunk
+        _read_exact(self._stream, self._pad)
+        self._pad = 0
+
+    def read(self):
+        return b"".join(self.read_chunks())
+
+    def skip(self):
+        for _ in self.read_chunks():
+            pass
+
+
+def iter_cpio(stream):
+    """Yield the CpioEntry members of a cpio newc stream."""
+    while True:
+        header = _read_exact(stream, 110)
+        magic = header[:6]
+        if magic not in (CPIO_NEWC_MAGIC, CPIO_CRC_MAGIC):
+            raise RPMError(f"unsupported cpio format {magic!r}")
+        fields = [int(header[i : i + 8], 16) for i in range(6, 110, 8)]
+        namesize = fields[11]
+        name = _read_exact(stream, namesize)[:-1].decode("utf-8", "surrogateescape")
+        _read_exact(stream, (4 - (110 + namesize) % 4) % 4)
+        if name == CPIO_TRAILER:
+            return
+        entry = CpioEntry(stream, fields, name)
+        yield entry
+        entry.skip()
+
+
+class _TreeWriter(object):
+    """Write cpio entries below a root directory, refusing any path that
+    would land outside of it.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.count = 0
+        self._dirs = dict()
+        # newc stores the data of hard linked files with the last link only
+        self._pending_links = dict()
+
+    def _parent(self, path):
+        parts = [p for p in path.split("/") if p]
+        if not parts or ".." in parts:
+            raise RPMError(f"refusing to extract {path}")
+        parent = os.path.join(self.root, *parts[:-1])
+        if parent not in self._dirs:
+            os.makedirs(parent, exist_ok=True)
+            real = os.path.realpath(parent)
+            if real != self.root and not real.startswith(self.root + os.sep):
+                raise RPMError(f"refusing to extract {path} outside of {self.root}")
+            self._dirs[parent] = real
+        return os.path.join(self._dirs[parent], parts[-1])
+
+    @staticmethod
+    def _replace(tmp, target):
+        if os.path.isdir(target) and not os.path.islink(target):
+            os.remove(tmp)
+            return
+        os.replace(tmp, target)
+
+    def write(self, path, entry):
+        target = self._parent(path)
+        tmp = f"{os.path.dirname(target)}/.{os.path.basename(target)}.{os.getpid()}"
+        mode = entry.mode
+        if stat.S_ISDIR(mode):
+            os.makedirs(target, exist_ok=True)
+            entry.skip()
+        elif stat.S_ISLNK(mode):
+            linkto = entry.read().decode("utf-8", "surrogateescape")
+            os.symlink(linkto, tmp)
+            self._replace(tmp, target)
+        elif stat.S_ISREG(mode):
+            key = (entry.devmajor, entry.devminor, entry.ino)
+            if entry.nlink > 1 and entry.size == 0:
+                self._pending_links.setdefault(key, []).append(target)
+                return
+            self._write_file(target, entry, self._pending_links.pop(key, []))
+        else:
+            # device nodes and fifos are of no use to the checker
+            entry.skip()
+            return
+        self.count += 1
+
+    def _write_file(self, target, entry, links):
+        """Write the data of entry to target, and hardlink links to it."""
+        tmp = f"{os.path.dirname(target)}/.{os.path.basename(target)}.{os.getpid()}"
+        with open(tmp, "wb") as f:
+            for chunk in entry.read_chunks():
+                f.write(chunk)
+        os.chmod(tmp, stat.S_IMODE(entry.mode) | stat.S_IWUSR)
+        os.utime(tmp, (entry.mtime, entry.mtime))
+        self._replace(tmp, target)
+        for link in links:
+            os.link(target, tmp)
+            self._replace(tmp, link)
+            self.count += 1
+
+    def skip(self, entry):
+        """Skip an entry that is not selected, unless it carries the data
+        of hard links that are.
+        """
+        key = (entry.devmajor, entry.devminor, entry.ino)
+        if (
+            stat.S_ISREG(entry.mode)
+            and entry.nlink > 1
+            and entry.size > 0
+            and key in self._pending_links
+        ):
+            links = self._pending_links.pop(key)
+            self._write_file(links[0], entry, links[1:])
+            self.count += 1
+        else:
+            entry.skip()
+
+    def finish(self):
+        # links whose data never came are empty files, as cpio makes them
+        for links in self._pending_links.values():
+            for link in links:
+                open(link, "wb").close()
+                self.count += 1
+        self._pending_links.clear()
+
+
+class FileListIndex(object):
+    """The file lists of a set of packages by package name, read once from
+    the rpm headers so that the xml descriptors are a lookup away.
+    """
+
+    def __init__(self):
+        self.files = dict()
+        self.nevras = dict()
+
+    @classmethod
+    def from_rpm_dir(cls, rpm_dir):
+        """Index every rpm file of rpm_dir."""
+        index = cls()
+        for filename in sorted(os.listdir(rpm_dir)):
+            if filename.endswith(".rpm"):
+                index.add_rpm(os.path.join(rpm_dir, filename))
+        return index
+
+    @classmethod
+    def from_installed(cls, names):
+        """Index the installed packages of names with a single rpm query."""
+        index = cls()
+        if not names:
+            return index
+        cmd = "rpm -q --qf '[%{=NAME} %{=NEVRA} %{FILENAMES}\\n]' " + " ".join(names)
+        _, stdout, _ = utils.run_cmd(cmd, print_cmd=False)
+        for line in stdout.decode().splitlines():
+            name, nevra, path = (line.split(" ", 2) + ["", ""])[:3]
+            if path:
+                index.nevras[name] = nevra
+                index.files.setdefault(name, []).append(path)
+        return index
+
+    def add_rpm(self, path):
+        with RPMFile(path) as f:
+            self.nevras[f.name] = f.nevra
+            self.files.setdefault(f.name, []).extend(f.filenames())
+
+    def headers(self, names):
+        """Return the header files below include directories of names."""
+        return list(
+            dict.fromkeys(
+                path
+                for name in names
+                for path in self.files.get(name, [])
+                if "include" in path and path.endswith(".h")
+            )
+        )
+
+    def owners(self, names, sonames):
+        """Return [(soname, package name, path)] of the files of names
+        called like one of sonames, in the order of sonames.
+        """
+        by_basename = dict()
+        for name in names:
+            for path in self.files.get(name, []):
+                by_basename.setdefault(posixpath.basename(path), []).append(
+                    (name, path)
+                )
+        return [
+            (soname, name, path)
+            for soname in sonames
+            for name, path in by_basename.get(soname, [])
+        ]
+
+    def libraries(self, names, sonames):
+        """Return the files of names called like one of sonames, in the
+        order of sonames.
+        """
+        return list(
+            dict.fromkeys(path for _, _, path in self.owners(names, sonames))
+        )
+
+
+class ABIFilter(object):
+    """Select what the checker reads from a package: the headers below
+    include directories, the shared objects and the ld.so configuration.
+    """
+
+    # bumped whenever the selection changes, it keys the stored trees
+    KEY = "abi-1"
+    SHARED_OBJECT = re.compile(r"\.so(\.\d+)*$")
+
+    def __call__(self, path):
+        if "/include/" in path:
+            return True
+        if path.startswith("/etc/ld.so.conf"):
+            return True
+        return bool(self.SHARED_OBJECT.search(path))
+
+
+def _extract_one(rpm, dst, path_filter):
+    with RPMFile(rpm) as f:
+        return f.extract(dst, path_filter)
+
+
+def extract_packages(rpms, dst, path_filter=None, jobs=None):
+    """Extract the rpm files below dst in a process pool.
+
+    path_filter must be picklable; None extracts everything. Return
+    {rpm: entries written}, failed packages are logged and left out.
+    """
+    return extract_trees(dict((rpm, dst) for rpm in rpms), path_filter, jobs)
+
+
+def extract_trees(targets, path_filter=None, jobs=None):
+    """Extract every rpm of targets {rpm: dst} below its own dst in a
+    process pool, like extract_packages.
+    """
+    loggerinst = logging.getLogger(__name__)
+    for dst in set(targets.values()):
+        os.makedirs(dst, exist_ok=True)
+    result = dict()
+    # the callers run threads, which must not be forked
+    context = multiprocessing.get_context("forkserver")
+    with futures.ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor:
+        jobs = dict(
+            (executor.submit(_extract_one, rpm, dst, path_filter), rpm)
+            for rpm, dst in targets.items()
+        )
+        for job in futures.as_completed(jobs):
+            rpm = jobs[job]
+            try:
+                result[rpm] = job.result()
+            except (OSError, EOFError, lzma.LZMAError, zlib.error, RPMError) as e:
+                loggerinst.warning(f"Failed to extract {rpm}: {e}")
+            else:
+                loggerinst.debug(f"Extracted {result[rpm]} files of {rpm}")
+    return result
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Running the checks of a command line, in this process or as a daemon job.
+"""
+import atexit
+import functools
+import logging
+import signal
+import sys
+import os
+import threading
+from concurrent import futures
+
+from abicheck import (
+    batch,
+    binhandler,
+    crawler,
+    daemon,
+    deltabuild,
+    deltadb,
+    metacache,
+    multirelease,
+    pipeline,
+    profiler,
+    symindex,
+    toolopts,
+    utils,
+    workspace,
+)
+
+loggerinst = logging.getLogger("abicheck")
+
+OLD_CHAIN = pipeline.chain("old")
+NEW_CHAIN = pipeline.chain("new")
+# The new OS devel/libs lookups extend the old OS lists, so the new chain
+# waits for the old one to get past this stage before running them.
+OLD_PKGS_RESOLVED = "get_old_libs_pkgs"
+NEW_PKGS_DEPENDENT = "get_new_devel_pkgs"
+
+
+def run_chain(checker, side, stages, wait=None, notify=None):
+    """Run the stages of one side in order.
+
+    wait is an event to block on before NEW_PKGS_DEPENDENT, notify an event
+    set once OLD_PKGS_RESOLVED finished (or the chain stopped early).
+    """
+    try:
+        for stage in stages:
+            if wait is not None and stage == NEW_PKGS_DEPENDENT:
+                wait.wait()
+            loggerinst.info(f"[{side}] {stage.replace('_', ' ')} ...")
+            pipeline.run_stage(checker, stage)
+            if notify is not None and stage == OLD_PKGS_RESOLVED:
+                notify.set()
+    finally:
+        if notify is not None:
+            notify.set()
+
+
+def run_chains_concurrently(checker):
+    """Run the old OS and new OS chains in two workers and wait for both.
+
+    Downloads of one side overlap with the abi-dumper work of the other;
+    a failure of either side is re-raised here once both have stopped.
+    """
+    old_resolved = threading.Event()
+    with futures.ThreadPoolExecutor(max_workers=2) as executor:
+        jobs = [
+            executor.submit(
+                run_chain, checker, "old", OLD_CHAIN, notify=old_resolved
+            ),
+            executor.submit(
+                run_chain, checker, "new", NEW_CHAIN, wait=old_resolved
+            ),
+        ]
+        for job in jobs:
+            job.result()
+
+
+def run_chains(checker):
+    """Run the old OS and the new OS chains of checker."""
+    if checker.opts.parallel:
+        run_chains_concurrently(checker)
+    else:
+        # old
+        run_chain(checker, "old", OLD_CHAIN)
+        # new
+        run_chain(checker, "new", NEW_CHAIN)
+
+
+def run_quick_check(checker):
+    """Run the symbol binding precheck of checker, return True if passed."""
+    with profiler.span("quick_check"):
+        checker.gen_new_quick_chroot()
+        return checker.quick_check()
+
+
+def run_batch(opts, workspace):
+    """Check many binaries, doing the package and dump work once."""
+    batch_checker = batch.BatchChecker(opts, workspace, opts.binfiles)
+    with profiler.span("inspect"):
+        shared = batch_checker.prepare()
+    if not opts.quick or batch_checker.quick_check():
+        run_chains(shared)
+    batch_checker.finish()
+
+
+def run_multi_release(opts, workspace):
+    """Check the binary against several releases, the new OS side once."""
+    multi = multirelease.MultiReleaseChecker(opts, workspace, opts.releases)
+    with profiler.span("inspect"):
+        multi.prepare()
+    if opts.quick and not run_quick_check(multi.new_checker):
+        return False
+
+    resolved = OLD_CHAIN.index(OLD_PKGS_RESOLVED) + 1
+    for checker in multi.old_checkers:
+        run_chain(checker, checker.old_os_full_name, OLD_CHAIN[:resolved])
+    multi.merge_old_packages()
+
+    workers = 1
+    if opts.parallel:
+        workers = min(len(multi.old_checkers) + 1, os.cpu_count() or 1)
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        jobs = [executor.submit(run_chain, multi.new_checker, "new", NEW_CHAIN)]
+        jobs += [
+            executor.submit(
+                run_chain, checker, checker.old_os_full_name, OLD_CHAIN[resolved:]
+            )
+            for checker in multi.old_checkers
+        ]
+        for job in jobs:
+            job.result()
+
+    multi.finish()
+    return True
+
+
+def run_build_deltas(opts, workspace):
+    """Add the library pairs of every release to the delta database."""
+    sonames = deltabuild.collect_sonames(
+        opts.build_deltas, f"{opts.new_os_id}_{opts.new_os_version}"
+    )
+    db = deltadb.DeltaDB()
+    builder = deltabuild.DeltaBuilder(db)
+    try:
+        for release in opts.releases:
+            output_dir = os.path.join(opts.output_dir, release)
+            utils.mkdir_p(output_dir)
+            checker = deltabuild.DeltaABI(opts, workspace, sonames, output_dir, release)
+            with profiler.span("inspect", release=release):
+                pipeline.run_stage(checker, "get_old_os_main_pkgs")
+                pipeline.run_stage(checker, "get_new_os_main_pkgs")
+                if not opts.rerun:
+                    checker.lookup_deltas()
+            run_chains(checker)
+            builder.add(checker)
+    finally:
+        db.close()
+        deltadb.forget_db()
+    loggerinst.info(
+        f"Added {builder.added} library pairs to the delta database {db.path}."
+    )
+
+
+def lookup_deltas(checker):
+    """Take the differences of the libraries of checker from the delta
+    database, return True if it has them all and the report is written.
+    """
+    if checker.delta_db is None:
+        return False
+    with profiler.span("deltas"):
+        pipeline.run_stage(checker, "get_old_os_main_pkgs")
+        pipeline.run_stage(checker, "get_new_os_main_pkgs")
+        if not checker.lookup_deltas():
+            return False
+    pipeline.run_stage(checker, "report")
+    return True
+
+
+def check(opts):
+    """Run the check asked for by the ToolOpts opts in a workspace of its
+    own, return the exit status.
+    """
+    with workspace.Workspace(opts.output_dir) as job_workspace:
+        return _check(opts, job_workspace)
+
+
+def _check(opts, job_workspace):
+    if opts.build_deltas:
+        run_build_deltas(opts, job_workspace)
+        return 0
+
+    if opts.binfiles:
+        run_batch(opts, job_workspace)
+        return 0
+
+    if opts.releases:
+        passed = run_multi_release(opts, job_workspace)
+        return 0 if passed else 1
+
+    checker = binhandler.ABI(opts, job_workspace)
+
+    with profiler.span("inspect"):
+        checker.gen_elf_info()
+        checker.gen_ldd_info()
+        checker.gen_soname_file()
+
+    if opts.quick and not run_quick_check(checker):
+        return 1
+
+    if lookup_deltas(checker):
+        checker.show_html()
+        return 0
+
+    run_chains(checker)
+
+    # diff and library depdency
+    pipeline.run_stage(checker, "report")
+
+    # show result
+    checker.show_html()
+    return 0
+
+
+def check_cmds():
+    """Exit if a tool the checks run is missing."""
+    utils.check_cmd(binhandler.ABI_CC)
+    utils.check_cmd(binhandler.ABI_DUMPER)
+    utils.check_cmd(binhandler.DOT)
+    utils.check_cmd(binhandler.CONVERT)
+
+
+def main():
+    """Perform all steps for the entire conversion process, of a command
+    line not handed over to a daemon.
+    """
+
+    utils.require_root()
+
+    # handle command line arguments
+    cli = toolopts.CLI()
+    opts = cli.process_cli_options()
+    signal.signal(signal.SIGINT, functools.partial(sigint_handler, opts))
+
+    if opts.daemon:
+        check_cmds()
+        return daemon.Daemon(workers=opts.workers, queue_size=opts.queue_size).serve()
+
+    atexit.register(profiler.get_profiler().write, opts.output_dir)
+
+    cache = metacache.get_cache(opts.metadata_quota)
+    if opts.clean_cache:
+        cache.clean()
+        workspace.clean()
+        if not (opts.binfile or opts.binfiles):
+            return
+
+    if opts.index_mirror:
+        symindex.build_index(
+            opts.index_mirror, f"{opts.new_os_id}_{opts.new_os_version}"
+        )
+        return
+
+    if opts.crawl:
+        crawler.inventory(opts.crawl, opts.output_dir)
+        return
+
+    # check cmd
+    check_cmds()
+
+    try:
+        return check(opts)
+    finally:
+        binhandler.ABI.clean_cache(opts.metadata_quota)
+
+
+def sigint_handler(opts, sig, frame):
+    print('You pressed Ctrl+C!')
+    binhandler.ABI.clean_cache(opts.metadata_quota)
+    sys.exit(0)
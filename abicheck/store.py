@@ -0,0 +1,379 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Content-addressed package store shared by all runs.
+
+Every package is kept under its checksum from the repo metadata, together
+with its extracted tree, so releases sharing byte-identical packages and
+repeated checks of a binary download and extract each package once. The
+chroot of a run is assembled from the stored trees with hardlinks, falling
+back to copies across filesystems. The least recently used packages are
+evicted once the store grows past its quota.
+
+Several processes may use the store at once, so every object has a lock
+file: readers linking an object hold it shared, and the store only
+replaces or removes an object while holding it exclusively.
+"""
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from abicheck import download, profiler, rpmfile, utils
+
+STORE_DIR = f"{utils.TMP_DIR}/store"
+DEFAULT_QUOTA = 20 * 1024 * 1024 * 1024
+# lists the packages a chroot was assembled from
+ASSEMBLED_FILE = ".packages"
+
+_store = None
+_store_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    checksum TEXT PRIMARY KEY, name TEXT, filename TEXT, rpm_size INTEGER,
+    tree_key TEXT, tree_size INTEGER, last_used REAL);
+"""
+
+
+def tree_size(path):
+    """Return the bytes used by the regular files below path."""
+    size = 0
+    for parent, _, filenames in os.walk(path):
+        for filename in filenames:
+            st = os.lstat(os.path.join(parent, filename))
+            size += st.st_size
+    return size
+
+
+def link_tree(src, dst):
+    """Recreate the tree src inside dst, hardlinking the files.
+
+    Files are copied when they can not be linked, e.g. across filesystems.
+    Return the number of files linked or copied.
+    """
+    count = 0
+    for parent, dirnames, filenames in os.walk(src):
+        rel = os.path.relpath(parent, src)
+        target_dir = os.path.normpath(os.path.join(dst, rel))
+        os.makedirs(target_dir, exist_ok=True)
+        # symlinks to directories are listed as dirs but not walked into
+        for name in dirnames + filenames:
+            source = os.path.join(parent, name)
+            target = os.path.join(target_dir, name)
+            if os.path.islink(source):
+                if os.path.lexists(target):
+                    os.remove(target)
+                os.symlink(os.readlink(source), target)
+            elif os.path.isdir(source):
+                continue
+            else:
+                if os.path.lexists(target):
+                    os.remove(target)
+                try:
+                    os.link(source, target)
+                except OSError:
+                    shutil.copy2(source, target)
+            count += 1
+    return count
+
+
+class PackageStore(object):
+    """The package store at path, holding at most quota bytes (0 for no
+    limit) of packages not used since the store was opened.
+    """
+
+    def __init__(self, path=STORE_DIR, quota=DEFAULT_QUOTA):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.quota = quota
+        self.opened = time.time()
+        utils.mkdir_p(os.path.join(path, "objects"))
+        utils.mkdir_p(os.path.join(path, "locks"))
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            os.path.join(path, "store.sqlite"), check_same_thread=False, timeout=60
+        )
+        with self._lock, self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def _object_dir(self, checksum):
+        return os.path.join(self.path, "objects", checksum[:2], checksum)
+
+    def _object_lock(self, checksum, operation=fcntl.LOCK_SH):
+        """Return a context holding the lock of an object."""
+        path = os.path.join(self.path, "locks", f"{checksum}.lock")
+        return utils.flock(path, operation)
+
+    def rpm_path(self, package):
+        """Return where the store keeps the rpm file of a PackageFile."""
+        return os.path.join(self._object_dir(package.checksum), package.filename)
+
+    def tree_path(self, package):
+        """Return where the store keeps the extracted tree of a PackageFile."""
+        return os.path.join(self._object_dir(package.checksum), "tree")
+
+    def _rows(self, packages):
+        with self._lock:
+            return dict(
+                (row[0], row[1:])
+                for package in packages
+                for row in self.conn.execute(
+                    "SELECT checksum, rpm_size, tree_key FROM packages"
+                    " WHERE checksum = ?",
+                    (package.checksum,),
+                )
+            )
+
+    def _touch(self, packages):
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "UPDATE packages SET last_used = ? WHERE checksum = ?",
+                [(now, package.checksum) for package in packages],
+            )
+
+    def fetch(self, packages, jobs=download.DEFAULT_JOBS):
+        """Make sure the store holds the rpm files of packages, downloading
+        the missing ones. Return the PackageFiles that are stored.
+        """
+        rows = self._rows(packages)
+        missing = [
+            package
+            for package in packages
+            if package.checksum not in rows
+            or not os.path.isfile(self.rpm_path(package))
+        ]
+        self.logger.info(
+            f"{len(packages) - len(missing)} of {len(packages)} packages"
+            " are in the package store."
+        )
+
+        if missing:
+            # a stable place, so verified and partial downloads are reused
+            downloader = download.PackageDownloader(
+                os.path.join(self.path, "incoming"), jobs, by_checksum=True
+            )
+            with profiler.span("download", "io", packages=len(missing)):
+                downloaded = set(downloader.download(missing))
+            now = time.time()
+            for package in missing:
+                path = downloader.path(package)
+                if path not in downloaded:
+                    continue
+                with self._object_lock(package.checksum, fcntl.LOCK_EX):
+                    utils.mkdir_p(self._object_dir(package.checksum))
+                    # another process may have stored it meanwhile
+                    if os.path.exists(path):
+                        os.replace(path, self.rpm_path(package))
+                    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+                    if not os.path.isfile(self.rpm_path(package)):
+                        continue
+                with self._lock, self.conn:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO packages"
+                        " VALUES (?, ?, ?, ?, NULL, 0, ?)",
+                        (
+                            package.checksum,
+                            package.name,
+                            package.filename,
+                            os.path.getsize(self.rpm_path(package)),
+                            now,
+                        ),
+                    )
+
+        stored = [p for p in packages if os.path.isfile(self.rpm_path(p))]
+        self._touch(stored)
+        return stored
+
+    def extract(self, packages, path_filter=None):
+        """Make sure the store holds the trees of packages extracted with
+        path_filter, extracting the missing ones in a process pool.
+        """
+        key = getattr(path_filter, "KEY", None) if path_filter else "all"
+        rows = self._rows(packages)
+        missing = [
+            package
+            for package in packages
+            if package.checksum in rows
+            and (
+                key is None
+                or rows[package.checksum][1] != key
+                or not os.path.isdir(self.tree_path(package))
+            )
+        ]
+        self.logger.info(
+            f"{len(packages) - len(missing)} of {len(packages)} package trees"
+            " are in the package store."
+        )
+        if not missing:
+            return
+
+        # extract on the same filesystem, then move the trees in place
+        targets = dict()
+        for package in missing:
+            tmp = tempfile.mkdtemp(prefix="tree-", dir=self.path)
+            targets[self.rpm_path(package)] = (package, tmp)
+        with profiler.span("extract", "io", packages=len(targets)):
+            extracted = rpmfile.extract_trees(
+                dict((rpm, tmp) for rpm, (_, tmp) in targets.items()), path_filter
+            )
+        for rpm, (package, tmp) in targets.items():
+            if rpm not in extracted:
+                shutil.rmtree(tmp, ignore_errors=True)
+                continue
+            with self._object_lock(package.checksum, fcntl.LOCK_EX):
+                self._install_tree(package, tmp, key)
+
+    def _install_tree(self, package, tmp, key):
+        """Move the tree extracted into tmp in place, the object being
+        locked exclusively, unless another process installed the same one.
+        """
+        tree = self.tree_path(package)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT tree_key FROM packages WHERE checksum = ?",
+                (package.checksum,),
+            ).fetchone()
+        # evicted meanwhile, or already there
+        if not (row and os.path.isfile(self.rpm_path(package))) or (
+            key is not None and row[0] == key and os.path.isdir(tree)
+        ):
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        # nobody reads the tree while the lock is held
+        if os.path.exists(tree):
+            shutil.rmtree(tree)
+        try:
+            os.rename(tmp, tree)
+        except OSError as e:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+            return
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE packages SET tree_key = ?, tree_size = ?"
+                " WHERE checksum = ?",
+                (key, tree_size(tree), package.checksum),
+            )
+
+    def link_packages(self, packages, dst):
+        """Hardlink the stored rpm files of packages into dst, replacing
+        the rpm files left there by earlier runs.
+        """
+        utils.mkdir_p(dst)
+        for filename in os.listdir(dst):
+            if filename.endswith(".rpm"):
+                os.remove(os.path.join(dst, filename))
+        for package in packages:
+            target = os.path.join(dst, package.filename)
+            with self._object_lock(package.checksum):
+                try:
+                    os.link(self.rpm_path(package), target)
+                except OSError:
+                    shutil.copy2(self.rpm_path(package), target)
+
+    def assemble(self, packages, dst):
+        """Build a fresh chroot dst from the stored trees of packages, and
+        list the checksums of the packages in its ASSEMBLED_FILE.
+
+        Return the number of files linked into it.
+        """
+        if os.path.exists(dst):
+            shutil.rmtree(dst)
+        utils.mkdir_p(dst)
+        count = 0
+        for package in packages:
+            tree = self.tree_path(package)
+            with self._object_lock(package.checksum):
+                if os.path.isdir(tree):
+                    count += link_tree(tree, dst)
+        utils.store_content_to_file(
+            os.path.join(dst, ASSEMBLED_FILE),
+            sorted(package.checksum for package in packages),
+        )
+        return count
+
+    def evict(self, quota=None, since=None):
+        """Remove the least recently used packages until the store fits
+        into quota, its own by default. Packages used since the time since,
+        by default since the store was opened, or locked by another process
+        are kept.
+        """
+        if quota is None:
+            quota = self.quota
+        if since is None:
+            since = self.opened
+        if not quota:
+            return
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT checksum, rpm_size + tree_size, last_used FROM packages"
+                " ORDER BY last_used"
+            ).fetchall()
+        total = sum(size for _, size, _ in rows)
+        evicted = 0
+        for checksum, size, last_used in rows:
+            if total <= quota:
+                break
+            if last_used >= since:
+                continue
+            lock = os.path.join(self.path, "locks", f"{checksum}.lock")
+            try:
+                with utils.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB):
+                    with self._lock:
+                        row = self.conn.execute(
+                            "SELECT last_used FROM packages WHERE checksum = ?",
+                            (checksum,),
+                        ).fetchone()
+                    if row and row[0] >= since:
+                        continue
+                    shutil.rmtree(self._object_dir(checksum), ignore_errors=True)
+                    with self._lock, self.conn:
+                        self.conn.execute(
+                            "DELETE FROM packages WHERE checksum = ?", (checksum,)
+                        )
+                    os.remove(lock)
+            except BlockingIOError:
+                continue
+            total -= size
+            evicted += 1
+        if evicted:
+            self.logger.info(
+                f"Evicted {evicted} packages from the package store,"
+                f" {utils.format_size(total)} left."
+            )
+
+
+def get_store(quota=DEFAULT_QUOTA):
+    """Return the package store shared by the checkers of this process;
+    its quota is the one of the first call, evict() takes another.
+    """
+    global _store  # pylint: disable=C0103
+    with _store_lock:
+        if _store is None:
+            _store = PackageStore(quota=quota)
+    return _store
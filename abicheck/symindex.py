@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Index of the symbols exported by the shared libraries of a repository.
+
+It is built offline from a local mirror of a repository: every package
+shipping shared objects is read once, and the sonames and defined dynamic
+symbols of its libraries are kept per package in a sqlite database, so a
+later revision of the mirror only reads the packages added or changed.
+From the database a compact index file is written: records sorted by the
+hash of the symbol or soname, followed by a string table. The checker
+mmaps it and finds the packages providing a missing symbol or soname with
+a binary search.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import tempfile
+import threading
+from concurrent import futures
+
+from abicheck import elf, rpmfile, utils
+
+INDEX_DIR = f"{utils.TMP_DIR}/symindex"
+MAGIC = b"ABISYM1\0"
+# magic, offset of the revision, symbol records, soname records, offset of
+# the string table; the symbol records follow, then the soname records
+HEADER = struct.Struct("<8sIIII")
+# hash of the name, offsets of the name, version, soname and package
+RECORD = struct.Struct("<QIIII")
+INDEXED_TYPES = (elf.STT_OBJECT, elf.STT_FUNC, elf.STT_GNU_IFUNC)
+
+_indexes = dict()
+_indexes_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    filename TEXT PRIMARY KEY, size INTEGER, mtime REAL, name TEXT);
+CREATE TABLE IF NOT EXISTS symbols (
+    filename TEXT, symbol TEXT, version TEXT, soname TEXT);
+CREATE TABLE IF NOT EXISTS sonames (filename TEXT, soname TEXT);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE INDEX IF NOT EXISTS symbols_filename ON symbols (filename);
+CREATE INDEX IF NOT EXISTS sonames_filename ON sonames (filename);
+"""
+
+
+def _hash(name):
+    digest = hashlib.blake2b(name.encode("utf-8", "surrogateescape"), digest_size=8)
+    return int.from_bytes(digest.digest(), "little")
+
+
+def index_path(os_full_name):
+    """Return the path of the index file of an OS."""
+    return os.path.join(INDEX_DIR, f"{os_full_name}.idx")
+
+
+def mirror_revision(mirror):
+    """Return the revision of the repodata of a mirror, "" without one."""
+    try:
+        with open(os.path.join(mirror, "repodata", "repomd.xml")) as f:
+            match = re.search(r"<revision>([^<]*)</revision>", f.read())
+    except OSError:
+        return ""
+    return match.group(1).strip() if match else ""
+
+
+class LibraryFilter(object):
+    """Select the shared objects of a package."""
+
+    def __call__(self, path):
+        return bool(rpmfile.ABIFilter.SHARED_OBJECT.search(path))
+
+
+def _read_package(rpm):
+    """Return the package name, the sonames and the defined dynamic
+    symbols [(symbol, version, soname)] of the shared objects of rpm.
+    """
+    sonames = list()
+    symbols = list()
+    with rpmfile.RPMFile(rpm) as f:
+        name = f.name
+        with tempfile.TemporaryDirectory(prefix="symindex-") as tmp:
+            if not f.extract(tmp, LibraryFilter()):
+                return name, sonames, symbols
+            for parent, _, filenames in os.walk(tmp):
+                for filename in filenames:
+                    path = os.path.join(parent, filename)
+                    if os.path.islink(path):
+                        continue
+                    try:
+                        with elf.ELFFile(path) as lib:
+                            if lib.elf_type != "DYN":
+                                continue
+                            soname = lib.soname or filename
+                            sonames.append(soname)
+                            for sym in lib.dynamic_symbols():
+                                if (
+                                    sym.defined
+                                    and sym.bind != elf.STB_LOCAL
+                                    and sym.type in INDEXED_TYPES
+                                ):
+                                    symbols.append((sym.name, sym.version or "", soname))
+                    except (OSError, elf.ELFError):
+                        continue
+                    except Exception:  # pylint: disable=W0703
+                        # a malformed library is left out, not the package
+                        continue
+    return name, sonames, symbols
+
+
+class IndexBuilder(object):
+    """Builds the index file at path from a local repository mirror,
+    keeping what it read per package in path.sqlite.
+    """
+
+    def __init__(self, path):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        utils.mkdir_p(os.path.dirname(path))
+        self.conn = sqlite3.connect(f"{path}.sqlite", timeout=60)
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else ""
+
+    def update(self, mirror, jobs=None):
+        """Read the packages of mirror added or changed since the last
+        update, forget the removed ones and rewrite the index file.
+        Return False if the mirror revision is unchanged.
+        """
+        revision = mirror_revision(mirror)
+        if revision and revision == self._meta("revision") and os.path.exists(self.path):
+            self.logger.info(f"The symbol index of {mirror} is up to date.")
+            return False
+
+        rpms = dict()
+        for parent, dirnames, filenames in os.walk(mirror):
+            dirnames.sort()
+            for filename in filenames:
+                if filename.endswith(".rpm") and not filename.endswith(".src.rpm"):
+                    path = os.path.join(parent, filename)
+                    st = os.stat(path)
+                    rpms[os.path.relpath(path, mirror)] = (st.st_size, st.st_mtime)
+        known = dict(
+            (filename, (size, mtime))
+            for filename, size, mtime in self.conn.execute(
+                "SELECT filename, size, mtime FROM packages"
+            )
+        )
+        removed = [filename for filename in known if filename not in rpms]
+        changed = [
+            filename for filename, stat in rpms.items() if known.get(filename) != stat
+        ]
+        self.logger.info(
+            f"Indexing {len(changed)} packages of {mirror},"
+            f" {len(rpms) - len(changed)} unchanged, {len(removed)} removed ..."
+        )
+
+        with self.conn:
+            for filename in removed + changed:
+                self._forget(filename)
+        with futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            jobs = dict(
+                (executor.submit(_read_package, os.path.join(mirror, filename)), filename)
+                for filename in changed
+            )
+            for job in futures.as_completed(jobs):
+                filename = jobs[job]
+                try:
+                    name, sonames, symbols = job.result()
+                except Exception as e:  # pylint: disable=W0703
+                    # one bad package must not end the build of the index
+                    self.logger.warning(f"Failed to index {filename}: {e}")
+                    continue
+                size, mtime = rpms[filename]
+                with self.conn:
+                    self.conn.execute(
+                        "INSERT INTO packages VALUES (?, ?, ?, ?)",
+                        (filename, size, mtime, name),
+                    )
+                    self.conn.executemany(
+                        "INSERT INTO sonames VALUES (?, ?)",
+                        ((filename, soname) for soname in sonames),
+                    )
+                    self.conn.executemany(
+                        "INSERT INTO symbols VALUES (?, ?, ?, ?)",
+                        ((filename,) + symbol for symbol in symbols),
+                    )
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('revision', ?)", (revision,)
+            )
+        self.write()
+        return True
+
+    def _forget(self, filename):
+        for table in ("packages", "sonames", "symbols"):
+            self.conn.execute(f"DELETE FROM {table} WHERE filename = ?", (filename,))
+
+    def write(self):
+        """Write the index file from the database."""
+        strings = dict()
+        table = bytearray()
+
+        def offset(string):
+            if string not in strings:
+                strings[string] = len(table)
+                table.extend(string.encode("utf-8", "surrogateescape") + b"\0")
+            return strings[string]
+
+        offset("")
+        revision = offset(self._meta("revision"))
+        symbols = sorted(
+            (_hash(symbol), offset(symbol), offset(version), offset(soname), offset(name))
+            for symbol, version, soname, name in self.conn.execute(
+                "SELECT DISTINCT symbol, version, soname, name"
+                " FROM symbols JOIN packages USING (filename)"
+            )
+        )
+        sonames = sorted(
+            (_hash(soname), offset(soname), 0, offset(soname), offset(name))
+            for soname, name in self.conn.execute(
+                "SELECT DISTINCT soname, name FROM sonames JOIN packages USING (filename)"
+            )
+        )
+
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            strings_offset = HEADER.size + RECORD.size * (len(symbols) + len(sonames))
+            f.write(HEADER.pack(MAGIC, revision, len(symbols), len(sonames), strings_offset))
+            for record in symbols + sonames:
+                f.write(RECORD.pack(*record))
+            f.write(table)
+        os.replace(tmp, self.path)
+        _forget_index(self.path)
+        self.logger.info(
+            f"Wrote the symbol index {self.path}: {len(symbols)} symbols,"
+            f" {len(sonames)} sonames, {utils.format_size(os.path.getsize(self.path))}."
+        )
+
+
+class SymbolIndex(object):
+    """A mmap'ed index file; use it as a context manager or close() it."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = None
+        # decoded strings by offset
+        self._strings = dict()
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, revision, self.symbol_count, self.soname_count, self.strings = (
+                HEADER.unpack_from(self._map)
+            )
+        except (ValueError, struct.error):
+            self.close()
+            raise OSError(f"{path} is not a symbol index")
+        if magic != MAGIC:
+            self.close()
+            raise OSError(f"{path} is not a symbol index")
+        self.revision = self._string(revision)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def _string(self, offset):
+        string = self._strings.get(offset)
+        if string is None:
+            start = self.strings + offset
+            string = self._map[start : self._map.find(b"\0", start)].decode(
+                "utf-8", "surrogateescape"
+            )
+            self._strings[offset] = string
+        return string
+
+    def _records(self, first, count, name):
+        """Yield the (name, version, soname, package) records of name among
+        the count records starting at record first.
+        """
+        key = _hash(name)
+        lo, hi = first, first + count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if RECORD.unpack_from(self._map, HEADER.size + mid * RECORD.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < first + count:
+            record = RECORD.unpack_from(self._map, HEADER.size + lo * RECORD.size)
+            if record[0] != key:
+                break
+            lo += 1
+            if self._string(record[1]) == name:
+                yield tuple(self._string(offset) for offset in record[1:])
+
+    def symbol_providers(self, symbol, version=None):
+        """Return the [(soname, package)] defining symbol, in the version
+        if given; like ld.so, unversioned definitions match any version.
+        """
+        return [
+            (soname, package)
+            for _, defined, soname, package in self._records(0, self.symbol_count, symbol)
+            if version is None or defined in (version, "")
+        ]
+
+    def soname_providers(self, soname):
+        """Return the packages shipping a library of that soname."""
+        return [
+            package
+            for _, _, _, package in self._records(
+                self.symbol_count, self.soname_count, soname
+            )
+        ]
+
+
+def build_index(mirror, os_full_name, jobs=None):
+    """Build or update the index of os_full_name from a local mirror."""
+    builder = IndexBuilder(index_path(os_full_name))
+    try:
+        builder.update(mirror, jobs)
+    finally:
+        builder.close()
+
+
+def indexed_sonames(os_full_name):
+    """Return the sonames of the libraries indexed for an OS, [] if no
+    index was built for it.
+    """
+    path = f"{index_path(os_full_name)}.sqlite"
+    if not os.path.exists(path):
+        return []
+    conn = sqlite3.connect(path, timeout=60)
+    try:
+        return [
+            soname
+            for soname, in conn.execute(
+                "SELECT DISTINCT soname FROM sonames ORDER BY soname"
+            )
+        ]
+    finally:
+        conn.close()
+
+
+def _forget_index(path):
+    with _indexes_lock:
+        index = _indexes.pop(path, None)
+    if index is not None:
+        index.close()
+
+
+def get_index(os_full_name):
+    """Return the SymbolIndex of an OS shared in this process, or None if
+    no index was built for it.
+    """
+    loggerinst = logging.getLogger(__name__)
+    path = index_path(os_full_name)
+    with _indexes_lock:
+        if path not in _indexes:
+            index = None
+            if os.path.exists(path):
+                try:
+                    index = SymbolIndex(path)
+                except OSError as e:
+                    loggerinst.warning(f"Can not read the symbol index {path}: {e}")
+            _indexes[path] = index
+        return _indexes[path]
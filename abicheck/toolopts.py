@@ -48,6 +48,43 @@ class ToolOpts(object):
         self.disable_colors = False
         self.output_dir = "./abi-info-export"
         self.binfile = ""
+        # Binaries checked together in batch mode
+        self.binfiles = []
+        # Run the old OS and new OS chains concurrently
+        self.parallel = False
+        # Parallel connections used to download packages
+        self.download_jobs = 4
+        # Download the full dependency closure instead of the planned set
+        self.alldeps = False
+        # Run the full check only if the symbol binding precheck passes
+        self.quick = False
+        # Run every stage again instead of resuming from the checkpoints
+        self.rerun = False
+        # Local repository mirror to build the symbol index from
+        self.index_mirror = None
+        # Application tree to write the manifest of the ELF files of
+        self.crawl = None
+        # Size limit of the package store in bytes, 0 for no limit
+        self.store_quota = 20 * 1024 * 1024 * 1024
+        # Size limit of the repo metadata cache in bytes, 0 for no limit
+        self.metadata_quota = 2 * 1024 * 1024 * 1024
+        # Check the repo metadata for updates even if it has not expired
+        self.refresh = False
+        # Empty the repo metadata cache first
+        self.clean_cache = False
+        # Serve check jobs over a Unix socket instead of running one
+        self.daemon = False
+        # Worker processes and queued jobs of the daemon; every check already
+        # downloads and dumps in parallel, so a quarter of the CPUs by default
+        self.workers = max(1, (os.cpu_count() or 1) // 4)
+        self.queue_size = 16
+        # Run the check here even if a daemon is running
+        self.no_daemon = False
+        # Compare every library with abi-compliance-checker instead of
+        # looking its pair up in the delta database
+        self.no_deltas = False
+        # File listing the sonames to build the delta database for, or "all"
+        self.build_deltas = None
 
         self.old_os_full_name = None
         # Old OS name (e.g. CentOS, UnionTech OS Server 20)
@@ -56,6 +93,10 @@ class ToolOpts(object):
         self.old_os_version = None
 
         self.old_dnf_conf = ""
+        # dnf config of the repos of the current OS
+        self.new_dnf_conf = "/etc/dnf/dnf.conf"
+        # Old OS releases compared at once in multi-release mode
+        self.releases = []
 
         self.new_os_id = distro.id()
         self.new_os_name = distro.name()
@@ -74,7 +115,14 @@ class CLI(object):
             f"  {PROG} --help\n"
             f"  {PROG} --version\n"
             f"  {PROG} --input BINFILE --release OS_RELEASE"
-            " [--output-dir DIR] [--debug] \n"
+            " [--output-dir DIR] [--parallel] [--quick] [--rerun] [--download-jobs N] [--store-quota GIB] [--new-repo-conf FILE] [--refresh] [--debug] \n"
+            f"  {PROG} --batch DIR|MANIFEST --release OS_RELEASE [options]\n"
+            f"  {PROG} --input BINFILE --releases all|OS_RELEASE,... [options]\n"
+            f"  {PROG} --index-mirror DIR\n"
+            f"  {PROG} --crawl DIR [--output-dir DIR]\n"
+            f"  {PROG} --build-deltas FILE|all --releases all|OS_RELEASE,...\n"
+            f"  {PROG} --clean-cache\n"
+            f"  {PROG} --daemon [--workers N] [--queue-size N]\n"
             "\n\n"
             "WARNING: The pre-migration operating system supported by the tool is"
             f" {SUPPORT_OS}"
@@ -108,6 +156,13 @@ class CLI(object):
             metavar="BINFILE",
             help="Input binary file to be migrated.",
         )
+        self._parser.add_option(
+            "-b",
+            "--batch",
+            metavar="DIR|MANIFEST",
+            help="Check all binaries below a directory, or listed one per line"
+            " in a manifest file, in one run.",
+        )
         self._parser.add_option(
             "-r",
             "--release",
@@ -116,6 +171,12 @@ class CLI(object):
             help="Operating systems that support migration."
             f" supported OS.RELEASE is {SUPPORT_OS}",
         )
+        self._parser.add_option(
+            "--releases",
+            metavar="all|OS_RELEASE,...",
+            help="Compare against several releases at once, 'all' for every"
+            " supported one. The current OS side is processed only once.",
+        )
         self._parser.add_option(
             "-o",
             "--output-dir",
@@ -123,6 +184,142 @@ class CLI(object):
             help="Directory to save output file (default: ./abi-info-export)",
         )
 
+        self._parser.add_option(
+            "-p",
+            "--parallel",
+            action="store_true",
+            help="Process the pre-migration and the current OS packages"
+            " concurrently.",
+        )
+
+        self._parser.add_option(
+            "-q",
+            "--quick",
+            action="store_true",
+            help="Check first that the binary's functions and symbol versions"
+            " bind against the current OS libraries, and run the header based"
+            " check only if they do.",
+        )
+
+        self._parser.add_option(
+            "--rerun",
+            action="store_true",
+            help="Run every stage again instead of skipping those whose"
+            " inputs are unchanged since the last run.",
+        )
+
+        self._parser.add_option(
+            "--download-jobs",
+            metavar="N",
+            type="int",
+            help="Number of parallel connections used to download packages"
+            " (default: 4)",
+        )
+
+        self._parser.add_option(
+            "--store-quota",
+            metavar="GIB",
+            type="float",
+            help="Size limit in GiB of the package store reused across runs,"
+            " 0 for no limit (default: 20)",
+        )
+
+        self._parser.add_option(
+            "--metadata-quota",
+            metavar="GIB",
+            type="float",
+            help="Size limit in GiB of the repo metadata cache reused across"
+            " runs, 0 for no limit (default: 2)",
+        )
+
+        self._parser.add_option(
+            "--refresh",
+            action="store_true",
+            help="Check the repo metadata for updates even if it has not"
+            " expired yet.",
+        )
+
+        self._parser.add_option(
+            "--clean-cache",
+            action="store_true",
+            help="Remove the cached repo metadata and indexes first, then"
+            " run the check if one is given.",
+        )
+
+        self._parser.add_option(
+            "--alldeps",
+            action="store_true",
+            help="Download the whole dependency closure of the packages"
+            " instead of only the ones holding the needed headers and libraries.",
+        )
+
+        self._parser.add_option(
+            "--new-repo-conf",
+            metavar="FILE",
+            help="dnf config of the current OS repositories"
+            " (default: /etc/dnf/dnf.conf)",
+        )
+
+        self._parser.add_option(
+            "--index-mirror",
+            metavar="DIR",
+            help="Build or update the index of the symbols exported by the"
+            " current OS libraries from a local repository mirror, used to"
+            " suggest packages for missing libraries and symbols, and exit.",
+        )
+
+        self._parser.add_option(
+            "--crawl",
+            metavar="DIR",
+            help="Find the binaries and shared objects below an application"
+            " directory, write them with their needed libraries to a"
+            " manifest in the output directory for --batch, and exit.",
+        )
+
+        self._parser.add_option(
+            "--build-deltas",
+            metavar="FILE|all",
+            help="Compare the libraries listed one soname per line in FILE,"
+            " or all those of the symbol index, between the given releases"
+            " and the current OS into the delta database, and exit.",
+        )
+
+        self._parser.add_option(
+            "--no-deltas",
+            action="store_true",
+            help="Compare every library with abi-compliance-checker instead"
+            " of taking the known differences from the delta database.",
+        )
+
+        self._parser.add_option(
+            "--daemon",
+            action="store_true",
+            help="Keep the repositories and caches loaded and run the checks"
+            " other invocations hand over through a Unix socket.",
+        )
+
+        self._parser.add_option(
+            "--workers",
+            metavar="N",
+            type="int",
+            help="Number of checks the daemon runs at once"
+            " (default: a quarter of the CPUs)",
+        )
+
+        self._parser.add_option(
+            "--queue-size",
+            metavar="N",
+            type="int",
+            help="Number of checks the daemon keeps waiting before it"
+            " refuses more (default: 16)",
+        )
+
+        self._parser.add_option(
+            "--no-daemon",
+            action="store_true",
+            help="Run the check in this process even if a daemon is running.",
+        )
+
         self._parser.add_option(
             "-d",
             "--debug",
@@ -136,54 +333,178 @@ class CLI(object):
             help=optparse.SUPPRESS_HELP,
         )
 
-    def process_cli_options(self):
-        """Process command line options used with the tool."""
-        warn_on_unsupported_options()
+    def process_cli_options(self, args=None, opts=None):
+        """Process command line options used with the tool, args instead
+        of the process arguments if given, into the ToolOpts opts, tool_opts
+        if not given. Return opts.
+        """
+        warn_on_unsupported_options(args)
 
-        parsed_opts, _ = self._parser.parse_args()
+        parsed_opts, _ = self._parser.parse_args(args)
 
-        global tool_opts  # pylint: disable=C0103
+        if opts is None:
+            opts = tool_opts
 
         if parsed_opts.output_dir:
-            tool_opts.output_dir = parsed_opts.output_dir
-        if not os.path.exists(tool_opts.output_dir):
-            mkdir_p(tool_opts.output_dir)
-        from abicheck import logger
-        logger.initialize_logger("abicheck.log", tool_opts.output_dir)
-        loggerinst = logging.getLogger(__name__)
-        loggerinst.info(f"The output-dir is {tool_opts.output_dir}.")
+            opts.output_dir = parsed_opts.output_dir
+        if not os.path.exists(opts.output_dir):
+            mkdir_p(opts.output_dir)
 
         if parsed_opts.debug:
-            tool_opts.debug = True
+            opts.debug = True
 
         if parsed_opts.disable_colors:
-            tool_opts.disable_colors = True
-
-        if parsed_opts.release:
-            tool_opts.old_os_full_name = parsed_opts.release
-            tool_opts.old_os_name = tool_opts.old_os_full_name.split('_')[0]
-            tool_opts.old_os_version = tool_opts.old_os_full_name.split('_')[1]
-            arch = platform.machine()
-            tool_opts.old_dnf_conf = f'{utils.DATA_DIR}/conf/{arch}/{tool_opts.old_os_full_name}.conf'
+            opts.disable_colors = True
+
+        from abicheck import logger
+        logger.initialize_logger(
+            "abicheck.log",
+            opts.output_dir,
+            disable_colors=opts.disable_colors,
+            debug=opts.debug,
+        )
+        loggerinst = logging.getLogger(__name__)
+        loggerinst.info(f"The output-dir is {opts.output_dir}.")
+
+        if parsed_opts.parallel:
+            opts.parallel = True
+
+        if parsed_opts.download_jobs:
+            opts.download_jobs = parsed_opts.download_jobs
+
+        if parsed_opts.store_quota is not None:
+            opts.store_quota = int(parsed_opts.store_quota * 1024 * 1024 * 1024)
+
+        if parsed_opts.metadata_quota is not None:
+            opts.metadata_quota = int(
+                parsed_opts.metadata_quota * 1024 * 1024 * 1024)
+
+        if parsed_opts.refresh:
+            opts.refresh = True
+
+        if parsed_opts.alldeps:
+            opts.alldeps = True
+
+        if parsed_opts.quick:
+            opts.quick = True
+
+        if parsed_opts.rerun:
+            opts.rerun = True
+
+        if parsed_opts.new_repo_conf:
+            if not os.path.isfile(parsed_opts.new_repo_conf):
+                loggerinst.critical(
+                    f"Error: {parsed_opts.new_repo_conf} isn't a file.")
+            opts.new_dnf_conf = parsed_opts.new_repo_conf
+
+        if parsed_opts.clean_cache:
+            opts.clean_cache = True
+
+        if parsed_opts.no_daemon:
+            opts.no_daemon = True
+
+        if parsed_opts.no_deltas:
+            opts.no_deltas = True
+
+        if parsed_opts.daemon:
+            opts.daemon = True
+            if parsed_opts.workers:
+                opts.workers = parsed_opts.workers
+            if parsed_opts.queue_size:
+                opts.queue_size = parsed_opts.queue_size
+            return opts
+
+        if opts.clean_cache and not (parsed_opts.input or parsed_opts.batch):
+            return opts
+
+        if parsed_opts.index_mirror:
+            if not os.path.isdir(parsed_opts.index_mirror):
+                loggerinst.critical(
+                    f"Error: {parsed_opts.index_mirror} isn't a directory.")
+            opts.index_mirror = parsed_opts.index_mirror
+            return opts
+
+        if parsed_opts.crawl:
+            if not os.path.isdir(parsed_opts.crawl):
+                loggerinst.critical(
+                    f"Error: {parsed_opts.crawl} isn't a directory.")
+            opts.crawl = parsed_opts.crawl
+            return opts
+
+        if parsed_opts.releases:
+            if parsed_opts.releases == "all":
+                opts.releases = list(SUPPORT_OS)
+            else:
+                opts.releases = parsed_opts.releases.split(",")
+            for release in opts.releases:
+                if release not in SUPPORT_OS:
+                    loggerinst.critical(
+                        f"Error: {release} isn't one of {SUPPORT_OS}.")
+            if parsed_opts.batch:
+                loggerinst.critical(
+                    "Error: --releases can not be used with --batch.")
+
+        release = parsed_opts.release
+        if not release and opts.releases:
+            release = opts.releases[0]
+        if release:
+            opts.old_os_full_name = release
+            opts.old_os_name = opts.old_os_full_name.split('_')[0]
+            opts.old_os_version = opts.old_os_full_name.split('_')[1]
+            opts.old_dnf_conf = release_dnf_conf(opts.old_os_full_name)
         else:
             loggerinst.critical(
-            "Error: --release is required.")
+            "Error: --release or --releases is required.")
 
-        if parsed_opts.input:
-            tool_opts.binfile = parsed_opts.input
-            if not utils.isbinary(tool_opts.binfile):
+        if parsed_opts.build_deltas:
+            if parsed_opts.build_deltas != "all" and not os.path.isfile(
+                    parsed_opts.build_deltas):
                 loggerinst.critical(
-                    f"Error: {tool_opts.binfile} isn't a binary file.")
+                    f"Error: {parsed_opts.build_deltas} isn't a file.")
+            opts.build_deltas = parsed_opts.build_deltas
+            if not opts.releases:
+                opts.releases = [opts.old_os_full_name]
+            return opts
+
+        if parsed_opts.batch:
+            if not os.path.exists(parsed_opts.batch):
+                loggerinst.critical(f"Error: {parsed_opts.batch} doesn't exist.")
+            from abicheck import batch
+            opts.binfiles = batch.collect_binaries(parsed_opts.batch)
+            # the files of a directory were found by reading their headers
+            if not os.path.isdir(parsed_opts.batch):
+                for binfile in opts.binfiles:
+                    if not utils.isbinary(binfile):
+                        loggerinst.critical(
+                            f"Error: {binfile} isn't a binary file.")
+            if not opts.binfiles:
+                loggerinst.critical(
+                    f"Error: no binary files found in {parsed_opts.batch}.")
+
+        elif parsed_opts.input:
+            opts.binfile = parsed_opts.input
+            if not utils.isbinary(opts.binfile):
+                loggerinst.critical(
+                    f"Error: {opts.binfile} isn't a binary file.")
 
         else:
             loggerinst.critical(
-            "Error: --input is required.")
-            pass
+            "Error: --input or --batch is required.")
+
+        return opts
+
+
+def release_dnf_conf(release):
+    """Return the dnf config of the repos of an old OS release."""
+    arch = platform.machine()
+    return f"{utils.DATA_DIR}/conf/{arch}/{release}.conf"
 
 
-def warn_on_unsupported_options():
+def warn_on_unsupported_options(args=None):
     loggerinst = logging.getLogger(__name__)
-    if any(x in sys.argv[1:] for x in ["--debuginfo"]):
+    if args is None:
+        args = sys.argv[1:]
+    if any(x in args for x in ["--debuginfo"]):
         loggerinst.critical("The --debuginfo option is not supported.\n"
                             f"See {PROG} -h for more information.")
 
@@ -13,8 +13,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import contextlib
 import datetime
 import errno
+import fcntl
 import getpass
 import inspect
 import logging
@@ -25,10 +27,36 @@ import subprocess
 import sys
 import traceback
 
-import dnf
 import pexpect
 from six import moves
 
+from abicheck import profiler
+
+
+@contextlib.contextmanager
+def flock(path, operation):
+    """Hold a flock on the lock file path, which may be removed by the
+    holder of an exclusive lock; raise BlockingIOError with LOCK_NB if it
+    is held.
+    """
+    while True:
+        f = open(path, "a")
+        try:
+            fcntl.flock(f, operation)
+            # the file was removed and maybe recreated while waiting
+            if os.path.exists(path) and os.path.samestat(
+                os.fstat(f.fileno()), os.stat(path)
+            ):
+                break
+        except BaseException:
+            f.close()
+            raise
+        f.close()
+    try:
+        yield
+    finally:
+        f.close()
+
 
 def check_cmd(prog):
     loggerinst = logging.getLogger(__name__)
@@ -64,65 +92,6 @@ def isbinary(filepath):
     return False
 
 
-def dnf_list(config, arch):
-    """List the package name from the config"""
-    loggerinst = logging.getLogger(__name__)
-    base = dnf.Base()
-
-    if os.path.exists(config):
-        conf = base.conf
-        conf.read(config)
-    else:
-        loggerinst.critical(f"No such file {config}, please check.")
-
-    base.read_all_repos()
-    try:
-        base.fill_sack()
-    except (dnf.exceptions.RepoError, dnf.exceptions.ConfigError) as e:
-        loggerinst.critical(e)
-    query = base.sack.query()
-    a = query.available()
-    pkgs = a.filter(arch=arch)
-    pkgs_list = list()
-    for pkg in pkgs:
-        pkgs_list.append(pkg.name)
-    if pkgs_list:
-        return pkgs_list
-    return []
-
-
-def dnf_provides(config, substr, arch):
-    loggerinst = logging.getLogger(__name__)
-    loggerinst.debug(f"Querying which package provides {substr}.")
-    base = dnf.Base()
-
-    if os.path.exists(config):
-        conf = base.conf
-        conf.read(config)
-    else:
-        loggerinst.critical(f"No such file {config}, please check.")
-
-    base.read_all_repos()
-    try:
-        base.fill_sack()
-    except (dnf.exceptions.RepoError, dnf.exceptions.ConfigError) as e:
-        loggerinst.critical(e)
-    query = base.sack.query()
-    a = query.available()
-    pkgs = a.filter(file__glob=substr, arch=arch,)
-    pkgs_list=list()
-    if pkgs:
-        for pkg in pkgs:
-            pkgs_list.append(pkg.name)
-        loggerinst.debug(
-            f"{substr} is provides by {pkgs_list}")
-    else:
-        pkgs_list=[]
-        loggerinst.debug(
-            f"Not found package provide {substr}")
-    return pkgs_list
-
-
 class Color(object):
     PURPLE = '\033[95m'
     CYAN = '\033[96m'
@@ -137,9 +106,9 @@ class Color(object):
 
 
 # Absolute path of a directory holding data for this tool
-DATA_DIR = "/usr/share/abicheck"
+DATA_DIR = os.environ.get("ABICHECK_DATA_DIR", "/usr/share/abicheck")
 # Directory for temporary data to be stored during runtime
-TMP_DIR = "/var/lib/abicheck"
+TMP_DIR = os.environ.get("ABICHECK_TMP_DIR", "/var/lib/abicheck")
 
 
 def format_msg_with_datetime(msg, level):
@@ -200,9 +169,10 @@ def store_content_to_file(filename, content):
         file_to_write.close()
 
 
-def run_cmd(cmd, print_cmd=True):
+def run_cmd(cmd, print_cmd=True, cwd=None):
     '''
     run command in subprocess and return exit code, output, error.
+    The command runs in directory cwd if given, the process cwd is untouched.
     '''
     loggerinst = logging.getLogger(__name__)
     if print_cmd:
@@ -214,13 +184,15 @@ def run_cmd(cmd, print_cmd=True):
     os.environ['LANG'] = 'C'
     os.environ['LC_ALL'] = 'C'
     cmd = cmd.encode('UTF-8')
-    proc = subprocess.Popen(
+    proc = profiler.get_profiler().popen(
         cmd,
         shell=True,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
+        cwd=cwd,
     )
-    (stdout, stderr) = proc.communicate()
+    (stdout, stderr) = profiler.get_profiler().communicate(proc)
+    profiler.get_profiler().command(proc, cmd)
     returncode = proc.returncode
     return (returncode, stdout, stderr)
 
@@ -240,20 +212,20 @@ def run_subprocess(cmd="", print_cmd=True, print_output=True):
     if sys.version_info[0] == 2 and sys.version_info[1] == 6:
         cmd = cmd.encode("ascii")
     cmd = shlex.split(cmd, False)
-    process = subprocess.Popen(cmd,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.STDOUT,
-                               bufsize=1,
-                               env={'LC_ALL': 'C'})
+    process = profiler.get_profiler().popen(cmd,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT,
+                                            bufsize=1,
+                                            env={'LC_ALL': 'C'})
     output = ''
     for line in iter(process.stdout.readline, b''):
         output += line.decode()
         if print_output:
             loggerinst.info(line.decode().rstrip('\n'))
 
-    # Call communicate() to wait for the process to terminate so that we can get the return code by poll().
-    # It's just for py2.6, py2.7+/3 doesn't need this.
-    process.communicate()
+    # wait for the process to terminate, keeping its resource usage
+    profiler.get_profiler().communicate(process)
+    profiler.get_profiler().command(process, cmd)
 
     return_code = process.poll()
     return output, return_code
@@ -317,6 +289,16 @@ def let_user_choose_item(num_of_options, item_to_choose):
     return opt_num - 1  # Get zero-based list index
 
 
+def format_size(size):
+    """Return a human readable size of a byte count."""
+    size = float(size)
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
 def mkdir_p(path):
     """Create all missing directories for the path and raise no exception
     if the path exists.
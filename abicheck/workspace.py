@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Per-check workspaces.
+
+The rpm files and chroots of a check are linked from the package store
+into a workspace of the check's own below WORKSPACE_DIR, named after its
+output directory. Checks with different output directories thus never
+touch each other's chroots, while a check run again in the same output
+directory finds its chroots where its checkpoints expect them. A check
+holds an exclusive lock on its workspace while it runs, so a second check
+into the same output directory is refused, and only the workspaces of no
+running check are removed.
+"""
+import fcntl
+import glob
+import hashlib
+import logging
+import os
+import shutil
+import time
+
+from abicheck import utils
+
+WORKSPACE_DIR = f"{utils.TMP_DIR}/workspaces"
+# workspaces not used for this long are removed by evict()
+MAX_AGE = 7 * 24 * 3600
+
+
+def _try_lock(path):
+    """Return the lock file path opened with an exclusive lock, None if
+    another check holds it.
+    """
+    f = open(path, "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+class Workspace(object):
+    """The workspace of the check writing into output_dir."""
+
+    def __init__(self, output_dir, root=WORKSPACE_DIR):
+        self.logger = logging.getLogger(__name__)
+        output_dir = os.path.abspath(output_dir)
+        digest = hashlib.sha1(output_dir.encode()).hexdigest()[:8]
+        self.output_dir = output_dir
+        self.path = os.path.join(root, f"{os.path.basename(output_dir)}-{digest}")
+        self._lock = None
+        # when the check started, what it used since is kept from eviction
+        self.started = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def acquire(self):
+        """Lock the workspace for this check, exit if another one holds it."""
+        utils.mkdir_p(self.path)
+        self._lock = _try_lock(f"{self.path}.lock")
+        if self._lock is None:
+            self.logger.critical(
+                f"Another check is running with the output directory {self.output_dir}."
+            )
+        # the lock file dates the last use for evict()
+        os.utime(f"{self.path}.lock")
+        self.started = time.time()
+
+    def release(self):
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def downloaddir(self, os_full_name, arch):
+        """Return the directory of the rpm files of an OS."""
+        return os.path.join(self.path, os_full_name, arch, "Packages")
+
+    def chroot(self, os_full_name, arch):
+        """Return the chroot the packages of an OS are assembled into."""
+        return os.path.join(self.path, os_full_name, arch, "chroot")
+
+
+def _remove(lock_path):
+    lock = _try_lock(lock_path)
+    if lock is None:
+        return False
+    with lock:
+        shutil.rmtree(lock_path[: -len(".lock")], ignore_errors=True)
+        os.remove(lock_path)
+    return True
+
+
+def evict(root=WORKSPACE_DIR, max_age=MAX_AGE):
+    """Remove the workspaces not used for max_age seconds by any check."""
+    loggerinst = logging.getLogger(__name__)
+    now = time.time()
+    removed = 0
+    for lock_path in glob.glob(os.path.join(root, "*.lock")):
+        try:
+            if now - os.path.getmtime(lock_path) < max_age:
+                continue
+        except OSError:
+            continue
+        removed += _remove(lock_path)
+    if removed:
+        loggerinst.info(f"Removed {removed} workspaces unused for {max_age // 86400} days.")
+
+
+def clean(root=WORKSPACE_DIR):
+    """Remove the workspaces of every check not running."""
+    loggerinst = logging.getLogger(__name__)
+    removed = sum(
+        _remove(lock_path) for lock_path in glob.glob(os.path.join(root, "*.lock"))
+    )
+    loggerinst.info(f"Removed {removed} workspaces.")
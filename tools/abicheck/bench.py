@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Offline benchmark of abicheck.
+
+For every scale a synthetic program, its libraries and the old release and
+current OS repositories are generated (see synth.py), then abicheck checks
+the program three times against file:// repos:
+
+    cold    empty package store, repo index, dump cache and checkpoints
+    warm    everything cached, every stage run again (--rerun)
+    resume  everything cached, stages skipped by their checkpoints
+
+The wall time of the whole run and of every stage and external command is
+read from the profile.json abicheck writes, appended to a results file and
+compared with the previous result of the same scale, phase and host, so
+that slowdowns beyond the threshold are reported and fail the run.
+
+abi-compliance-checker, abi-dumper, gcc, dot and convert are replaced by
+small stubs when they are not installed (or always with --stub-tools), so
+the benchmark measures abicheck itself and runs without network.
+"""
+import datetime
+import json
+import optparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synth  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_SCALES = "10x1000,10x100000,100x1000,100x100000,1000x1000,1000x100000"
+DEFAULT_RELEASE = "centos_7.6"
+PHASES = ("cold", "warm", "resume")
+# slowdowns below this many seconds are noise, whatever the ratio
+MIN_DELTA = 0.1
+
+ABI_CC_STUB = r'''
+import json
+import re
+import sys
+
+args = sys.argv[1:]
+
+
+def opt(name):
+    return args[args.index(name) + 1] if name in args else None
+
+
+def section(text, tag):
+    match = re.search(f"<{tag}>(.*?)</{tag}>", text, re.S)
+    return [line.strip() for line in match.group(1).splitlines() if line.strip()] if match else []
+
+
+if "-dumpversion" in args:
+    print("2.3-bench")
+elif "-dump" in args:
+    with open(opt("-dump")) as f:
+        descriptor = f.read()
+    functions = set()
+    for header in section(descriptor, "headers"):
+        with open(header, errors="replace") as f:
+            functions.update(re.findall(r"(\w+)\s*\(", f.read()))
+    with open(opt("-dump-path"), "w") as f:
+        json.dump({"libs": section(descriptor, "libs"), "functions": sorted(functions)}, f)
+elif "-old" in args:
+    with open(opt("-old")) as f:
+        old = set(json.load(f)["functions"])
+    with open(opt("-new")) as f:
+        new = set(json.load(f)["functions"])
+    removed, added = len(old - new), len(new - old)
+    verdict = "incompatible" if removed else "compatible"
+    with open(opt("--report-path"), "w") as f:
+        for kind in ("binary", "source"):
+            f.write(f"<!-- kind:{kind};verdict:{verdict};affected:{100.0 * removed / max(len(old), 1):.1f};"
+                    f"added:{added};removed:{removed};type_problems_high:0;type_problems_medium:0;"
+                    "type_problems_low:0;interface_problems_high:0;interface_problems_medium:0;"
+                    "interface_problems_low:0;changed_constants:0; -->\n")
+        f.write("<html><body><div class='tabset'><a id='BinaryID' class='tab active'>Binary<br/>Compatibility</a>"
+                "<a id='SourceID' class='tab disabled'>Source<br/>Compatibility</a></div>"
+                f"<div class='footer'>{opt('-l')}: {removed} removed, {added} added</div></body></html>\n")
+    sys.exit(1 if removed else 0)
+'''
+
+STUBS = {
+    "abi-compliance-checker": ABI_CC_STUB,
+    "abi-dumper": r'''
+import sys
+
+args = sys.argv[1:]
+with open(args[args.index("-o") + 1] if "-o" in args else "ABI.dump", "w") as f:
+    f.write("{}\n")
+''',
+    "gcc": r'''
+print("0-bench")
+''',
+    "dot": r'''
+import sys
+
+args = sys.argv[1:]
+with open(args[args.index("-o") + 1], "wb") as f:
+    f.write(b"\x89PNG\r\n\x1a\n")
+''',
+    "convert": r'''
+''',
+}
+
+
+def install_stubs(stub_dir, always):
+    """Write the stubs of the tools not installed into stub_dir, every
+    one of them if always, and return their names.
+    """
+    os.makedirs(stub_dir, exist_ok=True)
+    installed = list()
+    for name, body in STUBS.items():
+        path = os.path.join(stub_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+        if not always and shutil.which(name):
+            continue
+        with open(path, "w") as f:
+            f.write(f"#!{sys.executable}\n{body.lstrip()}")
+        os.chmod(path, 0o755)
+        installed.append(name)
+    return installed
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "-C", REPO_ROOT, "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def prepare(workdir, scale, release, regenerate):
+    """Generate the inputs of a scale once, return (program, data dir,
+    new OS dnf config).
+    """
+    root = os.path.join(workdir, scale.name)
+    marker = os.path.join(root, ".generated")
+    program = os.path.join(root, "program", "bin", "bench")
+    data_dir = os.path.join(root, "data")
+    new_conf = os.path.join(root, "new.conf")
+    if not regenerate and os.path.exists(marker):
+        return program, data_dir, new_conf
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    start = time.monotonic()
+    program, data_dir, new_conf = synth.generate(root, scale, release)
+    with open(marker, "w") as f:
+        f.write(f"{scale.name}\n")
+    print(f"[{scale.name}] generated the inputs in {time.monotonic() - start:.1f} s")
+    return program, data_dir, new_conf
+
+
+def run_check(scale_dir, inputs, release, stub_dir, phase, extra_args=()):
+    """Run abicheck once and return its result record."""
+    program, data_dir, new_conf = inputs
+    output_dir = os.path.join(scale_dir, "output")
+    tmp_dir = os.path.join(scale_dir, "var")
+    if phase == "cold":
+        for path in (output_dir, tmp_dir):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+    os.makedirs(output_dir, exist_ok=True)
+    cmd = [
+        sys.executable,
+        "main.py",
+        "--input",
+        program,
+        "--release",
+        release,
+        "--new-repo-conf",
+        new_conf,
+        "--output-dir",
+        output_dir,
+    ]
+    if phase == "warm":
+        cmd.append("--rerun")
+    cmd += list(extra_args)
+    env = dict(
+        os.environ,
+        ABICHECK_TMP_DIR=tmp_dir,
+        ABICHECK_DATA_DIR=data_dir,
+        PATH=f"{stub_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+    )
+    log_file = os.path.join(scale_dir, f"{phase}.log")
+    start = time.monotonic()
+    with open(log_file, "w") as log:
+        proc = subprocess.run(
+            cmd,
+            cwd=os.path.join(REPO_ROOT, "abicheck"),
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+    wall = time.monotonic() - start
+
+    stages = dict()
+    commands = dict()
+    try:
+        with open(os.path.join(output_dir, "profile.json")) as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        profile = {"totals": []}
+    for total in profile["totals"]:
+        if total["cat"] == "command":
+            commands[total["name"]] = {"calls": total["calls"], "wall": total["wall"]}
+        else:
+            stages[total["name"]] = total["wall"]
+    return {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "host": socket.gethostname(),
+        "scale": os.path.basename(scale_dir),
+        "phase": phase,
+        "returncode": proc.returncode,
+        "wall": wall,
+        "stages": stages,
+        "commands": commands,
+        "log": log_file,
+    }
+
+
+def load_results(path):
+    results = list()
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    results.append(json.loads(line))
+    except OSError:
+        pass
+    return results
+
+
+def previous_result(results, record):
+    for result in reversed(results):
+        if all(result.get(key) == record[key] for key in ("scale", "phase", "host")):
+            return result
+    return None
+
+
+def regressions(previous, record, threshold):
+    """Return the (name, previous s, current s) slower than previous by
+    more than threshold (a ratio) and MIN_DELTA seconds.
+    """
+    pairs = [("total", previous["wall"], record["wall"])]
+    for name, wall in record["stages"].items():
+        if name in previous["stages"]:
+            pairs.append((name, previous["stages"][name], wall))
+    return [
+        (name, old, new)
+        for name, old, new in pairs
+        if new - old > MIN_DELTA and new > old * (1 + threshold)
+    ]
+
+
+def print_record(record, previous):
+    print(
+        f"[{record['scale']}] {record['phase']}: {record['wall']:.2f} s,"
+        f" exit status {record['returncode']}"
+    )
+    for name, wall in sorted(record["stages"].items(), key=lambda item: -item[1]):
+        before = ""
+        if previous and name in previous["stages"]:
+            before = f"  (was {previous['stages'][name]:.2f} s)"
+        print(f"    {name:<32} {wall:>9.2f} s{before}")
+    for name, command in sorted(record["commands"].items()):
+        print(f"    $ {name:<30} {command['wall']:>9.2f} s in {command['calls']} calls")
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option(
+        "--scales",
+        default=DEFAULT_SCALES,
+        metavar="SONAMESxSYMBOLS,...",
+        help=f"Scales to run (default: {DEFAULT_SCALES})",
+    )
+    parser.add_option(
+        "--phases",
+        default=",".join(PHASES),
+        metavar="PHASE,...",
+        help=f"Phases to run, in order, of {PHASES}",
+    )
+    parser.add_option(
+        "--workdir",
+        default="abicheck-bench",
+        metavar="DIR",
+        help="Directory for the generated inputs and the runs (default: ./abicheck-bench)",
+    )
+    parser.add_option(
+        "--results",
+        metavar="FILE",
+        help="File the results are appended to (default: WORKDIR/results.jsonl)",
+    )
+    parser.add_option(
+        "--release",
+        default=DEFAULT_RELEASE,
+        help=f"Old OS release the old repo stands for (default: {DEFAULT_RELEASE})",
+    )
+    parser.add_option(
+        "--threshold",
+        type="float",
+        default=0.2,
+        help="Slowdown ratio reported as a regression (default: 0.2)",
+    )
+    parser.add_option(
+        "--regenerate",
+        action="store_true",
+        help="Generate the inputs again even if they exist",
+    )
+    parser.add_option(
+        "--stub-tools",
+        action="store_true",
+        help="Use the stubs even for the external tools that are installed",
+    )
+    opts, args = parser.parse_args()
+    if args:
+        parser.error(f"unexpected arguments {args}")
+    if os.geteuid() != 0:
+        parser.error("abicheck needs to be run under the root user")
+    scales = [synth.Scale.parse(text) for text in opts.scales.split(",") if text]
+    phases = [phase for phase in opts.phases.split(",") if phase]
+    for phase in phases:
+        if phase not in PHASES:
+            parser.error(f"unknown phase {phase}")
+
+    workdir = os.path.abspath(opts.workdir)
+    results_file = opts.results or os.path.join(workdir, "results.jsonl")
+    os.makedirs(workdir, exist_ok=True)
+    stubbed = install_stubs(os.path.join(workdir, "stubs"), opts.stub_tools)
+    if stubbed:
+        print(f"Using stubs for {', '.join(stubbed)}")
+
+    results = load_results(results_file)
+    failed = False
+    slower = list()
+    for scale in scales:
+        inputs = prepare(workdir, scale, opts.release, opts.regenerate)
+        for phase in phases:
+            record = run_check(
+                os.path.join(workdir, scale.name),
+                inputs,
+                opts.release,
+                os.path.join(workdir, "stubs"),
+                phase,
+            )
+            previous = previous_result(results, record)
+            print_record(record, previous)
+            if record["returncode"] != 0:
+                failed = True
+                print(f"    failed, see {record['log']}")
+            elif previous and previous["returncode"] == 0:
+                for name, old, new in regressions(previous, record, opts.threshold):
+                    slower.append(f"{scale.name} {phase} {name}: {old:.2f} s -> {new:.2f} s")
+            results.append(record)
+            with open(results_file, "a") as f:
+                f.write(json.dumps(record, sort_keys=True) + "\n")
+
+    if slower:
+        print(f"Regressions beyond {opts.threshold:.0%}:")
+        for line in slower:
+            print(f"    {line}")
+    print(f"Results appended to {results_file}")
+    return 1 if failed or slower else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,632 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Synthetic inputs for the abicheck benchmark.
+
+ELF64 shared libraries with versioned dynamic symbols and a program
+importing them are written from scratch, packed into rpm files and laid
+out as createrepo style repositories, one for the pre-migration release
+and one for the current OS. Everything is deterministic, so two runs of a
+scale produce byte-identical packages and metadata.
+"""
+import gzip
+import hashlib
+import os
+import platform
+import stat
+import struct
+
+ARCH = platform.machine()
+MACHINES = {"x86_64": 62, "aarch64": 183, "ppc64le": 21, "s390x": 22, "riscv64": 243}
+INTERP = {
+    "x86_64": "/lib64/ld-linux-x86-64.so.2",
+    "aarch64": "/lib/ld-linux-aarch64.so.1",
+}
+
+# ELF constants, see elf(5)
+ET_DYN = 3
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+PT_NOTE = 4
+SHT_PROGBITS = 1
+SHT_STRTAB = 3
+SHT_DYNAMIC = 6
+SHT_NOTE = 7
+SHT_DYNSYM = 11
+SHT_GNU_VERDEF = 0x6FFFFFFD
+SHT_GNU_VERNEED = 0x6FFFFFFE
+SHT_GNU_VERSYM = 0x6FFFFFFF
+SHF_ALLOC = 2
+SHF_EXECINSTR = 4
+STB_GLOBAL = 1
+STT_FUNC = 2
+VER_FLG_BASE = 1
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_SYMTAB = 6
+DT_STRSZ = 10
+DT_SYMENT = 11
+DT_SONAME = 14
+DT_RUNPATH = 29
+DT_VERSYM = 0x6FFFFFF0
+DT_VERDEF = 0x6FFFFFFC
+DT_VERDEFNUM = 0x6FFFFFFD
+DT_VERNEED = 0x6FFFFFFE
+DT_VERNEEDNUM = 0x6FFFFFFF
+
+EHDR = struct.Struct("<16sHHIQQQIHHHHHH")
+PHDR = struct.Struct("<IIQQQQQQ")
+SHDR = struct.Struct("<IIQQQQIIQQ")
+SYM = struct.Struct("<IBBHQQ")
+DYN = struct.Struct("<qQ")
+VERDEF = struct.Struct("<HHHHIII")
+VERDAUX = struct.Struct("<II")
+VERNEED = struct.Struct("<HHIII")
+VERNAUX = struct.Struct("<IHHII")
+
+# rpm header tags and types, see abicheck/rpmfile.py
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_RELEASE = 1002
+RPMTAG_SIZE = 1009
+RPMTAG_ARCH = 1022
+RPMTAG_FILESIZES = 1028
+RPMTAG_FILEMODES = 1030
+RPMTAG_FILELINKTOS = 1036
+RPMTAG_PROVIDENAME = 1047
+RPMTAG_DIRINDEXES = 1116
+RPMTAG_BASENAMES = 1117
+RPMTAG_DIRNAMES = 1118
+RPMTAG_PAYLOADFORMAT = 1124
+RPMTAG_PAYLOADCOMPRESSOR = 1125
+RPMSIGTAG_SIZE = 1000
+RPM_INT16_TYPE = 3
+RPM_INT32_TYPE = 4
+RPM_STRING_TYPE = 6
+RPM_STRING_ARRAY_TYPE = 8
+
+PACKAGE_VERSIONS = {"old": "1.0", "new": "2.0"}
+
+
+def elf_hash(name):
+    """Return the SysV ELF hash of name, as kept in vd_hash and vna_hash."""
+    h = 0
+    for c in name.encode():
+        h = ((h << 4) + c) & 0xFFFFFFFF
+        g = h & 0xF0000000
+        if g:
+            h ^= g >> 24
+        h &= ~g & 0xFFFFFFFF
+    return h
+
+
+def _align(data, alignment):
+    data.extend(b"\0" * (-len(data) % alignment))
+
+
+class StringTable(object):
+    def __init__(self):
+        self.data = bytearray(b"\0")
+        self.offsets = {"": 0}
+
+    def add(self, string):
+        if string not in self.offsets:
+            self.offsets[string] = len(self.data)
+            self.data.extend(string.encode() + b"\0")
+        return self.offsets[string]
+
+
+def write_elf(
+    path,
+    soname=None,
+    needed=(),
+    runpath=None,
+    defined=(),
+    undefined=(),
+    interp=None,
+):
+    """Write an ELF64 little endian shared object or PIE program to path.
+
+    defined are the (name, version) functions it exports, the versions
+    being defined in its .gnu.version_d after the base version named after
+    soname; undefined are the (name, version, soname) functions it imports.
+    A version of None leaves the symbol unversioned.
+    """
+    dynstr = StringTable()
+    names = StringTable()
+
+    verdefs = list()
+    if soname:
+        verdefs.append((soname, VER_FLG_BASE))
+    for _, version in defined:
+        if version and (version, 0) not in verdefs:
+            verdefs.append((version, 0))
+    def_index = dict((name, i + 1) for i, (name, _) in enumerate(verdefs))
+
+    verneeds = dict()
+    next_index = len(verdefs) + 1 if verdefs else 2
+    need_index = dict()
+    for _, version, file in undefined:
+        if version and (version, file) not in need_index:
+            verneeds.setdefault(file, []).append(version)
+            need_index[(version, file)] = next_index
+            next_index += 1
+
+    needed_offsets = [dynstr.add(name) for name in needed]
+    soname_offset = dynstr.add(soname) if soname else None
+    runpath_offset = dynstr.add(runpath) if runpath else None
+
+    symbols = [SYM.pack(0, 0, 0, 0, 0, 0)]
+    versyms = [0]
+    for name, version, file in undefined:
+        symbols.append(SYM.pack(dynstr.add(name), STB_GLOBAL << 4 | STT_FUNC, 0, 0, 0, 0))
+        versyms.append(need_index[(version, file)] if version else 1)
+    # defined symbols point into .text, they are packed once it is placed
+    defined_at = len(symbols)
+    for name, version in defined:
+        symbols.append((dynstr.add(name), version))
+        versyms.append(def_index[version] if version else 1)
+
+    verdef = bytearray()
+    for i, (name, flags) in enumerate(verdefs):
+        last = i == len(verdefs) - 1
+        verdef += VERDEF.pack(
+            1, flags, i + 1, 1, elf_hash(name), VERDEF.size,
+            0 if last else VERDEF.size + VERDAUX.size,
+        )
+        verdef += VERDAUX.pack(dynstr.add(name), 0)
+    verneed = bytearray()
+    for i, (file, versions) in enumerate(verneeds.items()):
+        last = i == len(verneeds) - 1
+        verneed += VERNEED.pack(
+            1, len(versions), dynstr.add(file), VERNEED.size,
+            0 if last else VERNEED.size + VERNAUX.size * len(versions),
+        )
+        for j, version in enumerate(versions):
+            verneed += VERNAUX.pack(
+                elf_hash(version), 0, need_index[(version, file)], dynstr.add(version),
+                0 if j == len(versions) - 1 else VERNAUX.size,
+            )
+
+    # the layout: headers, then the sections in file order, one PT_LOAD
+    # mapping the whole file at address 0
+    phnum = 3 + (1 if interp else 0)
+    out = bytearray(EHDR.size + PHDR.size * phnum)
+    placed = dict()
+
+    def place(name, sh_type, data, alignment, flags=SHF_ALLOC, entsize=0):
+        _align(out, alignment)
+        placed[name] = (len(out), len(data), sh_type, flags, alignment, entsize)
+        out.extend(data)
+
+    if interp:
+        place(".interp", SHT_PROGBITS, interp.encode() + b"\0", 1)
+    build_id = hashlib.sha1(
+        "\0".join([soname or "program"] + list(needed) + [n for n, _ in defined]).encode()
+    ).digest()
+    place(".note.gnu.build-id", SHT_NOTE, struct.pack("<III", 4, 20, 3) + b"GNU\0" + build_id, 4)
+    # .text comes before .dynsym so that the symbol values are known
+    place(".text", SHT_PROGBITS, b"\xc3" * 16, 16, SHF_ALLOC | SHF_EXECINSTR)
+    text_addr = placed[".text"][0]
+    section_order = (
+        [".interp"] if interp else []
+    ) + [".note.gnu.build-id", ".text", ".dynsym", ".dynstr", ".gnu.version"]
+    if verdef:
+        section_order.append(".gnu.version_d")
+    if verneed:
+        section_order.append(".gnu.version_r")
+    section_order += [".dynamic", ".shstrtab"]
+    text_index = section_order.index(".text") + 1
+    for i in range(defined_at, len(symbols)):
+        name_offset, _ = symbols[i]
+        symbols[i] = SYM.pack(
+            name_offset, STB_GLOBAL << 4 | STT_FUNC, 0, text_index, text_addr, 1
+        )
+    place(".dynsym", SHT_DYNSYM, b"".join(symbols), 8, entsize=SYM.size)
+    place(".dynstr", SHT_STRTAB, bytes(dynstr.data), 1)
+    place(".gnu.version", SHT_GNU_VERSYM, struct.pack(f"<{len(versyms)}H", *versyms), 2, entsize=2)
+    if verdef:
+        place(".gnu.version_d", SHT_GNU_VERDEF, bytes(verdef), 8)
+    if verneed:
+        place(".gnu.version_r", SHT_GNU_VERNEED, bytes(verneed), 8)
+
+    dynamic = [(DT_NEEDED, offset) for offset in needed_offsets]
+    if soname_offset is not None:
+        dynamic.append((DT_SONAME, soname_offset))
+    if runpath_offset is not None:
+        dynamic.append((DT_RUNPATH, runpath_offset))
+    dynamic += [
+        (DT_STRTAB, placed[".dynstr"][0]),
+        (DT_SYMTAB, placed[".dynsym"][0]),
+        (DT_STRSZ, len(dynstr.data)),
+        (DT_SYMENT, SYM.size),
+        (DT_VERSYM, placed[".gnu.version"][0]),
+    ]
+    if verdef:
+        dynamic += [(DT_VERDEF, placed[".gnu.version_d"][0]), (DT_VERDEFNUM, len(verdefs))]
+    if verneed:
+        dynamic += [(DT_VERNEED, placed[".gnu.version_r"][0]), (DT_VERNEEDNUM, len(verneeds))]
+    dynamic.append((DT_NULL, 0))
+    place(".dynamic", SHT_DYNAMIC, b"".join(DYN.pack(*d) for d in dynamic), 8, entsize=DYN.size)
+    for name in section_order:
+        names.add(name)
+    place(".shstrtab", SHT_STRTAB, bytes(names.data), 1, flags=0)
+
+    links = {
+        ".dynsym": ".dynstr",
+        ".gnu.version": ".dynsym",
+        ".gnu.version_d": ".dynstr",
+        ".gnu.version_r": ".dynstr",
+        ".dynamic": ".dynstr",
+    }
+    infos = {".dynsym": 1, ".gnu.version_d": len(verdefs), ".gnu.version_r": len(verneeds)}
+    _align(out, 8)
+    shoff = len(out)
+    out += SHDR.pack(0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+    for name in section_order:
+        offset, size, sh_type, flags, alignment, entsize = placed[name]
+        link = section_order.index(links[name]) + 1 if name in links else 0
+        out += SHDR.pack(
+            names.add(name), sh_type, flags, offset if flags else 0, offset, size,
+            link, infos.get(name, 0), alignment, entsize,
+        )
+
+    phdrs = list()
+    if interp:
+        offset, size = placed[".interp"][:2]
+        phdrs.append(PHDR.pack(PT_INTERP, 4, offset, offset, offset, size, size, 1))
+    phdrs.append(PHDR.pack(PT_LOAD, 5, 0, 0, 0, shoff, shoff, 0x1000))
+    offset, size = placed[".dynamic"][:2]
+    phdrs.append(PHDR.pack(PT_DYNAMIC, 6, offset, offset, offset, size, size, 8))
+    offset, size = placed[".note.gnu.build-id"][:2]
+    phdrs.append(PHDR.pack(PT_NOTE, 4, offset, offset, offset, size, size, 4))
+    out[EHDR.size:EHDR.size + PHDR.size * phnum] = b"".join(phdrs)
+
+    ident = b"\x7fELF" + bytes([2, 1, 1, 0]) + b"\0" * 8
+    out[:EHDR.size] = EHDR.pack(
+        ident, ET_DYN, MACHINES.get(ARCH, 62), 1, text_addr if interp else 0,
+        EHDR.size, shoff, 0, EHDR.size, PHDR.size, phnum, SHDR.size,
+        len(section_order) + 1, len(section_order),
+    )
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def _rpm_header(entries):
+    index = bytearray()
+    store = bytearray()
+    for tag, typ, value in entries:
+        if typ == RPM_INT16_TYPE:
+            _align(store, 2)
+            offset, count = len(store), len(value)
+            store += struct.pack(f">{count}H", *value)
+        elif typ == RPM_INT32_TYPE:
+            _align(store, 4)
+            offset, count = len(store), len(value)
+            store += struct.pack(f">{count}I", *value)
+        elif typ == RPM_STRING_TYPE:
+            offset, count = len(store), 1
+            store += value.encode() + b"\0"
+        else:
+            offset, count = len(store), len(value)
+            store += b"".join(v.encode() + b"\0" for v in value)
+        index += struct.pack(">IIiI", tag, typ, offset, count)
+    return (
+        b"\x8e\xad\xe8\x01\0\0\0\0"
+        + struct.pack(">II", len(entries), len(store))
+        + bytes(index)
+        + bytes(store)
+    )
+
+
+def _cpio(members):
+    out = bytearray()
+    for ino, (path, mode, data) in enumerate(members + [("TRAILER!!!", 0, b"")], 1):
+        name = ("." + path if path.startswith("/") else path).encode() + b"\0"
+        fields = (ino, mode, 0, 0, 1, 0, len(data), 0, 0, 0, 0, len(name), 0)
+        out += b"070701" + b"".join(b"%08x" % field for field in fields) + name
+        _align(out, 4)
+        out += data
+        _align(out, 4)
+    return bytes(out)
+
+
+def write_rpm(path, name, version, members, provides=()):
+    """Write a binary rpm of the (path, mode, data) members, symlinks
+    holding their target as data, with a gzip compressed cpio payload.
+    """
+    dirs = sorted(set(os.path.dirname(m[0]) + "/" for m in members))
+    entries = [
+        (RPMTAG_NAME, RPM_STRING_TYPE, name),
+        (RPMTAG_VERSION, RPM_STRING_TYPE, version),
+        (RPMTAG_RELEASE, RPM_STRING_TYPE, "1"),
+        (RPMTAG_SIZE, RPM_INT32_TYPE, [sum(len(m[2]) for m in members)]),
+        (RPMTAG_ARCH, RPM_STRING_TYPE, ARCH),
+        (RPMTAG_FILESIZES, RPM_INT32_TYPE, [len(m[2]) for m in members]),
+        (RPMTAG_FILEMODES, RPM_INT16_TYPE, [m[1] & 0xFFFF for m in members]),
+        (
+            RPMTAG_FILELINKTOS,
+            RPM_STRING_ARRAY_TYPE,
+            [m[2].decode() if stat.S_ISLNK(m[1]) else "" for m in members],
+        ),
+        (RPMTAG_PROVIDENAME, RPM_STRING_ARRAY_TYPE, list(provides) or [name]),
+        (
+            RPMTAG_DIRINDEXES,
+            RPM_INT32_TYPE,
+            [dirs.index(os.path.dirname(m[0]) + "/") for m in members],
+        ),
+        (RPMTAG_BASENAMES, RPM_STRING_ARRAY_TYPE, [os.path.basename(m[0]) for m in members]),
+        (RPMTAG_DIRNAMES, RPM_STRING_ARRAY_TYPE, dirs),
+        (RPMTAG_PAYLOADFORMAT, RPM_STRING_TYPE, "cpio"),
+        (RPMTAG_PAYLOADCOMPRESSOR, RPM_STRING_TYPE, "gzip"),
+    ]
+    # tag order matters to rpm, not to the readers used here
+    entries.sort(key=lambda entry: entry[0])
+    header = _rpm_header(entries)
+    payload = gzip.compress(_cpio(members), mtime=0)
+    signature = bytearray(
+        _rpm_header([(RPMSIGTAG_SIZE, RPM_INT32_TYPE, [len(header) + len(payload)])])
+    )
+    _align(signature, 8)
+    lead = bytearray(96)
+    lead[:4] = b"\xed\xab\xee\xdb"
+    lead[4:6] = b"\x03\x00"
+    lead[10:76] = name.encode()[:65].ljust(66, b"\0")
+    lead[78:80] = b"\x00\x05"
+    with open(path, "wb") as f:
+        f.write(bytes(lead) + bytes(signature) + header + payload)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _xml(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def write_repo(repo_dir, packages, revision):
+    """Write the repodata of the rpm files of packages below repo_dir, as
+    createrepo would: repomd.xml, primary.xml.gz and filelists.xml.gz.
+
+    packages are (location, name, version, files, provides).
+    """
+    primary = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<metadata xmlns="http://linux.duke.edu/metadata/common"'
+        ' xmlns:rpm="http://linux.duke.edu/metadata/rpm"'
+        f' packages="{len(packages)}">\n'
+    ]
+    filelists = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<filelists xmlns="http://linux.duke.edu/metadata/filelists"'
+        f' packages="{len(packages)}">\n'
+    ]
+    for location, name, version, files, provides in packages:
+        path = os.path.join(repo_dir, location)
+        pkgid = _sha256(path)
+        size = os.path.getsize(path)
+        entries = "".join(
+            f'<rpm:entry name="{_xml(p)}"/>' for p in provides
+        )
+        primary.append(
+            f'<package type="rpm"><name>{name}</name><arch>{ARCH}</arch>'
+            f'<version epoch="0" ver="{version}" rel="1"/>'
+            f'<checksum type="sha256" pkgid="YES">{pkgid}</checksum>'
+            f"<summary>{name}</summary><description>{name}</description>"
+            "<packager/><url/>"
+            f'<time file="{revision}" build="{revision}"/>'
+            f'<size package="{size}" installed="{size}" archive="{size}"/>'
+            f'<location href="{location}"/>'
+            "<format><rpm:license>GPLv3+</rpm:license><rpm:group>Unspecified</rpm:group>"
+            f"<rpm:provides>{entries}</rpm:provides></format></package>\n"
+        )
+        filelists.append(
+            f'<package pkgid="{pkgid}" name="{name}" arch="{ARCH}">'
+            f'<version epoch="0" ver="{version}" rel="1"/>'
+            + "".join(f"<file>{_xml(f)}</file>" for f in files)
+            + "</package>\n"
+        )
+    primary.append("</metadata>\n")
+    filelists.append("</filelists>\n")
+
+    repodata = os.path.join(repo_dir, "repodata")
+    os.makedirs(repodata, exist_ok=True)
+    data = list()
+    for md_type, content in (("primary", primary), ("filelists", filelists)):
+        raw = "".join(content).encode()
+        compressed = gzip.compress(raw, mtime=0)
+        href = f"repodata/{md_type}.xml.gz"
+        with open(os.path.join(repo_dir, href), "wb") as f:
+            f.write(compressed)
+        data.append(
+            f'<data type="{md_type}">'
+            f'<checksum type="sha256">{hashlib.sha256(compressed).hexdigest()}</checksum>'
+            f'<open-checksum type="sha256">{hashlib.sha256(raw).hexdigest()}</open-checksum>'
+            f'<location href="{href}"/><timestamp>{revision}</timestamp>'
+            f"<size>{len(compressed)}</size><open-size>{len(raw)}</open-size></data>\n"
+        )
+    with open(os.path.join(repodata, "repomd.xml"), "w") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<repomd xmlns="http://linux.duke.edu/metadata/repo"'
+            ' xmlns:rpm="http://linux.duke.edu/metadata/rpm">\n'
+            f"<revision>{revision}</revision>\n" + "".join(data) + "</repomd>\n"
+        )
+
+
+class Scale(object):
+    """A benchmark scale: sonames libraries exporting symbols functions in
+    total, all of them imported by the program. Compared to the old
+    release, the new one drops every removed_every-th function of a
+    library and adds as many in a new symbol version.
+    """
+
+    def __init__(self, sonames, symbols, removed_every=100):
+        self.sonames = sonames
+        self.symbols = symbols
+        self.removed_every = removed_every
+
+    @classmethod
+    def parse(cls, text):
+        """Parse "SONAMESxSYMBOLS", e.g. "100x100000"."""
+        sonames, _, symbols = text.lower().partition("x")
+        return cls(int(sonames), int(symbols))
+
+    @property
+    def name(self):
+        return f"{self.sonames}x{self.symbols}"
+
+    def soname(self, i):
+        return f"libbench{i}.so.1"
+
+    def functions(self, i):
+        """Return the functions of library i in the old release."""
+        count = self.symbols // self.sonames + (
+            1 if i < self.symbols % self.sonames else 0
+        )
+        return [f"bench{i}_func{j}" for j in range(max(count, 1))]
+
+    def library_symbols(self, i, side):
+        """Return the [(name, version)] library i exports on a side."""
+        functions = self.functions(i)
+        base = f"BENCH{i}_1.0"
+        if side == "old":
+            return [(name, base) for name in functions]
+        kept = [
+            (name, base)
+            for j, name in enumerate(functions)
+            if (j + 1) % self.removed_every
+        ]
+        added = len(functions) - len(kept)
+        return kept + [(f"bench{i}_new{j}", f"BENCH{i}_2.0") for j in range(added)]
+
+
+def _header(i, symbols):
+    guard = f"BENCH{i}_H"
+    lines = [f"#ifndef {guard}", f"#define {guard}", ""]
+    lines += [f"int {name}(int value);" for name, _ in symbols]
+    lines += ["", f"#endif /* {guard} */", ""]
+    return "\n".join(lines).encode()
+
+
+def write_side(root, scale, side):
+    """Write the library and devel packages and the repo of one side into
+    root/<side>/repo, return the repo directory.
+    """
+    version = PACKAGE_VERSIONS[side]
+    repo_dir = os.path.join(root, side, "repo")
+    build_dir = os.path.join(root, side, "build")
+    os.makedirs(os.path.join(repo_dir, "Packages"), exist_ok=True)
+    os.makedirs(build_dir, exist_ok=True)
+    # the libraries are ELF64, so their provides carry the 64bit marker
+    suffix = "()(64bit)"
+    packages = list()
+    for i in range(scale.sonames):
+        soname = scale.soname(i)
+        symbols = scale.library_symbols(i, side)
+        lib = os.path.join(build_dir, soname)
+        write_elf(lib, soname=soname, defined=symbols)
+        with open(lib, "rb") as f:
+            lib_data = f.read()
+        versions = sorted(set(v for _, v in symbols))
+        name = f"bench{i}"
+
+        libs = f"{name}-libs"
+        members = [(f"/usr/lib64/{soname}", stat.S_IFREG | 0o755, lib_data)]
+        provides = [libs, f"{soname}{suffix}"] + [
+            f"{soname}({v}){suffix}" for v in versions
+        ]
+        location = f"Packages/{libs}-{version}-1.{ARCH}.rpm"
+        write_rpm(os.path.join(repo_dir, location), libs, version, members, provides)
+        packages.append((location, libs, version, [m[0] for m in members], provides))
+
+        devel = f"{name}-devel"
+        members = [
+            (f"/usr/include/{name}.h", stat.S_IFREG | 0o644, _header(i, symbols)),
+            (f"/usr/lib64/libbench{i}.so", stat.S_IFLNK | 0o777, soname.encode()),
+        ]
+        location = f"Packages/{devel}-{version}-1.{ARCH}.rpm"
+        write_rpm(os.path.join(repo_dir, location), devel, version, members, [devel])
+        packages.append((location, devel, version, [m[0] for m in members], [devel]))
+    write_repo(repo_dir, packages, revision=1)
+    return repo_dir
+
+
+def write_program(root, scale):
+    """Write the program importing every old release function, with its
+    libraries next to it as they were installed on the old release.
+    """
+    bin_dir = os.path.join(root, "program", "bin")
+    lib_dir = os.path.join(root, "program", "lib")
+    os.makedirs(bin_dir, exist_ok=True)
+    os.makedirs(lib_dir, exist_ok=True)
+    needed = list()
+    undefined = list()
+    for i in range(scale.sonames):
+        soname = scale.soname(i)
+        needed.append(soname)
+        symbols = scale.library_symbols(i, "old")
+        write_elf(os.path.join(lib_dir, soname), soname=soname, defined=symbols)
+        undefined += [(name, version, soname) for name, version in symbols]
+    program = os.path.join(bin_dir, "bench")
+    write_elf(
+        program,
+        needed=needed,
+        runpath="$ORIGIN/../lib",
+        undefined=undefined,
+        interp=INTERP.get(ARCH, INTERP["x86_64"]),
+    )
+    os.chmod(program, 0o755)
+    return program
+
+
+def write_dnf_conf(path, name, repo_dir):
+    with open(path, "w") as f:
+        f.write(
+            "[main]\n"
+            "gpgcheck=0\n"
+            "best=True\n"
+            "skip_if_unavailable=False\n"
+            "reposdir=/dev/null\n"
+            "\n"
+            f"[{name}]\n"
+            f"name = {name}\n"
+            f"baseurl = file://{os.path.abspath(repo_dir)}/\n"
+        )
+
+
+def generate(root, scale, release):
+    """Write every input of a scale below root and return (program, data
+    dir holding the old release dnf config, new OS dnf config).
+    """
+    old_repo = write_side(root, scale, "old")
+    new_repo = write_side(root, scale, "new")
+    program = write_program(root, scale)
+
+    data_dir = os.path.join(root, "data")
+    conf_dir = os.path.join(data_dir, "conf", ARCH)
+    os.makedirs(conf_dir, exist_ok=True)
+    write_dnf_conf(os.path.join(conf_dir, f"{release}.conf"), "bench-old", old_repo)
+    new_conf = os.path.join(root, "new.conf")
+    write_dnf_conf(new_conf, "bench-new", new_repo)
+    return program, data_dir, new_conf